@@ -0,0 +1,80 @@
+'''
+
+Benchmark for the infobox extraction in wiki_city_data.py.
+
+Compares the full article parse (parse_infobox_full, the original parse_infobox path) with the fast path (parse_infobox_fast, which only parses
+the infobox template span and normalizes the values in the same pass) on the wikitext of a few large city articles.
+The wikitext is downloaded once and kept in the wiki_benchmark_pages folder so later runs are offline and comparable.
+
+usage: python benchmark_infobox_parsing.py [page title ...]
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from wiki_city_data import WikiCityDataResearcher, parse_infobox_fast, parse_infobox_full
+import os
+import statistics
+import sys
+import time
+
+# GLOBALS ##############################################################################################################################
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+benchmark_pages_folder = os.path.join(script_directory, 'wiki_benchmark_pages')
+
+# large city articles (hundreds of KB of wikitext) are where the full parse hurts the most
+default_titles = ['New York City', 'Chicago', 'Los Angeles', 'San Francisco', 'Houston', 'London', 'Paris', 'Tokyo']
+
+repeats = 5
+
+# FUNCTIONS ###################################################################################################################################
+
+def load_benchmark_wikitext(titles):
+    if not os.path.exists(benchmark_pages_folder):
+        os.makedirs(benchmark_pages_folder)
+    researcher = WikiCityDataResearcher()
+    pages = {}
+    for title in titles:
+        file_path = os.path.join(benchmark_pages_folder, f"{title.replace(' ', '_').replace('/', '_')}.wiki")
+        if not os.path.exists(file_path):
+            wikitext = researcher.fetch_wikitext(title)
+            if wikitext is None:
+                print(f"Skipping {title}, the wikitext could not be fetched")
+                continue
+            with open(file_path, 'w', encoding='utf-8') as file:
+                file.write(wikitext)
+        with open(file_path, 'r', encoding='utf-8') as file:
+            pages[title] = file.read()
+    return pages
+
+def time_parser(parser, wikitext, normalize):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parser(wikitext, normalize)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+# MAIN EXECUTION ###################################################################################################################################
+
+if __name__ == "__main__":
+    titles = sys.argv[1:] or default_titles
+    pages = load_benchmark_wikitext(titles)
+
+    print(f"\n{'page':<20} {'size KB':>8} {'full parse ms':>14} {'fast path ms':>13} {'speedup':>8}  same raw fields")
+    total_full = 0.0
+    total_fast = 0.0
+    for title, wikitext in pages.items():
+        # the old path returned the raw values, so it is timed without normalization
+        full_seconds = time_parser(parse_infobox_full, wikitext, False)
+        fast_seconds = time_parser(parse_infobox_fast, wikitext, True)
+        total_full += full_seconds
+        total_fast += fast_seconds
+        # the fast path has to find the same template as the full parse
+        fast_raw = parse_infobox_fast(wikitext, False)
+        same_fields = fast_raw is None or fast_raw == parse_infobox_full(wikitext, False)
+        print(f"{title:<20} {len(wikitext) / 1024:>8.0f} {full_seconds * 1000:>14.1f} {fast_seconds * 1000:>13.2f} {full_seconds / max(fast_seconds, 1e-9):>7.0f}x  "
+              f"{same_fields if fast_raw is not None else 'fallback to full parse'}")
+
+    if pages:
+        print(f"\nTotal: full parse {total_full * 1000:.1f} ms, fast path {total_fast * 1000:.2f} ms ({total_full / max(total_fast, 1e-9):.0f}x) over {len(pages)} pages, median of {repeats} runs")
@@ -0,0 +1,135 @@
+'''
+
+Benchmark for the compact place records in place_model.py.
+
+Loads the restaurant_data_*.json files of the reports folder the way google_api_model_data.py combines them, once as nested dicts (json.load of
+every file into one combined dict) and once as Place records (read_places_json), and reports the tracemalloc peak and the time of each.
+The Place records are checked to convert back to the same dicts.
+
+Without report files (or with --synthetic N) it generates N synthetic places shaped like the place details records (5 reviews, address
+components, opening hours periods) into the place_benchmark_reports folder next to this script, so the runs are comparable.
+
+usage: python benchmark_place_model.py [--synthetic N]
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from place_model import read_places_json
+import gc
+import glob
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# GLOBALS ##############################################################################################################################
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+reports_folder = 'reports'
+synthetic_reports_folder = os.path.join(script_directory, 'place_benchmark_reports')
+
+places_per_synthetic_file = 2000
+review_words = ('great food friendly staff amazing pasta slow service cozy atmosphere would come back again the best tacos in town '
+                'overpriced but worth it lovely patio brunch was busy waited forty minutes for a table delicious cocktails').split()
+
+# FUNCTIONS ###################################################################################################################################
+
+def synthetic_place(index):
+    day_periods = [{'open': {'day': day, 'time': '1130'}, 'close': {'day': day, 'time': '2200'}} for day in range(7)]
+    return {
+        'place_id': f"ChIJsynthetic{index:08d}",
+        'name': f"Synthetic Restaurant {index}",
+        'business_status': 'OPERATIONAL',
+        'types': random.choice([['restaurant', 'food', 'point_of_interest', 'establishment'],
+                                ['bar', 'restaurant', 'food', 'point_of_interest', 'establishment'],
+                                ['meal_takeaway', 'restaurant', 'food', 'point_of_interest', 'establishment']]),
+        'rating': round(random.uniform(3, 5), 1),
+        'user_ratings_total': random.randint(10, 5000),
+        'price_level': random.randint(1, 4),
+        'formatted_address': f"{index} Broadway, New York, NY 10024, USA",
+        'website': f"https://restaurant{index}.example.com/",
+        'url': f"https://maps.google.com/?cid={index}",
+        'international_phone_number': '+1 212-555-0100',
+        'utc_offset': -300,
+        'geometry': {'location': {'lat': 40.7 + random.random() / 10, 'lng': -74 + random.random() / 10},
+                     'viewport': {'northeast': {'lat': 40.8, 'lng': -73.9}, 'southwest': {'lat': 40.7, 'lng': -74.0}}},
+        'plus_code': {'compound_code': 'Q2RG+CC New York, NY, USA', 'global_code': '87G8Q2RG+CC'},
+        'address_components': [{'long_name': name, 'short_name': name[:3], 'types': ['political']}
+                               for name in [str(index), 'Broadway', 'Manhattan', 'New York', 'New York County', 'New York', 'United States', '10024']],
+        'opening_hours': {'open_now': True, 'periods': day_periods,
+                          'weekday_text': [f"{day}: 11:30 AM – 10:00 PM" for day in
+                                           ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']]},
+        'reviews': [{'author_name': f"Reviewer {index}-{number}", 'author_url': f"https://www.google.com/maps/contrib/{index}{number}/reviews",
+                     'language': 'en', 'original_language': 'en', 'profile_photo_url': f"https://lh3.googleusercontent.com/a/{index}{number}=s128",
+                     'rating': random.randint(1, 5), 'relative_time_description': 'a month ago',
+                     'text': ' '.join(random.choices(review_words, k=random.randint(20, 120))), 'time': 1700000000 + index + number, 'translated': False}
+                    for number in range(5)],
+        'editorial_summary': {'language': 'en', 'overview': 'Family style italian classics in a lively dining room.'},
+        'reservable': True, 'dine_in': True, 'serves_lunch': True, 'serves_dinner': True, 'serves_wine': True, 'serves_beer': True,
+        'serves_breakfast': False, 'serves_brunch': True, 'serves_vegetarian_food': True, 'wheelchair_accessible_entrance': True,
+        'last_updated': '2024-02-06T19:17:13.901102',
+        'crow_fly_distance_km': round(random.uniform(0, 30), 2),
+    }
+
+def write_synthetic_reports(place_count):
+    if not os.path.exists(synthetic_reports_folder):
+        os.makedirs(synthetic_reports_folder)
+    for file_path in glob.glob(os.path.join(synthetic_reports_folder, 'restaurant_data_*.json')):
+        os.remove(file_path)
+    random.seed(0)
+    for file_number, start in enumerate(range(0, place_count, places_per_synthetic_file)):
+        places = {f"ChIJsynthetic{index:08d}": synthetic_place(index) for index in range(start, min(start + places_per_synthetic_file, place_count))}
+        with open(os.path.join(synthetic_reports_folder, f"restaurant_data_synthetic_{file_number}.json"), 'w') as file:
+            json.dump(places, file, indent=4)
+    return sorted(glob.glob(os.path.join(synthetic_reports_folder, 'restaurant_data_*.json')))
+
+def combine_as_dicts(file_paths):
+    combined = {}
+    for file_path in file_paths:
+        with open(file_path, 'r') as file:
+            data = json.load(file)
+        for place_id, details in data.items():
+            if isinstance(details, dict):
+                combined[place_id] = details
+    return combined
+
+def combine_as_places(file_paths):
+    combined = {}
+    for file_path in file_paths:
+        combined.update(read_places_json(file_path))
+    return combined
+
+def measure(loader, file_paths):
+    '''returns (result, tracemalloc peak MB, current MB once loaded, seconds)'''
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = loader(file_paths)
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak / 1e6, current / 1e6, seconds
+
+# MAIN EXECUTION ###################################################################################################################################
+
+if __name__ == "__main__":
+    synthetic_count = int(sys.argv[sys.argv.index('--synthetic') + 1]) if '--synthetic' in sys.argv else 0
+    file_paths = [] if synthetic_count else sorted(glob.glob(os.path.join(reports_folder, 'restaurant_data_*.json')))
+    if not file_paths:
+        file_paths = write_synthetic_reports(synthetic_count or 20000)
+
+    dicts, dict_peak, dict_current, dict_seconds = measure(combine_as_dicts, file_paths)
+    sample = {place_id: dicts[place_id] for place_id in random.sample(list(dicts), min(500, len(dicts)))}
+    place_count = len(dicts)
+    del dicts
+    places, place_peak, place_current, place_seconds = measure(combine_as_places, file_paths)
+    same_records = all(places[place_id].to_dict() == details for place_id, details in sample.items())
+
+    print(f"\n{place_count} places from {len(file_paths)} files")
+    print(f"{'model':<14} {'peak MB':>9} {'held MB':>9} {'load s':>8}")
+    print(f"{'nested dicts':<14} {dict_peak:>9.1f} {dict_current:>9.1f} {dict_seconds:>8.2f}")
+    print(f"{'Place':<14} {place_peak:>9.1f} {place_current:>9.1f} {place_seconds:>8.2f}")
+    print(f"\nPeak memory {dict_peak / max(place_peak, 1e-9):.1f}x lower, held memory {dict_current / max(place_current, 1e-9):.1f}x lower, "
+          f"records convert back to the same dicts: {same_records}")
@@ -0,0 +1,137 @@
+'''
+
+This module holds a small pool of reusable headless Chrome sessions for the pages that only render their content with javascript.
+
+Starting a browser costs seconds, so the sessions are created lazily (up to pool_size), handed out through a queue and reused for many pages.
+A session is quit and replaced after max_pages_per_browser pages (long lived browsers leak memory) or after any webdriver error.
+render() is blocking, the async crawler runs it in a thread executor with pool_size workers so the browsers never block the event loop.
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+import logging
+import queue
+import threading
+import time
+
+# CLASSES ###################################################################################################################################
+
+class HeadlessBrowserPool:
+    def __init__(self, pool_size=2, max_pages_per_browser=50, page_load_timeout=30, render_wait_seconds=3, user_agent=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.pool_size = pool_size
+        self.max_pages_per_browser = max_pages_per_browser
+        self.page_load_timeout = page_load_timeout
+        self.render_wait_seconds = render_wait_seconds
+        self.user_agent = user_agent
+        self.idle_browsers = queue.Queue()
+        self.lock = threading.Lock()
+        self.browsers_created = 0
+        self.browsers_alive = 0
+        self.pages_rendered = 0
+        self.render_seconds = 0.0
+        self.startup_seconds = 0.0
+
+    def create_browser(self):
+        started = time.perf_counter()
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless=new')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--no-sandbox')
+        options.add_argument('--disable-dev-shm-usage')
+        # images are never needed to find the menu links and are most of the page weight
+        options.add_argument('--blink-settings=imagesEnabled=false')
+        if self.user_agent:
+            options.add_argument(f'--user-agent={self.user_agent}')
+        driver = webdriver.Chrome(options=options)
+        driver.set_page_load_timeout(self.page_load_timeout)
+        with self.lock:
+            self.browsers_created += 1
+            self.startup_seconds += time.perf_counter() - started
+        self.logger.info(f"{self.create_browser.__name__} - Started headless browser #{self.browsers_created}")
+        return {'driver': driver, 'pages': 0}
+
+    def acquire(self):
+        try:
+            return self.idle_browsers.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            can_create = self.browsers_alive < self.pool_size
+            if can_create:
+                self.browsers_alive += 1
+        if can_create:
+            try:
+                return self.create_browser()
+            except WebDriverException:
+                with self.lock:
+                    self.browsers_alive -= 1
+                raise
+        # all browsers are busy, wait for one to come back
+        return self.idle_browsers.get()
+
+    def release(self, browser, broken=False):
+        if broken or browser['pages'] >= self.max_pages_per_browser:
+            # recycle: quit this session, the next acquire starts a fresh one
+            self.quit_browser(browser)
+            with self.lock:
+                self.browsers_alive -= 1
+            return
+        self.idle_browsers.put(browser)
+
+    def quit_browser(self, browser):
+        try:
+            browser['driver'].quit()
+        except WebDriverException as e:
+            self.logger.warning(f"{self.quit_browser.__name__} - Error quitting browser: {e}")
+
+    def render(self, url):
+        '''returns (final url, rendered html) or (url, None) when the page could not be rendered'''
+        browser = self.acquire()
+        started = time.perf_counter()
+        broken = False
+        try:
+            driver = browser['driver']
+            driver.get(url)
+            WebDriverWait(driver, self.render_wait_seconds).until(lambda d: d.execute_script('return document.readyState') == 'complete')
+            return driver.current_url, driver.page_source
+        except TimeoutException:
+            # whatever rendered so far is still worth parsing
+            try:
+                return browser['driver'].current_url, browser['driver'].page_source
+            except WebDriverException:
+                broken = True
+                return url, None
+        except WebDriverException as e:
+            self.logger.warning(f"{self.render.__name__} - Error rendering {url}: {e}")
+            broken = True
+            return url, None
+        finally:
+            browser['pages'] += 1
+            with self.lock:
+                self.pages_rendered += 1
+                self.render_seconds += time.perf_counter() - started
+            self.release(browser, broken)
+
+    def metrics(self):
+        pages = max(self.pages_rendered, 1)
+        return {
+            'browsers_created': self.browsers_created,
+            'pages_rendered': self.pages_rendered,
+            'seconds_per_page': round(self.render_seconds / pages, 3),
+            # the browser start up time spread over the pages it served
+            'startup_seconds_per_page': round(self.startup_seconds / pages, 3),
+        }
+
+    def close(self):
+        while True:
+            try:
+                browser = self.idle_browsers.get_nowait()
+            except queue.Empty:
+                break
+            self.quit_browser(browser)
+            with self.lock:
+                self.browsers_alive -= 1
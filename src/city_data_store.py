@@ -0,0 +1,129 @@
+'''
+
+This module keeps the city level dataset used by city_data_wikipedia.py and city_level_data_feed.py.
+
+The store is keyed by city name and every record holds the geocoded context (state / country), the parsed Wikipedia infobox, the population and
+economic figures pulled out of the infobox, and a last_updated timestamp. A city is only fetched again when it is missing, older than the
+data_shelf_life (in days, the same idea as AddressResearcher.data_shelf_life for the place details) or when its last fetch found no infobox (a
+failed request is retried on the next run rather than kept empty for the whole shelf life).
+
+The records are written to address_city_level_data.json after every batch of cities (atomically, through a temp file + os.replace) so an
+interrupted run keeps everything fetched so far, and a flat Parquet copy (one row per city, figures as columns) is written next to it for analysis.
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import pandas as pd
+
+# CONSTANTS ###################################################################################################################################
+
+# infobox fields (after the wiki_city_data normalization) that become the figure columns
+POPULATION_FIELD_PREFIXES = ('population', 'pop_')
+ECONOMIC_FIELD_PREFIXES = ('gdp', 'income', 'median_household_income', 'per_capita_income', 'unemployment', 'poverty')
+AREA_FIELD_PREFIXES = ('area_', 'elevation_')
+
+DEFAULT_DATA_SHELF_LIFE = 30  # Days
+
+# FUNCTIONS ###################################################################################################################################
+
+def extract_city_figures(infobox):
+    '''returns the numeric population / economic / area fields of a parsed infobox, the text fields stay in the infobox'''
+    figures = {}
+    for key, value in (infobox or {}).items():
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            continue
+        if key.startswith(POPULATION_FIELD_PREFIXES + ECONOMIC_FIELD_PREFIXES + AREA_FIELD_PREFIXES):
+            figures[key] = value
+    return figures
+
+def write_json_atomic(data, file_path):
+    # write to a temp file in the same folder and swap it in, a crash mid write never leaves a truncated json behind
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=4)
+    os.replace(temp_path, file_path)
+
+# CLASSES ###################################################################################################################################
+
+class CityDataStore:
+    def __init__(self, json_path, parquet_path=None, data_shelf_life=DEFAULT_DATA_SHELF_LIFE):
+        self.json_path = json_path
+        self.parquet_path = parquet_path
+        self.data_shelf_life = data_shelf_life  # Days
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.data = self.load()
+
+    def load(self):
+        if os.path.exists(self.json_path):
+            with open(self.json_path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        return {}
+
+    def is_stale(self, city):
+        record = self.data.get(city)
+        # a city whose infobox fetch failed (or found no infobox) is fetched again on the next run instead of waiting out the shelf life
+        if not record or not record.get('infobox_found'):
+            return True
+        # records without a usable timestamp are treated as expired, the same fallback the place details use
+        try:
+            last_updated = datetime.fromisoformat(record.get('last_updated', '1970-01-01T00:00:00'))
+        except ValueError:
+            last_updated = datetime(1970, 1, 1)
+        return datetime.now() - last_updated >= timedelta(days=self.data_shelf_life)
+
+    def cities_to_fetch(self, cities):
+        '''returns the cities that are missing from the store or past the shelf life, in the original order'''
+        return [city for city in cities if self.is_stale(city)]
+
+    def update_city(self, city, context, infobox):
+        self.data[city] = {
+            'city': city,
+            'state': context.get('state'),
+            'country': context.get('country'),
+            'infobox_found': bool(infobox),
+            'figures': extract_city_figures(infobox),
+            'infobox': infobox or {},
+            'last_updated': datetime.now().isoformat(),
+        }
+
+    def to_frame(self):
+        '''one row per city with the figures as columns and the full infobox as a json string'''
+        rows = []
+        for city, record in self.data.items():
+            row = {
+                'city': city,
+                'state': record.get('state'),
+                'country': record.get('country'),
+                'infobox_found': record.get('infobox_found', False),
+                'last_updated': record.get('last_updated'),
+            }
+            row.update(record.get('figures', {}))
+            row['infobox_json'] = json.dumps(record.get('infobox', {}), default=str)
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def save(self):
+        write_json_atomic(self.data, self.json_path)
+        if self.parquet_path:
+            temp_path = f"{self.parquet_path}.tmp"
+            self.to_frame().to_parquet(temp_path, index=False)
+            os.replace(temp_path, self.parquet_path)
+        self.logger.info(f"{self.save.__name__} - {len(self.data)} cities saved to {self.json_path}")
+
+    def refresh(self, city_contexts, fetch_infoboxes, batch_size=25):
+        '''fetches the missing / stale cities with fetch_infoboxes({city: context}) -> {city: infobox or None} in batches and saves after each
+        batch, so a rerun only picks up where the last one stopped. returns the list of cities that were fetched'''
+        cities = self.cities_to_fetch(list(city_contexts))
+        print(f"{len(city_contexts) - len(cities)} cities are fresh in {os.path.basename(self.json_path)}, fetching {len(cities)} cities")
+        for start in range(0, len(cities), batch_size):
+            batch = {city: city_contexts[city] for city in cities[start:start + batch_size]}
+            infoboxes = fetch_infoboxes(batch)
+            for city, context in batch.items():
+                self.update_city(city, context, infoboxes.get(city))
+            self.save()
+            print(f"Saved {min(start + batch_size, len(cities))}/{len(cities)} cities")
+        return cities
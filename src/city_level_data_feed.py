@@ -1,6 +1,7 @@
 # IMPORTS ###################################################################################################################################
 
 from bs4 import BeautifulSoup
+from city_data_store import CityDataStore
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from fake_useragent import UserAgent
@@ -19,6 +20,7 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
 from tqdm import tqdm
 from urllib.parse import urlparse, urljoin
+from wiki_city_data import WikiCityDataResearcher
 import asyncio
 import certifi
 import difflib
@@ -51,66 +53,29 @@ ROOT = os.getenv('ROOT')
 FILE_DROP_PATH = os.getenv('FILE_DROP_PATH')
 if not os.path.exists(FILE_DROP_PATH):
     os.makedirs(FILE_DROP_PATH)
+# optional local pages-articles dump (.xml.bz2 / .xml.gz / .xml), when set the city data is read offline from the dump instead of the api
+WIKI_DUMP_PATH = os.getenv('WIKI_DUMP_PATH')
 
 # define script directory
 script_directory = os.path.dirname(os.path.abspath(__file__))
 
-# CLASSES ###################################################################################################################################
-
-class WikiCityDataResearcher:
-    def __init__(self):
-        self.session = requests.Session()
-
-    def fetch_wikipedia_data(self, search_phrase):
-        print(f"Fetching Wikipedia data for: {search_phrase}")
-        
-        # Define the URL and parameters for the API request to get the raw wikitext
-        url = "https://en.wikipedia.org/w/api.php"
-        params = {
-            "action": "parse",
-            "page": search_phrase,
-            "format": "json",
-            "prop": "wikitext",
-            "redirects": True,
-        }
-
-        response = self.session.get(url=url, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            wikitext = data["parse"]["wikitext"]["*"]
-            return self.parse_infobox(wikitext)
-        else:
-            print(f"Failed to fetch data for {search_phrase}")
-            return None
-
-    def parse_infobox(self, wikitext):
-        print("Parsing wikitext to find the infobox...")
-        parsed_wikitext = mwparserfromhell.parse(wikitext)
-
-        for template in parsed_wikitext.filter_templates():
-            template_name = str(template.name).strip()
-            if "infobox" in template_name.lower():
-                print("Infobox template found. Extracting data...")
-                infobox_data = {str(param.name).strip(): str(param.value).strip() for param in template.params}
-                return infobox_data
-
-        print("No infobox found.")
-        return None
-
 # MAIN EXECUTION ###################################################################################################################################
 
 # open the address_secrets_restaurants.json file
 with open(f'{script_directory}/address_secrets_restaurants.json', 'r') as file:
     restaurant_data_objects = json.load(file)
 
-# Initialize an empty list to hold the cities
+# Initialize an empty list to hold the cities and a dictionary for the geocoded state / country of each city
 cities = []
+city_contexts = {}
 
 # Iterate through the restaurant_data_objects and extract the "city" field for each location
 for location, details in restaurant_data_objects.items():
     city = details.get("city")  # Extract the city from the details
     if city and city not in cities:  # Check if city is not empty and not already in the list
         cities.append(city)
+        # the state and country are used to pick the right page when the city name is ambiguous
+        city_contexts[city] = {"state": details.get("state"), "country": details.get("country")}
 
 # initialize a list of cities that did not return results
 failed_search_cities = []
@@ -120,12 +85,28 @@ for city in cities:
     print(city)
     
 # Usage
-researcher = WikiCityDataResearcher()
-
-# Loop through each city and fetch Wikipedia infobox data
+# the city -> page title decisions (including the resolved disambiguation pages) are saved so later runs go straight to the right page
+# the parsed infoboxes are cached by page revision, unchanged pages are only re-checked once the cache ttl has passed
+researcher = WikiCityDataResearcher(title_map_path=f'{script_directory}/wiki_city_title_map.json',
+                                    infobox_cache_path=f'{script_directory}/wiki_infobox_cache.json',
+                                    cache_ttl_days=7)
+
+# the city level dataset is keyed by city and saved after every batch, reruns only fetch the missing cities and the ones past the shelf life
+city_data_store = CityDataStore(f'{script_directory}/address_city_level_data.json',
+                                parquet_path=f'{script_directory}/address_city_level_data.parquet',
+                                data_shelf_life=30)
+
+if WIKI_DUMP_PATH:
+    # offline mode: one streaming pass over the local dump, no api calls and no rate limits
+    # (the whole list goes in one batch since every batch is a full pass over the dump)
+    city_data_store.refresh(city_contexts, lambda batch: researcher.fetch_city_infoboxes_from_dump(WIKI_DUMP_PATH, batch), batch_size=len(city_contexts) or 1)
+else:
+    # Fetch the Wikipedia infobox data in batches (title resolution + disambiguation scoring + concurrent wikitext fetches)
+    city_data_store.refresh(city_contexts, researcher.fetch_city_infoboxes)
+
+# Loop through each city and print the Wikipedia infobox data
 for city in cities:
-    print(f"\nFetching data for: {city}")
-    wikipedia_infobox_data = researcher.fetch_wikipedia_data(city)
+    wikipedia_infobox_data = city_data_store.data.get(city, {}).get('infobox')
     
     # Check if infobox data was found and print it
     if wikipedia_infobox_data:
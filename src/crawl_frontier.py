@@ -0,0 +1,159 @@
+'''
+
+This module holds the crawl frontier of the menu crawler (menu_crawler.py): URL canonicalization, the seen URL filter and the prioritized queue of
+URLs still to visit.
+
+    - canonicalize_url drops fragments, tracking parameters (utm_*, fbclid, gclid, ...), default ports and empty query values, lower cases the scheme
+      and host and sorts the query, so the same page reached through different links is one URL. url_fingerprint additionally ignores http vs https,
+      www. and a trailing slash, it is the key used for the dedup
+    - the seen filter is a Bloom filter: a fixed size bit array (sized from the expected number of URLs and the false positive rate) instead of a set
+      of strings, so memory stays flat for millions of URLs. a false positive only skips a page, it never crawls one twice. the filter lives for
+      one run and its keys are scoped to the crawl that queued the url (crawl id + url fingerprint), so it only keeps a crawl from downloading the
+      same page twice: two crawls on the same host dedup independently and a recrawl in a later run visits every page again
+    - the pending URLs are kept in one heap per crawl (the crawl id, e.g. the website fingerprint of menu_crawler.py, not the host: two crawls of
+      the same host never pop or drop each other's urls) ordered by priority (likely menu paths first, then shallow pages), the total number of
+      pending URLs is capped by max_pending and the lowest priority URLs are dropped first when the cap is hit
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from urllib.parse import urlparse, urlunparse, urljoin, parse_qsl, urlencode
+import hashlib
+import heapq
+import itertools
+import logging
+import math
+
+# CONSTANTS ###################################################################################################################################
+
+TRACKING_QUERY_PARAMETERS = {'fbclid', 'gclid', 'gclsrc', 'dclid', 'msclkid', 'yclid', 'igshid', 'mc_cid', 'mc_eid', '_ga', '_gl', '_hsenc', '_hsmi',
+                             'ref', 'ref_src', 'source', 'spm', 'hsCtaTracking', 'trk', 'sessionid', 'sid', 'phpsessid', 'jsessionid'}
+TRACKING_QUERY_PREFIXES = ('utm_', 'pk_', 'mtm_', 'hsa_', 'oly_')
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+DEFAULT_FRONTIER_CAPACITY = 5_000_000  # URLs the seen filter is sized for
+DEFAULT_FALSE_POSITIVE_RATE = 0.001
+DEFAULT_MAX_PENDING = 100_000
+
+# FUNCTIONS ###################################################################################################################################
+
+def canonicalize_url(url, base_url=None):
+    '''returns the canonical form of the (optionally relative) url, or None for anything that is not an http(s) url'''
+    if base_url:
+        url = urljoin(base_url, url)
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parsed.hostname:
+        return None
+    host = parsed.hostname.lower().rstrip('.')
+    netloc = host if parsed.port in (None, DEFAULT_PORTS[scheme]) else f"{host}:{parsed.port}"
+    path = parsed.path or '/'
+    while '//' in path:
+        path = path.replace('//', '/')
+    query = [(key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=False)
+             if key.lower() not in TRACKING_QUERY_PARAMETERS and not key.lower().startswith(TRACKING_QUERY_PREFIXES)]
+    return urlunparse((scheme, netloc, path, '', urlencode(sorted(query)), ''))
+
+def url_fingerprint(url):
+    '''dedup key of a canonical url: http / https, www. and a trailing slash do not make a different page'''
+    parsed = urlparse(url)
+    host = parsed.netloc[4:] if parsed.netloc.startswith('www.') else parsed.netloc
+    path = parsed.path.rstrip('/') or '/'
+    return f"{host}{path}?{parsed.query}" if parsed.query else f"{host}{path}"
+
+# CLASSES ###################################################################################################################################
+
+class BloomFilter:
+    '''fixed memory set membership with false positives (never false negatives), sized for capacity items at false_positive_rate'''
+    def __init__(self, capacity=DEFAULT_FRONTIER_CAPACITY, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.bit_count = max(8, int(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.item_count = 0
+
+    def bit_positions(self, item):
+        # double hashing: the k positions are derived from two 64 bit halves of one digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.bit_count for i in range(self.hash_count)]
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.bit_positions(item))
+
+    def add(self, item):
+        '''adds the item, returns False when it was (probably) already in the filter'''
+        added = False
+        for position in self.bit_positions(item):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        if added:
+            self.item_count += 1
+        return added
+
+class CrawlFrontier:
+    def __init__(self, capacity=DEFAULT_FRONTIER_CAPACITY, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE, max_pending=DEFAULT_MAX_PENDING):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.max_pending = max_pending
+        self.seen = BloomFilter(capacity, false_positive_rate)
+        self.pending = {}
+        self.pending_count = 0
+        self.dropped_count = 0
+        self.duplicate_count = 0
+        self.sequence = itertools.count()
+
+    def seen_key(self, crawl, url):
+        return f"{crawl} {url_fingerprint(url)}"
+
+    def has_seen(self, crawl, url):
+        return self.seen_key(crawl, url) in self.seen
+
+    def mark_seen(self, crawl, url):
+        '''returns False when the url was already seen by the crawl'''
+        return self.seen.add(self.seen_key(crawl, url))
+
+    def push(self, crawl, url, depth, priority):
+        '''queues a canonical url for the crawl unless the crawl saw it before, higher priority urls are popped first'''
+        if not self.mark_seen(crawl, url):
+            self.duplicate_count += 1
+            return False
+        heapq.heappush(self.pending.setdefault(crawl, []), (-priority, depth, next(self.sequence), url))
+        self.pending_count += 1
+        if self.pending_count > self.max_pending:
+            self.drop_lowest_priority()
+        return True
+
+    def pop(self, crawl):
+        '''returns (url, depth) of the best pending url of the crawl, or None when the crawl has nothing left'''
+        heap = self.pending.get(crawl)
+        if not heap:
+            self.pending.pop(crawl, None)
+            return None
+        _, depth, _, url = heapq.heappop(heap)
+        self.pending_count -= 1
+        return url, depth
+
+    def drop_crawl(self, crawl):
+        '''forgets the pending urls of a finished crawl (page budget spent), they stay in the seen filter'''
+        self.pending_count -= len(self.pending.pop(crawl, []))
+
+    def drop_lowest_priority(self):
+        # trims the pending urls of all crawls to 75% of max_pending in one go (so it runs once per quarter of new urls, not on every push),
+        # keeping the best urls overall. the dropped urls stay marked as seen
+        entries = [(entry, crawl) for crawl, heap in self.pending.items() for entry in heap]
+        keep = heapq.nsmallest(int(self.max_pending * 0.75), entries)
+        self.pending = {}
+        for entry, crawl in keep:
+            self.pending.setdefault(crawl, []).append(entry)
+        for heap in self.pending.values():
+            heapq.heapify(heap)
+        self.dropped_count += len(entries) - len(keep)
+        self.pending_count = len(keep)
+
+    def stats(self):
+        return {'seen_urls': self.seen.item_count, 'pending_urls': self.pending_count, 'duplicates_skipped': self.duplicate_count,
+                'dropped_urls': self.dropped_count, 'seen_filter_mb': round(len(self.seen.bits) / 1e6, 1)}
@@ -58,10 +58,15 @@ input: Address string
 (working) the self.all_place_ids set is initialized.
 (working) the text search and nearby search functions are called and the results are added to the self.all_place_ids set.
 (working) for all results in self.all_place_ids, if the place_id is not already in the self.data dictionary or if the place_id is in the self.data dictionary and the last_updated timestamp is more than 2 days old, the place details api will be called. the api is only called when necessary to avoid rate limiting and make efficient use of cached data.
+(working) the opening hours periods are compiled into a 168 hour weekly bitmask per place (opening_hours.py), stored as the opening_hours_mask hex column with the day period label (early only, mid day to late, ...).
+(working) the relevance gate (relevance_gate.py) drops the non-relevant places (configurable rules and the persisted non-relevant name / type list) from the self.all_place_ids set using the search result payloads, before any place details call is paid for.
+(working) the search result fields (name, types, rating, price level, business status, address, geometry, plus code) are merged into the self.data dictionary as partial records with the source of every field in field_sources, and the place details api call only requests the fields the search results did not provide.
 (working) the place details are fetched for each place_id in the self.all_place_ids set, but only if the place_id is not already in the self.data dictionary or if the place_id is in the self.data dictionary and the last_updated timestamp is more than 2 days old.
 (working) output_1: the updated self.data dictionary is saved to the json file and the csv file.
-(not yet implemented) for all results that returned a valid website, the SpiderCrawlerMenuScraper class will visit each website and navigate itself to the menu page and gather the menu links. the menu links are then added to the self.data dictionary and the updated self.data dictionary is saved to the json file and the csv file.
-(not yet implemented) the menu data is parsed and saved to the json file and the csv file after normalizing it. the menu data can also be augmented / stitched / aggregated if it is found in other data sources such as the restaurant booking sites, the restaurant review / award / blog sites, or the social media sites.
+(working) for all results that returned a valid website, the SpiderCrawlerMenuScraper class (menu_crawler.py) crawls each website asynchronously with per host politeness and robots.txt checks and gathers the menu link candidates. the menu links are then added to the self.data dictionary as menu_link_candidates and the updated self.data dictionary is saved to the json file and the csv file.
+(working) the menu text is extracted (menu_text_extraction.py) and the menu prices are parsed into per section price summary statistics (menu_prices.py) that are saved to the json file and the csv file.
+(working) the places are labeled by cuisine and service style (place_classifier.py): keyword seed labels and a TF-IDF / SGD model trained on them for the places the keywords do not cover.
+(not yet implemented) the menu data can also be augmented / stitched / aggregated if it is found in other data sources such as the restaurant booking sites, the restaurant review / award / blog sites, or the social media sites.
 
 ## Module planned updates (roadmap):
 
@@ -105,10 +110,19 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException
 from tqdm import tqdm
 from urllib.parse import urlparse, urljoin
+from menu_crawler import SpiderCrawlerMenuScraper
+from menu_prices import record_menu_price_summaries
+from menu_text_extraction import MenuTextExtractor
+from opening_hours import record_opening_hours_masks
+from place_classifier import PlaceClassifier
+from relevance_gate import RelevanceGate
+from review_sentiment import ReviewSentimentScorer
+from review_store import ReviewStore
 import asyncio
 import certifi
 import difflib
 import functools
+import heapq
 import json
 import logging
 import math
@@ -166,6 +180,20 @@ print(f"""SSL Context Details:
     CA Certs Path: {certifi.where()}
     """)
 
+# place details fields (the names of the fields parameter) and the key of each field in the details result
+PLACE_DETAILS_FIELDS = {
+    'place_id': 'place_id', 'name': 'name', 'editorial_summary': 'editorial_summary', 'website': 'website', 'url': 'url', 'types': 'types',
+    'rating': 'rating', 'price_level': 'price_level', 'opening_hours': 'opening_hours', 'utc_offset': 'utc_offset', 'review': 'reviews',
+    'user_ratings_total': 'user_ratings_total', 'international_phone_number': 'international_phone_number', 'formatted_address': 'formatted_address',
+    'address_components': 'address_components', 'geometry': 'geometry', 'plus_code': 'plus_code', 'business_status': 'business_status',
+    'reservable': 'reservable', 'dine_in': 'dine_in', 'wheelchair_accessible_entrance': 'wheelchair_accessible_entrance',
+    'serves_breakfast': 'serves_breakfast', 'serves_brunch': 'serves_brunch', 'serves_dinner': 'serves_dinner', 'serves_lunch': 'serves_lunch',
+    'serves_wine': 'serves_wine', 'serves_beer': 'serves_beer', 'serves_vegetarian_food': 'serves_vegetarian_food',
+}
+# search result fields that are complete in the text / nearby search results (the search opening_hours only has open_now, so it is not one of them)
+SEARCH_RESULT_FIELDS = ['place_id', 'name', 'types', 'rating', 'user_ratings_total', 'price_level', 'business_status', 'formatted_address', 'geometry',
+                        'plus_code', 'vicinity']
+
 # Set API keys and other information from environment variables
 # the open weather api key is not currently being used but will be used in the CityResearcher when we add the weather data to the report
 # open_weather_api_key = os.getenv('OPEN_WEATHER_API_KEY')
@@ -230,6 +258,9 @@ def safe_request(max_retries=3, backoff_factor=1):
             while retries < max_retries:
                 try:
                     response = func(*args, **kwargs)
+                    # the decorated methods that return parsed data (search results, place details, None for cached data) are passed through
+                    if not isinstance(response, requests.Response):
+                        return response
                     if response.status_code == 200:
                         return response
                     else:
@@ -269,6 +300,8 @@ class AddressResearcher:
         self.text_search_phrase_templates = self.create_text_search_phrase_templates()
         self.search_distances_in_meters = [500, 750, 1000, 1250, 1500, 1750, 2000, 2250, 2500, 2750, 3000, 3500, 4000, 4500, 5000, 5500, 6000, 6500, 7000, 7500, 8000, 8500, 9000, 9500, 10000, 12500, 15000, 17500, 20000, 25000, 30000, 35000]
         self.all_place_ids = set()
+        self.search_payloads = {}  # place_id -> text / nearby search result, used by the relevance gate before the place details calls
+        self.relevance_gate = RelevanceGate(os.path.join(FILE_DROP_PATH, 'relevance_rules.json'), os.path.join(FILE_DROP_PATH, 'non_relevant_places.json'))
         self.data_shelf_life = 30  # Days
 
     def load_cached_data(self):
@@ -430,6 +463,7 @@ class AddressResearcher:
                         place_id = result.get('place_id')
                         if place_id:  # Ensure place_id exists
                             self.all_place_ids.add(place_id)  # Add the place ID to all_place_ids
+                            self.search_payloads.setdefault(place_id, {}).update(result)  # Keep the search result for the relevance gate
                     all_places.extend(search_data['results'])  # Collect all places
 
                     # Fetch next page token and wait for it to become valid
@@ -477,6 +511,7 @@ class AddressResearcher:
                         place_id = result.get('place_id')
                         if place_id:  # Ensure place_id exists
                             self.all_place_ids.add(place_id)  # Add the place ID to all_place_ids
+                            self.search_payloads.setdefault(place_id, {}).update(result)  # Keep the search result for the relevance gate
                     all_places.extend(search_data['results'])  # Collect all places
 
                     # Fetch next page token and wait for it to become valid
@@ -495,28 +530,71 @@ class AddressResearcher:
         self.logger.info(f"{self.query_google_nearby_search.__name__} - {number_of_results} results were found for the nearby search with radius {distance} meters")
         return all_places
     
+    def details_are_fresh(self, place_id):
+        '''True when the cached details of the place are younger than the shelf life (no place details call needed)'''
+        if place_id not in self.data:
+            return False
+        # Use .get() to safely access 'last_updated', with a fallback to a very old date if it doesn't exist
+        last_updated_str = self.data[place_id].get('last_updated', '1970-01-01T00:00:00')
+        try:
+            last_updated = datetime.fromisoformat(last_updated_str)
+        except ValueError:
+            # If the date string is invalid, default to the Unix epoch start time or altenately could be expressed as datetime.min
+            last_updated = datetime(1970, 1, 1)
+        return datetime.now() - last_updated < timedelta(days=self.data_shelf_life)
+
+    def merge_search_payloads(self):
+        '''stores the complete fields of the search results in self.data (partial records for the places never fetched), with the source and time
+        of every field in field_sources, so the place details call does not have to request them again'''
+        now = datetime.now().isoformat()
+        merged = 0
+        for place_id in self.all_place_ids:
+            payload = self.search_payloads.get(place_id)
+            if not payload:
+                continue
+            record = self.data.setdefault(place_id, {})
+            field_sources = record.setdefault('field_sources', {})
+            for field in SEARCH_RESULT_FIELDS:
+                if field in payload:
+                    record[field] = payload[field]
+                    field_sources[field] = {'source': 'search', 'last_updated': now}
+            merged += 1
+        self.logger.info(f"{self.merge_search_payloads.__name__} - Search result fields merged for {merged} places")
+
+    def details_fields_to_request(self, place_id):
+        '''the place details fields not provided by this run's search results'''
+        search_fields = {field for field in SEARCH_RESULT_FIELDS if field in self.search_payloads.get(place_id, {})}
+        return [field for field, key in PLACE_DETAILS_FIELDS.items() if key not in search_fields]
+
+    def apply_relevance_gate(self):
+        '''drops the non-relevant places (by their search payload) from self.all_place_ids before the place details calls, returns the number
+        of place details calls saved (the rejected places whose details were not fresh)'''
+        relevant_place_ids, rejected = self.relevance_gate.filter_place_ids(self.all_place_ids, self.search_payloads)
+        saved_calls = 0
+        now = datetime.now().isoformat()
+        for place_id, reason in rejected.items():
+            if not self.details_are_fresh(place_id):
+                saved_calls += 1
+            # Places fetched on an earlier run keep their data but are flagged so the next steps can filter them out
+            if place_id in self.data:
+                self.data[place_id]['relevance_gate'] = {'relevant': False, 'reason': reason, 'last_checked': now}
+        self.all_place_ids = relevant_place_ids
+        self.relevance_gate.save()
+        print(f"Relevance gate: {len(rejected)} non-relevant places skipped, {saved_calls} place details calls saved")
+        self.logger.info(f"{self.apply_relevance_gate.__name__} - {len(rejected)} non-relevant places skipped, {saved_calls} place details calls saved")
+        return saved_calls
+
     # @safe_request(max_retries=3, backoff_factor=1, handled_exceptions=(ChunkedEncodingError,))
     @safe_request()
     def get_place_details(self, place_id):
-        # to optimize the place details api call, we only want to request fields that are not already present in the data. this will require a dynamic list creation for the fields parameter in the place details api call.
-        fields_to_search = 'place_id,name,editorial_summary,website,url,types,rating,price_level,opening_hours,utc_offset,review,user_ratings_total,international_phone_number,formatted_address,address_components,geometry,plus_code,business_status,reservable,dine_in,wheelchair_accessible_entrance,serves_breakfast,serves_brunch,serves_dinner,serves_lunch,serves_wine,serves_beer,serves_vegetarian_food'
+        # to optimize the place details api call, only the fields that this run's search results did not already provide are requested
+        fields_to_search = ','.join(self.details_fields_to_request(place_id))
         # Check if data exists and is fresh
         self.logger.info(f"{self.get_place_details.__name__} - Checking if data for place ID {place_id} is present")
-        if place_id in self.data:
-            self.logger.info(f"{self.get_place_details.__name__} - Data for {place_id} is present. Checking if it's fresh.")
-            # Use .get() to safely access 'last_updated', with a fallback to a very old date if it doesn't exist
-            last_updated_str = self.data[place_id].get('last_updated', '1970-01-01T00:00:00')
-            try:
-                last_updated = datetime.fromisoformat(last_updated_str)
-            except ValueError:
-                # If the date string is invalid, default to the Unix epoch start time or altenately could be expressed as datetime.min
-                last_updated = datetime(1970, 1, 1)
-                
-            if datetime.now() - last_updated < timedelta(days=self.data_shelf_life):  # Only fetch details if data is older than the shelf life
-            # if datetime.now() - last_updated < timedelta(days=14):  # This implementation uses a 14 day threshold for data freshness
-                print(f"Data for {place_id} is fresh. Skipping API call.")
-                self.logger.info(f"{self.get_place_details.__name__} - Data for {place_id} is fresh. Skipping API call.")
-                return None  # Skip fetching details and return None to indicate no new data was fetched
+        if self.details_are_fresh(place_id):  # Only fetch details if data is older than the shelf life
+            print(f"Data for {place_id} is fresh. Skipping API call.")
+            self.logger.info(f"{self.get_place_details.__name__} - Data for {place_id} is fresh. Skipping API call.")
+            return None  # Skip fetching details and return None to indicate no new data was fetched
         
         print(f"Fetching details for place ID: {place_id}")
         self.logger.info(f"{self.get_place_details.__name__} - No fresh data found. Fetching details for place ID: {place_id} from the place details API")
@@ -553,8 +631,9 @@ class AddressResearcher:
             print(f"\nPlace details fetched for place ID: {place_id}")
             self.logger.info(f"{self.get_place_details.__name__} - Place details fetched for place ID: {place_id}")
 
-            # Check if 'geometry' or 'location' data is missing
-            if 'geometry' not in details or 'location' not in details['geometry']:
+            # Check if 'geometry' or 'location' data is missing (from the details and from the search result)
+            known_geometry = details.get('geometry') or self.data.get(place_id, {}).get('geometry') or {}
+            if 'location' not in known_geometry:
                 # Use the self.location attribute to fill in the missing geometry data
                 # Ensure self.location is up-to-date by calling self.geocode_address if needed
                 if not self.location:
@@ -629,13 +708,14 @@ class AddressResearcher:
         self.logger.info(f"{self.add_crow_fly_distances.__name__} - Crow fly distances added/updated for {len(self.all_place_ids)} places")
 
     def format_weekday_text(self, opening_hours):
-        '''not working'''
-        # Extract 'weekday_text' and join with newline characters if it exists
-        return '\n'.join(opening_hours['weekday_text']) if 'weekday_text' in opening_hours else 'N/A'
+        # Extract 'weekday_text' and join with newline characters if it exists (the narrow / thin spaces google puts around the times become plain spaces)
+        if 'weekday_text' not in opening_hours:
+            return 'N/A'
+        return '\n'.join(line.replace('\u202f', ' ').replace('\u2009', ' ') for line in opening_hours['weekday_text'])
 
     def format_reviews(self, reviews):
         formatted_reviews = []
-        for review in sorted(reviews, key=lambda x: x.get('time', 0), reverse=True)[:5]:  # Sorting by time and getting top 5
+        for review in heapq.nlargest(5, reviews, key=lambda x: x.get('time', 0)):  # Latest 5 by time without sorting the whole list
             date_time = datetime.fromtimestamp(review.get('time', 0)).strftime('%Y-%m-%d %H:%M:%S')
             review_text = (f"Date: {date_time}, Author: {review.get('author_name', 'Anonymous')}, "
                            f"Rating: {review.get('rating', 'N/A')}, "
@@ -644,7 +724,6 @@ class AddressResearcher:
         return '\n\n'.join(formatted_reviews) if formatted_reviews else 'N/A'
 
     def save_report_as_csv(self, data, csv_file_path):
-        '''opening_hours not being formatted correctly in the csv file'''
         self.logger.info(f"{self.save_report_as_csv.__name__} - Saving report as CSV file at {csv_file_path}")
         columns_order = ['place_id', 
                         'name', 
@@ -676,6 +755,12 @@ class AddressResearcher:
                         'serves_wine', 
                         'serves_beer',
                         'serves_vegetarian_food', 
+                        'menu_link_candidates',
+                        'menu_price_summary',
+                        'review_sentiment',
+                        'place_labels',
+                        'opening_hours_mask',
+                        'opening_hours_day_period',
                         ]
 
         data_for_df = []
@@ -684,9 +769,11 @@ class AddressResearcher:
             place_data['place_id'] = place_id
             place_data['opening_hours'] = self.format_weekday_text(place_info.get('opening_hours', {}))
             place_data['review'] = self.format_reviews(place_info.get('reviews', []))
+            place_data['menu_link_candidates'] = '; '.join(candidate['url'] for candidate in place_info.get('menu_link_candidates', []))
             
             for key, value in place_info.items():
-                if key in columns_order:  # Only add if the key is in the columns_order list
+                # Only add if the key is in the columns_order list, the columns formatted above are not overwritten with the raw values
+                if key in columns_order and key not in ('opening_hours', 'menu_link_candidates'):
                     if isinstance(value, list):
                         place_data[key] = '; '.join([json.dumps(item) if isinstance(item, dict) else str(item) for item in value])
                     elif isinstance(value, dict):
@@ -717,24 +804,86 @@ class AddressResearcher:
             self.query_google_nearby_search(distance)
             time.sleep(1)  # Delay to avoid rate limiting
 
+        # Skip the non-relevant places (fast food, gas stations, closed businesses, the persisted non-relevant list) before paying for their details
+        self.apply_relevance_gate()
+
+        # Store the search result fields (geometry, rating, address, ...) so the details calls only request the remaining fields
+        self.merge_search_payloads()
+
         # Fetch place details for unique place IDs
         for place_id in tqdm(self.all_place_ids, desc="Fetching place details"):
             detailed_info = self.get_place_details(place_id)
             if detailed_info:  # Ensure valid data is received
-                self.data[place_id] = detailed_info  # Update self.data
+                # Merge into the record so the search fields and the data added by the later steps are kept
+                now = detailed_info['last_updated']
+                field_sources = self.data.setdefault(place_id, {}).setdefault('field_sources', {})
+                for field in detailed_info:
+                    if field != 'last_updated':
+                        field_sources[field] = {'source': 'details', 'last_updated': now}
+                self.data[place_id].update(detailed_info)  # Update self.data
 
         self.add_crow_fly_distances()
         self.logger.info(f"{self.run_searches_and_save.__name__} - Crow fly distances added")
 
+        # Save the place details before the enrichment stages, an error in any of them never loses the details this run already paid for
+        self.save_data(json_file_path, csv_file_path)
+
+        # Compile the opening hours periods into the 168 hour weekly masks (vectorized open at / open late queries without the period dicts)
+        self.run_enrichment_stage('Opening hours masks', lambda: record_opening_hours_masks(self.data))
+
+        # Add the new reviews to the shared review store (deduplicated by place, author and time, so the reviews accumulate across runs) and score
+        # the sentiment of the stored reviews (only the ones never scored, cached by review hash) for the per place summary
+        self.run_enrichment_stage('Reviews and review sentiment', self.record_reviews_and_sentiment)
+
+        # Crawl the restaurant websites for menu links (only the places never crawled or past the shelf life)
+        menu_crawler = SpiderCrawlerMenuScraper(data_shelf_life=self.data_shelf_life,
+                                                page_validators_path=os.path.join(FILE_DROP_PATH, 'menu_page_validators.json'))
+        self.run_enrichment_stage('Menu link candidates', lambda: menu_crawler.record_menu_links(self.data))
+
+        # Download the menu pages / pdfs and extract their text in a process pool (cached by content hash in the shared menu_text_cache folder)
+        menu_text_extractor = MenuTextExtractor(os.path.join(FILE_DROP_PATH, 'menu_text_cache'), crawler=menu_crawler, data_shelf_life=self.data_shelf_life)
+        self.run_enrichment_stage('Menu documents', lambda: menu_text_extractor.record_menu_texts(self.data))
+
+        # Parse the menu prices of all the places in one batch and add the per section price summary statistics
+        self.run_enrichment_stage('Menu price summaries', lambda: record_menu_price_summaries(self.data, menu_text_extractor.cache))
+
+        # Label the cuisine and service style (cached sparse features, only the new / changed places are vectorized and predicted)
+        self.run_enrichment_stage('Place labels', lambda: PlaceClassifier(os.path.join(FILE_DROP_PATH, 'place_classifier')).record_place_labels(self.data))
+
+        # Save again with everything the enrichment stages added
+        self.save_data(json_file_path, csv_file_path)
+
+    def run_enrichment_stage(self, description, stage):
+        '''runs one enrichment stage, an error is logged and the run continues with the next stage (the place details are already saved)'''
+        try:
+            stage()
+        except Exception as e:
+            print(f"{description} failed: {e}")
+            self.logger.error(f"{self.run_enrichment_stage.__name__} - {description} failed: {e}")
+            return False
+        self.logger.info(f"{self.run_searches_and_save.__name__} - {description} added")
+        return True
+
+    def record_reviews_and_sentiment(self):
+        review_store = ReviewStore(os.path.join(FILE_DROP_PATH, 'restaurant_reviews.sqlite'))
+        try:
+            new_reviews = review_store.ingest_places(self.data)
+            print(f"{new_reviews} new reviews added to the review store")
+            self.logger.info(f"{self.record_reviews_and_sentiment.__name__} - {new_reviews} new reviews added to the review store")
+            ReviewSentimentScorer(review_store).record_place_sentiment(self.data)
+        finally:
+            review_store.close()
+
+    def save_data(self, json_file_path, csv_file_path):
         # Save data to JSON and CSV files
         with open(json_file_path, 'w') as file:
             json.dump(self.data, file, indent=4)
         print(f"Data saved to JSON file at {json_file_path}")
-        self.logger.info(f"{self.run_searches_and_save.__name__} - Data saved to JSON file at {json_file_path}")
+        self.logger.info(f"{self.save_data.__name__} - Data saved to JSON file at {json_file_path}")
 
         self.save_report_as_csv(self.data, csv_file_path)
         print(f"Data saved to CSV file at {csv_file_path}")
-        self.logger.info(f"{self.run_searches_and_save.__name__} - Data saved to CSV file at {csv_file_path}")
+        self.logger.info(f"{self.save_data.__name__} - Data saved to CSV file at {csv_file_path}")
 
 # # Main execution
 # if __name__ == "__main__":
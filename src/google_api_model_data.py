@@ -6,13 +6,23 @@ It also saves the formatted data to restaurant_data_formatted.csv and restaurant
 
 '''
 
+from collections.abc import Mapping
 import json
 import os 
 import pandas as pd
 import requests
+import resource
+import sys
 from math import radians, cos, sin, asin, sqrt
 from pandas import json_normalize
 from dotenv import load_dotenv
+from opening_hours import record_opening_hours_masks
+from place_aggregates import PlaceAggregates
+from place_classifier import PlaceClassifier
+from place_model import compact_places, read_places_json, write_places_json
+from place_snapshot import write_place_snapshot, SNAPSHOT_FILE_NAME
+from review_sentiment import ReviewSentimentScorer
+from review_store import ReviewStore
 
 # Load environment variables
 load_dotenv()
@@ -136,22 +146,22 @@ combined_place_ids = set()
 fixed_records_count = 0
 failed_records_count = 0
 
-# Process each JSON file
+# Process each JSON file, the places are held as compact Place records (place_model.py) instead of the nested dicts of the files
 for file in all_json_files:
-    with open(os.path.join(reports_folder, file), 'r') as f:
-        data = json.load(f)  # Assuming data is a dictionary
+    skipped_records = []
+    data = read_places_json(os.path.join(reports_folder, file), skipped_records)
 
-        # Update the set of original place IDs
-        original_place_ids.update(data.keys())
+    # Update the set of original place IDs
+    original_place_ids.update(data.keys())
+    original_place_ids.update(place_id for place_id, _ in skipped_records)
 
-        # Combine data and update combined_place_ids set
-        for place_id, details in data.items():
-            if isinstance(details, dict):
-                details['source_address_file'] = file  # Add source file info
-                combined_json_data[place_id] = details  # Combine data
-                combined_place_ids.add(place_id)  # Update combined_place_ids set
-            else:
-                print(f"Warning: Expected a dictionary for place ID {place_id}, got {type(details)} in file {file}")
+    # Combine data and update combined_place_ids set
+    for place_id, details in data.items():
+        details['source_address_file'] = file  # Add source file info
+        combined_json_data[place_id] = details  # Combine data
+        combined_place_ids.add(place_id)  # Update combined_place_ids set
+    for place_id, details in skipped_records:
+        print(f"Warning: Expected a dictionary for place ID {place_id}, got {type(details)} in file {file}")
 
 # Ensure all place_ids have valid location data
 for place_id, details in combined_json_data.items():
@@ -167,9 +177,38 @@ for place_id, details in combined_json_data.items():
 # Add crow fly distances
 add_crow_fly_distances(combined_json_data)
 
-# Save the combined JSON data
-with open(os.path.join(processed_reports_folder, 'restaurant_data_all_combined.json'), 'w') as f:
-    json.dump(combined_json_data, f, indent=4)
+# Weekly opening hours masks (168 bits as hex) for all the places in one batch
+record_opening_hours_masks(combined_json_data)
+# the steps below read the packed fields (opening hours, reviews, ...), they are packed again after each step so only one field is materialized at
+# a time
+compact_places(combined_json_data)
+
+# Add the reviews of every address file to the review store, a place found from several addresses only adds its reviews once
+# (this is the same store the data feed writes to when FILE_DROP_PATH points to the reports folder)
+review_store = ReviewStore(os.path.join(reports_folder, 'restaurant_reviews.sqlite'))
+print(f"{review_store.ingest_places(combined_json_data)} new reviews added to the review store")
+# Sentiment summary over all the stored reviews of each place (not only the latest 5), only the new reviews are scored
+ReviewSentimentScorer(review_store).record_place_sentiment(combined_json_data)
+review_store.close()
+compact_places(combined_json_data)
+
+# Cuisine / service style labels for all the places, the features of the places already labeled by an earlier merge are reused from the cache
+PlaceClassifier(os.path.join(reports_folder, 'place_classifier')).record_place_labels(combined_json_data)
+compact_places(combined_json_data)
+
+# Dashboard aggregate cube (source address x city x price level x distance band x cuisine), only the places that changed since the last merge
+# are subtracted from / added to the cube
+place_aggregates = PlaceAggregates(os.path.join(processed_reports_folder, 'place_aggregates'))
+print(f"{place_aggregates.update(combined_json_data)} places re-aggregated into the dashboard cube ({len(place_aggregates.cube)} cells)")
+place_aggregates.save()
+
+# Save the combined JSON data (same json as json.dump with indent=4, written one record at a time)
+write_places_json(os.path.join(processed_reports_folder, 'restaurant_data_all_combined.json'), combined_json_data)
+
+# Publish the memory mapped columnar snapshot the map / dashboard scripts open instead of loading the combined json
+snapshot_count = write_place_snapshot(combined_json_data, os.path.join(processed_reports_folder, SNAPSHOT_FILE_NAME))
+print(f"Columnar snapshot of {snapshot_count} places saved to {SNAPSHOT_FILE_NAME}")
+compact_places(combined_json_data)
 
 # Perform new validation checks using sets
 missing_ids = original_place_ids - combined_place_ids
@@ -197,15 +236,12 @@ def explore_structure(obj, path=''):
     elif isinstance(obj, list) and obj:  # Ensure the list is not empty
         explore_structure(obj[0], path)  # Explore the first item structure
             
-# Load the JSON data
-with open(os.path.join(processed_reports_folder, 'restaurant_data_all_combined.json'), 'r') as f:
-    data = json.load(f)
-
 # Set to store unique field names
 fields = set()
 
-# Explore the structure of the JSON data
-explore_structure(data)
+# Explore the structure of the combined data one record at a time (instead of loading the saved file back as one more copy of the corpus)
+for place_id, details in combined_json_data.items():
+    explore_structure(details.to_dict(), place_id)
 
 # Print all unique field names after the first dot
 print("Fields structure:")
@@ -298,10 +334,10 @@ print(f"\n\n#-------------------------------------------------- COMBINING JSON F
 print(f"\n\n#-------------------------------------------------- FORMATTING JSON FOR MAP --------------------------------------------------#\n\n")
 
 def format_for_map(obj):
-    if not isinstance(obj, dict):  # Check if the object is a dictionary
-        return None  # Skip this object if it's not a dictionary
+    if not isinstance(obj, Mapping):  # Check if the object is a place record (dict or Place)
+        return None  # Skip this object if it's not a place record
 
-    # Proceed with formatting if obj is a dictionary
+    # Proceed with formatting if obj is a place record
     formatted_data = {
         "name": obj.get("name"),
         "types": ", ".join(obj.get("types", [])),
@@ -315,6 +351,8 @@ def format_for_map(obj):
         "direct_distance_km": obj.get("crow_fly_distance_km"),
         "address": obj.get("formatted_address"),
         "opening_hours_weekday_text": "\n".join(obj.get("opening_hours", {}).get("weekday_text", [])),
+        "opening_hours_mask": obj.get("opening_hours_mask"),
+        "opening_hours_day_period": obj.get("opening_hours_day_period"),
         "time_zone_utc_offset": obj.get("utc_offset"),
         "business_status": obj.get("business_status"),
         "dine_in": obj.get("dine_in"),
@@ -329,25 +367,17 @@ def format_for_map(obj):
     }
     return formatted_data
 
-# Dictionary to hold all formatted data with place_id as keys
-formatted_data_dict = {}
-
-# Iterate through each place's data in the JSON dictionary
-for place_id, place_data in data.items():
-    if isinstance(place_data, dict):
-        formatted_obj = format_for_map(place_data)
-        if formatted_obj:
-            formatted_data_dict[place_id] = formatted_obj  # Use place_id as the key
-    else:
-        print(f"Warning: Data for place_id {place_id} is not a dictionary.")
-
-# Save the formatted data to a new JSON file
+# Save the formatted data to a new JSON file, each place is formatted as it is written (place_id as the key)
 output_filename = os.path.join(processed_reports_folder, 'restaurant_data_map_file.json')
-with open(output_filename, 'w') as outfile:
-    json.dump(formatted_data_dict, outfile, indent=4)
+formatted_records = ((place_id, format_for_map(place_data)) for place_id, place_data in combined_json_data.items())
+write_places_json(output_filename, ((place_id, formatted_obj) for place_id, formatted_obj in formatted_records if formatted_obj))
 
 print(f"Data successfully saved to {output_filename}")
 
+# Peak resident memory of the merge (ru_maxrss is in kilobytes on linux and in bytes on macos)
+peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(f"Peak memory: {peak_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024):.0f} MB")
+
 print(f"\n\n#-------------------------------------------------- FORMATTING JSON FOR MAP --------------------------------------------------#\n\n")
 
 
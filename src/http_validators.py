@@ -0,0 +1,70 @@
+'''
+
+This module keeps the HTTP cache validators of the downloaded menu documents so the scheduled refreshes only pay for a header round trip when a
+restaurant did not change its menu.
+
+For every url the store keeps the ETag, the Last-Modified date, the sha256 of the last downloaded content and the document kind. The next
+download sends them back as If-None-Match / If-Modified-Since:
+    - a 304 Not Modified means the cached text (by content hash) is still current, nothing is downloaded or parsed
+    - a 200 whose content hash matches the stored one (servers without validators, or dynamic pages that re-render the same menu) is not parsed again
+
+The validators are saved as json next to the menu text cache.
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from datetime import datetime
+import json
+import logging
+import os
+
+# CLASSES ###################################################################################################################################
+
+class ValidatorStore:
+    def __init__(self, file_path):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.file_path = file_path
+        self.validators = self.load()
+
+    def load(self):
+        if os.path.exists(self.file_path):
+            with open(self.file_path, 'r') as file:
+                return json.load(file)
+        return {}
+
+    def save(self):
+        temp_path = f"{self.file_path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump(self.validators, file)
+        os.replace(temp_path, self.file_path)
+        self.logger.info(f"{self.save.__name__} - {len(self.validators)} url validators saved to {self.file_path}")
+
+    def get(self, url):
+        return self.validators.get(url)
+
+    def conditional_headers(self, url):
+        '''If-None-Match / If-Modified-Since headers for the url, empty when nothing was downloaded from it before'''
+        validator = self.validators.get(url)
+        headers = {}
+        if not validator:
+            return headers
+        if validator.get('etag'):
+            headers['If-None-Match'] = validator['etag']
+        if validator.get('last_modified'):
+            headers['If-Modified-Since'] = validator['last_modified']
+        return headers
+
+    def mark_not_modified(self, url):
+        self.validators[url]['last_checked'] = datetime.now().isoformat()
+
+    def update(self, url, response_headers, content_hash, kind):
+        '''stores the validators of a full (200) response, returns True when the content changed since the last download'''
+        previous = self.validators.get(url) or {}
+        self.validators[url] = {
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'content_hash': content_hash,
+            'kind': kind,
+            'last_checked': datetime.now().isoformat(),
+        }
+        return previous.get('content_hash') != content_hash
@@ -0,0 +1,453 @@
+'''
+
+This module builds the comparison place layers for the folium maps in viz_map.py and viz_testing_map.py.
+
+Instead of instantiating a folium CircleMarker, IFrame and Popup for every place and rendering each one through the folium templates,
+the places are written as a single compact GeoJSON FeatureCollection. A small Leaflet script styles each point by its price_level and
+builds the popup on the client when it is opened, so the map generation time is dominated by one json.dumps call (seconds for 100k places).
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from folium import MacroElement
+from jinja2 import Template
+import hashlib
+import json
+import numpy as np
+import os
+
+# CONSTANTS ###################################################################################################################################
+
+# grey scale colors for price levels 1-4, places without a price level (or an unknown one) are drawn with the default color
+PRICE_LEVEL_COLORS = {1: '#d4d4d4', 2: '#a9a9a9', 3: '#7e7e7e', 4: '#535353'}
+DEFAULT_PLACE_COLOR = '#d4d4d4'
+
+# popup fields: (property name, popup label, function that pulls the value out of a place record)
+# an empty label renders the value in bold as the popup title, the LINK_FIELDS are rendered as links with the label as the link text
+# missing values are left out of the geojson and shown as 'N/A' (or a '#' link) by the popup script
+DEFAULT_POPUP_FIELDS = [
+    ('name', '', lambda details: details.get('name')),
+    ('address', 'Address', lambda details: details.get('formatted_address')),
+    ('phone', 'Phone', lambda details: details.get('formatted_phone_number')),
+    ('rating', 'Rating', lambda details: details.get('rating', 0)),
+    ('price_level', 'Price Level', lambda details: details.get('price_level')),
+    ('summary', 'Editorial Summary', lambda details: (details.get('editorial_summary') or {}).get('overview')),
+    ('website', 'Website', lambda details: details.get('website')),
+    ('url', 'Maps URL', lambda details: details.get('url')),
+]
+
+LINK_FIELDS = ['website', 'url']
+
+# number of decimals kept for the coordinates (6 decimals is ~10cm which is more than the places api precision we use)
+COORDINATE_PRECISION = 6
+
+# density grid cell sizes in degrees, keyed by the first zoom level that uses them (the national view at zoom_start=5 uses the 0.5 degree grid)
+DENSITY_ZOOM_CELL_SIZES = {0: 2.0, 4: 0.5, 6: 0.2, 8: 0.05}
+
+# light to dark ramp for the density cells, the cell value is log scaled to 0-1 per zoom level before picking a color
+DENSITY_COLORS = ['#3b3b3b', '#5c5c5c', '#7e7e7e', '#a9a9a9', '#d4d4d4', '#ffffff']
+
+# region shards: geohash prefix length to start from, shards with more places than the limit are split on the next geohash character
+SHARD_GEOHASH_PRECISION = 3
+SHARD_MAX_GEOHASH_PRECISION = 6
+SHARD_MAX_FEATURES = 5000
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# FUNCTIONS ###################################################################################################################################
+
+def place_location(details):
+    '''returns the (lat, lng) tuple of a place record or None if the geometry is missing'''
+    location = (details.get('geometry') or {}).get('location') or {}
+    lat = location.get('lat')
+    lng = location.get('lng')
+    if lat is None or lng is None:
+        return None
+    return lat, lng
+
+def build_place_feature(place_id, details, popup_fields=DEFAULT_POPUP_FIELDS):
+    location = place_location(details)
+    if location is None:
+        return None
+    lat, lng = location
+
+    # only keep the properties that have a value, the popup script skips missing keys
+    properties = {'place_id': place_id, 'price_level': details.get('price_level')}
+    for key, _, getter in popup_fields:
+        value = getter(details)
+        if value is not None and value != '':
+            properties[key] = value
+
+    return {
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [round(lng, COORDINATE_PRECISION), round(lat, COORDINATE_PRECISION)]},
+        'properties': properties,
+    }
+
+def build_place_feature_collection(places, popup_fields=DEFAULT_POPUP_FIELDS):
+    '''places is an iterable of (place_id, details) pairs, records without a location are skipped'''
+    features = []
+    for place_id, details in places:
+        feature = build_place_feature(place_id, details, popup_fields)
+        if feature is not None:
+            features.append(feature)
+    return {'type': 'FeatureCollection', 'features': features}
+
+def dump_compact_geojson(feature_collection):
+    # compact separators keep the embedded / written payload small, and '</' is escaped so the json can be inlined in a <script> tag
+    return json.dumps(feature_collection, separators=(',', ':'), ensure_ascii=False).replace('</', '<\\/')
+
+def save_geojson(feature_collection, file_path):
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write(dump_compact_geojson(feature_collection))
+    print(f"GeoJSON with {len(feature_collection['features'])} features saved to {file_path}")
+
+def place_coordinate_arrays(places, weight_field=None):
+    '''returns lat, lng and weight numpy arrays for the (place_id, details) pairs that have a location, the weight is 1 when weight_field is None or missing'''
+    lats, lngs, weights = [], [], []
+    for _, details in places:
+        location = place_location(details)
+        if location is None:
+            continue
+        lats.append(location[0])
+        lngs.append(location[1])
+        weight = details.get(weight_field) if weight_field else 1.0
+        weights.append(weight if isinstance(weight, (int, float)) else 0.0)
+    return np.array(lats, dtype=np.float64), np.array(lngs, dtype=np.float64), np.array(weights, dtype=np.float64)
+
+def compute_density_grid(lats, lngs, weights, cell_size):
+    '''bins the points into a cell_size degree grid aligned to the lat / lng origin, returns only the non-empty cells'''
+    if len(lats) == 0:
+        return {'cell_size': cell_size, 'lat0': 0.0, 'lng0': 0.0, 'rows': np.array([], dtype=np.int32), 'cols': np.array([], dtype=np.int32), 'values': np.array([])}
+    # align the grid to multiples of the cell size so the cells stay put when places are added at the edges
+    lat0 = np.floor(lats.min() / cell_size) * cell_size
+    lng0 = np.floor(lngs.min() / cell_size) * cell_size
+    lat_bins = max(int(np.ceil((lats.max() - lat0) / cell_size)), 1)
+    lng_bins = max(int(np.ceil((lngs.max() - lng0) / cell_size)), 1)
+    grid, _, _ = np.histogram2d(lats, lngs, bins=[lat_bins, lng_bins],
+                                range=[[lat0, lat0 + lat_bins * cell_size], [lng0, lng0 + lng_bins * cell_size]], weights=weights)
+    rows, cols = np.nonzero(grid)
+    return {'cell_size': cell_size, 'lat0': float(lat0), 'lng0': float(lng0), 'rows': rows.astype(np.int32), 'cols': cols.astype(np.int32), 'values': grid[rows, cols]}
+
+def compute_density_grids(lats, lngs, weights, zoom_cell_sizes=DENSITY_ZOOM_CELL_SIZES):
+    return {min_zoom: compute_density_grid(lats, lngs, weights, cell_size) for min_zoom, cell_size in zoom_cell_sizes.items()}
+
+def density_cache_key(lats, lngs, weights, zoom_cell_sizes=DENSITY_ZOOM_CELL_SIZES):
+    # the key covers the point data and the grid settings, so any change to either one invalidates the cached grids
+    digest = hashlib.sha256()
+    for array in (lats, lngs, weights):
+        digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    digest.update(json.dumps(sorted(zoom_cell_sizes.items())).encode())
+    return digest.hexdigest()[:32]
+
+def load_or_compute_density_grids(lats, lngs, weights, cache_folder, zoom_cell_sizes=DENSITY_ZOOM_CELL_SIZES):
+    '''returns the density grids for the points, reusing the .npz aggregates in cache_folder when the points and grid settings haven't changed'''
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    cache_file_path = os.path.join(cache_folder, f'density_{density_cache_key(lats, lngs, weights, zoom_cell_sizes)}.npz')
+
+    if os.path.exists(cache_file_path):
+        with np.load(cache_file_path) as cached:
+            grids = {}
+            for min_zoom, cell_size in zoom_cell_sizes.items():
+                grids[min_zoom] = {
+                    'cell_size': cell_size,
+                    'lat0': float(cached[f'{min_zoom}_origin'][0]),
+                    'lng0': float(cached[f'{min_zoom}_origin'][1]),
+                    'rows': cached[f'{min_zoom}_rows'],
+                    'cols': cached[f'{min_zoom}_cols'],
+                    'values': cached[f'{min_zoom}_values'],
+                }
+        print(f"Density grids loaded from cache {cache_file_path}")
+        return grids
+
+    grids = compute_density_grids(lats, lngs, weights, zoom_cell_sizes)
+    arrays = {}
+    for min_zoom, grid in grids.items():
+        arrays[f'{min_zoom}_origin'] = np.array([grid['lat0'], grid['lng0']])
+        arrays[f'{min_zoom}_rows'] = grid['rows']
+        arrays[f'{min_zoom}_cols'] = grid['cols']
+        arrays[f'{min_zoom}_values'] = grid['values']
+    # drop the aggregates of older data before saving the new ones
+    for file in os.listdir(cache_folder):
+        if file.startswith('density_') and file.endswith('.npz'):
+            os.remove(os.path.join(cache_folder, file))
+    np.savez_compressed(cache_file_path, **arrays)
+    print(f"Density grids computed for {len(lats)} places and saved to {cache_file_path}")
+    return grids
+
+def density_grids_for_client(grids):
+    '''converts the grids to the compact structure used by DensityGridLayer, the values are log scaled to 0-1 per zoom level'''
+    levels = []
+    for min_zoom in sorted(grids):
+        grid = grids[min_zoom]
+        values = np.log1p(np.clip(grid['values'], 0, None))
+        if len(values) and values.max() > 0:
+            values = values / values.max()
+        levels.append({
+            'min_zoom': min_zoom,
+            'cell_size': grid['cell_size'],
+            'lat0': round(grid['lat0'], COORDINATE_PRECISION),
+            'lng0': round(grid['lng0'], COORDINATE_PRECISION),
+            # flat [row, col, value, row, col, value, ...] list keeps the payload small
+            'cells': np.column_stack([grid['rows'], grid['cols'], np.round(values, 3)]).ravel().tolist(),
+        })
+    return levels
+
+def geohash_encode(lat, lng, precision):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even_bit = True  # geohash bits alternate between longitude and latitude, starting with longitude
+    while len(geohash) < precision:
+        coordinate_range, value = (lng_range, lng) if even_bit else (lat_range, lat)
+        middle = (coordinate_range[0] + coordinate_range[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            coordinate_range[0] = middle
+        else:
+            coordinate_range[1] = middle
+        even_bit = not even_bit
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(geohash)
+
+def shard_features_by_geohash(features, precision=SHARD_GEOHASH_PRECISION, max_features=SHARD_MAX_FEATURES, max_precision=SHARD_MAX_GEOHASH_PRECISION):
+    '''groups the point features by geohash prefix, splitting any shard above max_features on a longer prefix (up to max_precision)'''
+    # encode each point once at the longest precision, the shorter prefixes are slices of it
+    keyed_features = [(geohash_encode(feature['geometry']['coordinates'][1], feature['geometry']['coordinates'][0], max_precision), feature) for feature in features]
+    shards = {}
+    pending = [(precision, keyed_features)]
+    while pending:
+        current_precision, group = pending.pop()
+        buckets = {}
+        for geohash, feature in group:
+            buckets.setdefault(geohash[:current_precision], []).append((geohash, feature))
+        for key, bucket in buckets.items():
+            if len(bucket) > max_features and current_precision < max_precision:
+                pending.append((current_precision + 1, bucket))
+            else:
+                shards[key] = [feature for _, feature in bucket]
+    return shards
+
+def write_place_shards(feature_collection, shard_folder, precision=SHARD_GEOHASH_PRECISION, max_features=SHARD_MAX_FEATURES):
+    '''writes one compact geojson file per region shard and returns the shard index (key, bounding box, count and file name per shard)'''
+    if not os.path.exists(shard_folder):
+        os.makedirs(shard_folder)
+    # remove the shards of the previous build so regions that no longer have places aren't served
+    for file in os.listdir(shard_folder):
+        if file.endswith('.geojson'):
+            os.remove(os.path.join(shard_folder, file))
+
+    shard_index = []
+    for key, features in sorted(shard_features_by_geohash(feature_collection['features'], precision, max_features).items()):
+        lngs = [feature['geometry']['coordinates'][0] for feature in features]
+        lats = [feature['geometry']['coordinates'][1] for feature in features]
+        file_name = f'{key}.geojson'
+        with open(os.path.join(shard_folder, file_name), 'w', encoding='utf-8') as file:
+            file.write(dump_compact_geojson({'type': 'FeatureCollection', 'features': features}))
+        # the bbox is the extent of the places in the shard, which is tighter than the geohash cell
+        shard_index.append({'key': key, 'bbox': [min(lats), min(lngs), max(lats), max(lngs)], 'count': len(features), 'file': file_name})
+
+    print(f"{len(feature_collection['features'])} places written to {len(shard_index)} region shards in {shard_folder}")
+    return shard_index
+
+# CLASSES ###################################################################################################################################
+
+class PlaceGeoJsonLayer(MacroElement):
+    '''renders a FeatureCollection from build_place_feature_collection as canvas circle markers styled by price_level'''
+
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_colors = {{ this.colors }};
+            var {{ this.get_name() }}_popup_fields = {{ this.popup_fields }};
+            var {{ this.get_name() }}_link_fields = {{ this.link_fields }};
+            // one shared canvas renderer for all points, svg circle markers get slow past a few thousand places
+            var {{ this.get_name() }}_renderer = L.canvas();
+
+            function {{ this.get_name() }}_escape(value) {
+                return String(value).replace(/[&<>"']/g, function (c) {
+                    return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+                });
+            }
+
+            function {{ this.get_name() }}_popup(properties) {
+                var html = "<div style=\\"font-family: 'Arial', sans-serif; font-size: 14px; max-height: {{ this.popup_height }}px; overflow-y: auto;\\">";
+                {{ this.get_name() }}_popup_fields.forEach(function (field) {
+                    var key = field[0], label = field[1], value = properties[key];
+                    var is_link = {{ this.get_name() }}_link_fields.indexOf(key) !== -1;
+                    if (value === undefined || value === null) {
+                        if (label === '') { return; }
+                        value = is_link ? '#' : 'N/A';
+                    }
+                    if (is_link) {
+                        html += "<a href='" + {{ this.get_name() }}_escape(value) + "' target='_blank'>" + label + "</a><br>";
+                    } else if (Array.isArray(value)) {
+                        html += label + ": <br>" + value.map({{ this.get_name() }}_escape).join('<br><br>') + "<br>";
+                    } else if (label === '') {
+                        html += "<strong>" + {{ this.get_name() }}_escape(value) + "</strong><br>";
+                    } else {
+                        html += label + ": " + {{ this.get_name() }}_escape(value) + "<br>";
+                    }
+                });
+                return html + "</div>";
+            }
+
+            var {{ this.get_name() }} = L.geoJSON({{ this.data }}, {
+                pointToLayer: function (feature, latlng) {
+                    var color = {{ this.get_name() }}_colors[feature.properties.price_level] || '{{ this.default_color }}';
+                    return L.circleMarker(latlng, {
+                        renderer: {{ this.get_name() }}_renderer,
+                        radius: {{ this.radius }},
+                        color: color,
+                        fill: true,
+                        fillColor: color,
+                        fillOpacity: {{ this.fill_opacity }}
+                    });
+                },
+                onEachFeature: function (feature, layer) {
+                    // the popup html is only built when the popup is opened
+                    layer.bindPopup(function () { return {{ this.get_name() }}_popup(feature.properties); }, {maxWidth: {{ this.popup_width }}});
+                }
+            });
+
+            // only draw the individual places from min_zoom in, the density layer covers the zoomed out views
+            function {{ this.get_name() }}_toggle() {
+                var map = {{ this._parent.get_name() }};
+                if (map.getZoom() >= {{ this.min_zoom }}) {
+                    if (!map.hasLayer({{ this.get_name() }})) { {{ this.get_name() }}.addTo(map); }
+                } else {
+                    map.removeLayer({{ this.get_name() }});
+                }
+            }
+            {{ this._parent.get_name() }}.on('zoomend', {{ this.get_name() }}_toggle);
+            {{ this.get_name() }}_toggle();
+            {% if this.shard_index %}
+
+            // sharded mode: the page only carries the shard index, the place data of a region is fetched the first time it intersects the viewport
+            var {{ this.get_name() }}_shard_index = {{ this.shard_index }};
+            var {{ this.get_name() }}_loaded_shards = {};
+            function {{ this.get_name() }}_load_shards() {
+                var map = {{ this._parent.get_name() }};
+                if (map.getZoom() < {{ this.min_zoom }}) { return; }
+                var viewport = map.getBounds().pad(0.25);
+                {{ this.get_name() }}_shard_index.forEach(function (shard) {
+                    if ({{ this.get_name() }}_loaded_shards[shard.key]) { return; }
+                    var shard_bounds = L.latLngBounds([shard.bbox[0], shard.bbox[1]], [shard.bbox[2], shard.bbox[3]]);
+                    if (!viewport.intersects(shard_bounds)) { return; }
+                    {{ this.get_name() }}_loaded_shards[shard.key] = true;
+                    fetch('{{ this.shard_url_prefix }}' + shard.file)
+                        .then(function (response) { return response.json(); })
+                        .then(function (data) { {{ this.get_name() }}.addData(data); })
+                        .catch(function () { {{ this.get_name() }}_loaded_shards[shard.key] = false; });
+                });
+            }
+            {{ this._parent.get_name() }}.on('moveend', {{ this.get_name() }}_load_shards);
+            {{ this.get_name() }}_load_shards();
+            {% endif %}
+        {% endmacro %}
+        """)
+
+    def __init__(self, feature_collection, popup_fields=DEFAULT_POPUP_FIELDS, price_level_colors=PRICE_LEVEL_COLORS, default_color=DEFAULT_PLACE_COLOR,
+                 radius=3.5, fill_opacity=0.5, popup_width=300, popup_height=150, min_zoom=0, shard_index=None, shard_url_prefix=''):
+        super().__init__()
+        self._name = 'PlaceGeoJsonLayer'
+        self.min_zoom = min_zoom
+        # with a shard index the features are loaded from the shard files, so feature_collection can be None
+        self.data = dump_compact_geojson(feature_collection) if feature_collection else 'null'
+        self.shard_index = json.dumps(shard_index, separators=(',', ':')) if shard_index else None
+        self.shard_url_prefix = shard_url_prefix
+        self.colors = json.dumps({str(level): color for level, color in (price_level_colors or {}).items()})
+        self.popup_fields = json.dumps([[key, label] for key, label, _ in popup_fields])
+        self.link_fields = json.dumps(LINK_FIELDS)
+        self.default_color = default_color
+        self.radius = radius
+        self.fill_opacity = fill_opacity
+        self.popup_width = popup_width
+        self.popup_height = popup_height
+
+class DensityGridLayer(MacroElement):
+    '''renders the density grids from density_grids_for_client as canvas rectangles, switching to the finer grid as the map zooms in'''
+
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_levels = {{ this.levels }};
+            var {{ this.get_name() }}_colors = {{ this.colors }};
+            var {{ this.get_name() }}_renderer = L.canvas();
+            var {{ this.get_name() }}_layers = {};
+            var {{ this.get_name() }}_active = null;
+
+            // the rectangles for a zoom level are only built the first time that level is shown
+            function {{ this.get_name() }}_build(level) {
+                var group = L.layerGroup(), cells = level.cells, size = level.cell_size;
+                for (var i = 0; i < cells.length; i += 3) {
+                    var south = level.lat0 + cells[i] * size, west = level.lng0 + cells[i + 1] * size, value = cells[i + 2];
+                    var color = {{ this.get_name() }}_colors[Math.min({{ this.get_name() }}_colors.length - 1, Math.floor(value * {{ this.get_name() }}_colors.length))];
+                    L.rectangle([[south, west], [south + size, west + size]], {
+                        renderer: {{ this.get_name() }}_renderer,
+                        stroke: false,
+                        fillColor: color,
+                        fillOpacity: {{ this.fill_opacity }} * (0.3 + 0.7 * value),
+                        interactive: false
+                    }).addTo(group);
+                }
+                return group;
+            }
+
+            function {{ this.get_name() }}_update() {
+                var map = {{ this._parent.get_name() }}, zoom = map.getZoom(), level = null;
+                {{ this.get_name() }}_levels.forEach(function (candidate) { if (zoom >= candidate.min_zoom) { level = candidate; } });
+                if (zoom > {{ this.max_zoom }}) { level = null; }
+                var key = level ? level.min_zoom : null;
+                if (key === {{ this.get_name() }}_active) { return; }
+                if ({{ this.get_name() }}_active !== null) { map.removeLayer({{ this.get_name() }}_layers[{{ this.get_name() }}_active]); }
+                if (level) {
+                    if (!(key in {{ this.get_name() }}_layers)) { {{ this.get_name() }}_layers[key] = {{ this.get_name() }}_build(level); }
+                    {{ this.get_name() }}_layers[key].addTo(map);
+                }
+                {{ this.get_name() }}_active = key;
+            }
+            {{ this._parent.get_name() }}.on('zoomend', {{ this.get_name() }}_update);
+            {{ this.get_name() }}_update();
+        {% endmacro %}
+        """)
+
+    def __init__(self, client_levels, colors=DENSITY_COLORS, fill_opacity=0.6, max_zoom=18):
+        super().__init__()
+        self._name = 'DensityGridLayer'
+        self.levels = json.dumps(client_levels, separators=(',', ':'))
+        self.colors = json.dumps(colors)
+        self.fill_opacity = fill_opacity
+        self.max_zoom = max_zoom
+
+def add_density_layer(m, places, cache_folder, weight_field='rating', zoom_cell_sizes=DENSITY_ZOOM_CELL_SIZES, **layer_kwargs):
+    '''aggregates the (place_id, details) pairs into the density grids (cached in cache_folder) and adds the overlay to the folium map'''
+    lats, lngs, weights = place_coordinate_arrays(places, weight_field)
+    return add_density_layer_from_arrays(m, lats, lngs, weights, cache_folder, zoom_cell_sizes, **layer_kwargs)
+
+def add_density_layer_from_arrays(m, lats, lngs, weights, cache_folder, zoom_cell_sizes=DENSITY_ZOOM_CELL_SIZES, **layer_kwargs):
+    '''same as add_density_layer for coordinate / weight arrays that are already columns (place_snapshot.py, the place_filters.py frame)'''
+    grids = load_or_compute_density_grids(lats, lngs, weights, cache_folder, zoom_cell_sizes)
+    DensityGridLayer(density_grids_for_client(grids), **layer_kwargs).add_to(m)
+    return grids
+
+def add_place_layer(m, places, popup_fields=DEFAULT_POPUP_FIELDS, **layer_kwargs):
+    '''builds the FeatureCollection for the (place_id, details) pairs and adds it to the folium map, returns the number of features added'''
+    feature_collection = build_place_feature_collection(places, popup_fields)
+    PlaceGeoJsonLayer(feature_collection, popup_fields=popup_fields, **layer_kwargs).add_to(m)
+    return len(feature_collection['features'])
+
+def add_sharded_place_layer(m, places, shard_folder, shard_url_prefix, popup_fields=DEFAULT_POPUP_FIELDS, precision=SHARD_GEOHASH_PRECISION,
+                            max_features=SHARD_MAX_FEATURES, **layer_kwargs):
+    '''same as add_place_layer but writes the places to region shard files next to the map, shard_url_prefix is the shard folder relative to the map html.
+    the page fetches the shards, so it has to be served over http (python -m http.server) instead of opened as a file:// url'''
+    feature_collection = build_place_feature_collection(places, popup_fields)
+    shard_index = write_place_shards(feature_collection, shard_folder, precision, max_features)
+    PlaceGeoJsonLayer(None, popup_fields=popup_fields, shard_index=shard_index, shard_url_prefix=shard_url_prefix, **layer_kwargs).add_to(m)
+    return len(feature_collection['features'])
@@ -0,0 +1,419 @@
+'''
+
+This module holds the SpiderCrawlerMenuScraper from the google_api_data_feed.py roadmap: it visits the website of every place and collects the
+links that most likely lead to the menu (menu pages, menu pdfs, food / drink / wine list pages).
+
+The crawler is asynchronous (asyncio + aiohttp) so hundreds of sites are crawled at the same time with one shared connection pool:
+    - a global connection limit and a per host connection limit (the TCPConnector keeps the connections alive and reuses them per host)
+    - a minimum delay between two requests to the same host, so a single restaurant site is never hammered
+    - robots.txt is fetched once per host, cached, and checked before every request
+    - a bounded best first crawl per site (max_depth link hops from the home page, max_pages_per_site pages), limited to the same site
+    - a shared crawl frontier (crawl_frontier.py): canonical urls, a Bloom filter of the urls each crawl visited in this run and per crawl priority
+      queues that visit the likely menu paths first. places that share a website are crawled once, keyed by the website fingerprint
+
+The menu link candidates are written back on each place as menu_link_candidates (url, score, link text, depth), sorted by score.
+
+With a page_validators_path the home page of every site is fetched conditionally (http_validators.py ValidatorStore, the same validators the menu
+documents use): a 304 Not Modified, or a 200 with the same content hash as the last crawl, reuses the menu link candidates already stored on the
+place instead of crawling the site again. Only the home page is checked, a menu link that changed on an internal page while the home page stayed
+the same is not picked up until the home page changes (or the validators file is removed).
+
+Sites that render their navigation with javascript return no menu links over plain http. Only for those sites the home page is rendered again in a
+HeadlessBrowserPool session (browser_pool.py), and the crawler reports how often that fallback fired and what a page costs on each path.
+
+usage: python menu_crawler.py  (crawls the websites of every restaurant_data_*.json file in FILE_DROP_PATH)
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from bs4 import BeautifulSoup
+from browser_pool import HeadlessBrowserPool
+from concurrent.futures import ThreadPoolExecutor
+from crawl_frontier import CrawlFrontier, canonicalize_url, url_fingerprint
+from datetime import datetime, timedelta
+from http_validators import ValidatorStore
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+import aiohttp
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+# CONSTANTS ###################################################################################################################################
+
+CRAWLER_USER_AGENT = 'Mozilla/5.0 (compatible; RestaurantMenuResearchBot/1.0)'
+
+# words in the link text / url that point to a menu, with their weight in the candidate score
+MENU_LINK_KEYWORDS = {
+    'menu': 3.0,
+    'menus': 3.0,
+    'carte': 2.0,
+    'food': 1.5,
+    'dinner': 1.5,
+    'lunch': 1.5,
+    'brunch': 1.5,
+    'breakfast': 1.0,
+    'drinks': 1.5,
+    'cocktails': 1.5,
+    'wine': 1.5,
+    'beverage': 1.0,
+    'dessert': 1.0,
+    'happy hour': 1.0,
+    'tasting': 1.0,
+    'prix fixe': 1.0,
+    'eat': 0.5,
+}
+MENU_FILE_BONUS = 2.0  # pdf links that mention a menu are usually the menu itself
+MIN_MENU_LINK_SCORE = 1.5
+
+# links to these never lead to a menu page on the site itself
+SKIP_LINK_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.mp4', '.mov', '.zip', '.ics', '.css', '.js')
+SKIP_LINK_SCHEMES = ('mailto:', 'tel:', 'javascript:', 'sms:')
+
+WORD_PATTERN = re.compile(r'[a-z]+')
+
+# FUNCTIONS ###################################################################################################################################
+
+def site_key(url):
+    '''host without the www. prefix, used to keep the crawl on the same site and for the per host politeness'''
+    host = urlparse(url).netloc.lower()
+    return host[4:] if host.startswith('www.') else host
+
+def score_menu_link(url, text):
+    '''scores how likely a link is to lead to a menu, from the keywords in the link text and in the url path'''
+    path = urlparse(url).path.lower()
+    haystack = f"{(text or '').lower()} {' '.join(WORD_PATTERN.findall(path))}"
+    score = 0.0
+    for keyword, weight in MENU_LINK_KEYWORDS.items():
+        if re.search(rf'\b{keyword}\b', haystack):
+            score += weight
+    if score and path.endswith('.pdf'):
+        score += MENU_FILE_BONUS
+    return score
+
+def extract_links(html, base_url):
+    '''returns [(canonical absolute url, link text)] for the followable links of a page'''
+    soup = BeautifulSoup(html, 'html.parser')
+    links = []
+    for anchor in soup.find_all('a', href=True):
+        href = anchor['href'].strip()
+        if not href or href.startswith('#') or href.lower().startswith(SKIP_LINK_SCHEMES):
+            continue
+        url = canonicalize_url(href, base_url)
+        if url is None or urlparse(url).path.lower().endswith(SKIP_LINK_EXTENSIONS):
+            continue
+        links.append((url, anchor.get_text(' ', strip=True)))
+    return links
+
+def website_fingerprint(website):
+    '''dedup key of a place website, the same site written with / without https, www. or tracking parameters gives the same key'''
+    canonical = canonicalize_url(website if urlparse(website).scheme else f"https://{website}")
+    return url_fingerprint(canonical) if canonical else website
+
+# CLASSES ###################################################################################################################################
+
+class SpiderCrawlerMenuScraper:
+    def __init__(self, max_concurrency=64, per_host_limit=2, per_host_delay=1.0, max_depth=2, max_pages_per_site=15, request_timeout=20,
+                 user_agent=CRAWLER_USER_AGENT, data_shelf_life=30, browser_fallback=True, browser_pool_size=2, max_pages_per_browser=50,
+                 max_pending_urls=100_000, page_validators_path=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.max_concurrency = max_concurrency
+        self.per_host_limit = per_host_limit
+        self.per_host_delay = per_host_delay  # Seconds between two requests to the same host
+        self.max_depth = max_depth
+        self.max_pages_per_site = max_pages_per_site
+        self.request_timeout = request_timeout
+        self.user_agent = user_agent
+        self.data_shelf_life = data_shelf_life  # Days
+        self.robots_cache = {}
+        self.host_locks = {}
+        self.host_last_request = {}
+        self.max_pending_urls = max_pending_urls
+        self.frontier = None
+        self.page_validators = ValidatorStore(page_validators_path) if page_validators_path else None
+        self.sites_not_modified = 0
+        self.sites_unreachable = 0
+        self.browser_fallback = browser_fallback
+        self.browser_pool_size = browser_pool_size
+        self.max_pages_per_browser = max_pages_per_browser
+        self.browser_pool = None
+        self.browser_executor = None
+        self.pages_fetched = 0
+        self.fetch_seconds = 0.0
+        self.browser_fallbacks = 0
+        self.browser_metrics = None
+
+    async def wait_for_host(self, host):
+        '''serializes the request start times per host so two requests to the same host are at least per_host_delay apart'''
+        lock = self.host_locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            wait = self.host_last_request.get(host, 0) + self.per_host_delay - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.host_last_request[host] = time.monotonic()
+
+    async def load_robots(self, session, url):
+        parsed = urlparse(url)
+        origin = f"{parsed.scheme}://{parsed.netloc}"
+        if origin not in self.robots_cache:
+            # the task is cached (not the result) so concurrent requests for the same origin share one robots.txt download
+            self.robots_cache[origin] = asyncio.ensure_future(self.fetch_robots(session, origin))
+        return await self.robots_cache[origin]
+
+    async def fetch_robots(self, session, origin):
+        robots = RobotFileParser()
+        try:
+            await self.wait_for_host(site_key(origin))
+            async with session.get(f"{origin}/robots.txt") as response:
+                if response.status >= 400:
+                    # no robots.txt (or a broken one) means everything is allowed
+                    robots.parse([])
+                else:
+                    robots.parse((await response.text(errors='replace')).splitlines())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.info(f"{self.fetch_robots.__name__} - robots.txt not available for {origin}: {e}")
+            robots.parse([])
+        return robots
+
+    async def fetch_page(self, session, url, conditional=False):
+        '''returns (final url, html, status) with status 'ok' for html pages and (final url, None, None) for everything else or on errors. a
+        conditional fetch sends the stored validators of the url and stores the new ones, status is then 'not_modified' (304, html None) or
+        'unchanged' (same content hash as the last fetch) when the page did not change'''
+        robots = await self.load_robots(session, url)
+        if not robots.can_fetch(self.user_agent, url):
+            self.logger.info(f"{self.fetch_page.__name__} - Disallowed by robots.txt: {url}")
+            return url, None, None
+        headers = self.page_validators.conditional_headers(url) if conditional else {}
+        await self.wait_for_host(site_key(url))
+        started = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as response:
+                self.pages_fetched += 1
+                if response.status == 304 and headers:
+                    self.page_validators.mark_not_modified(url)
+                    return url, None, 'not_modified'
+                if response.status >= 400 or 'html' not in response.headers.get('Content-Type', ''):
+                    return str(response.url), None, None
+                html = await response.text(errors='replace')
+                if conditional:
+                    digest = hashlib.sha256(html.encode('utf-8')).hexdigest()
+                    if not self.page_validators.update(url, response.headers, digest, 'html'):
+                        return str(response.url), html, 'unchanged'
+                return str(response.url), html, 'ok'
+        except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeDecodeError) as e:
+            self.logger.warning(f"{self.fetch_page.__name__} - Error fetching {url}: {e}")
+            return url, None, None
+        finally:
+            self.fetch_seconds += time.perf_counter() - started
+
+    async def render_page(self, url):
+        '''renders the page in a pooled headless browser without blocking the event loop, returns (final url, html or None)'''
+        if self.browser_pool is None:
+            self.browser_pool = HeadlessBrowserPool(pool_size=self.browser_pool_size, max_pages_per_browser=self.max_pages_per_browser,
+                                                    user_agent=self.user_agent)
+            self.browser_executor = ThreadPoolExecutor(max_workers=self.browser_pool_size)
+        self.browser_fallbacks += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.browser_executor, self.browser_pool.render, url)
+        except Exception as e:
+            # a missing chrome / chromedriver only disables the fallback, the static results are kept
+            self.logger.error(f"{self.render_page.__name__} - Browser fallback failed for {url}: {e}")
+            if self.browser_pool.browsers_created == 0:
+                # no browser could be started at all, do not retry it for every remaining site
+                print(f"Headless browser unavailable, browser fallback disabled: {e}")
+                self.browser_fallback = False
+            return url, None
+
+    def collect_candidates(self, candidates, html, page_url, depth):
+        '''adds the menu links of the page to candidates and returns [(score, link)] for all the links of the page'''
+        links = []
+        for link, text in extract_links(html, page_url):
+            score = score_menu_link(link, text)
+            if score >= MIN_MENU_LINK_SCORE:
+                candidate = candidates.get(link)
+                if candidate is None or candidate['score'] < score:
+                    candidates[link] = {'url': link, 'score': score, 'text': text[:200], 'depth': depth + 1}
+            links.append((score, link))
+        return links
+
+    async def crawl_site(self, session, website, crawl, previous_candidates=None):
+        '''bounded best first crawl of one site, returns the menu link candidates sorted by score, or None when the home page could not be fetched
+        (timeout, dns, 5xx, disallowed) so the candidates of the last crawl are kept. crawl is the frontier key of this crawl (the website
+        fingerprint), two crawls on the same host keep their own queue and seen urls. previous_candidates (the candidates of the last crawl) are
+        returned as they are when the home page did not change since then'''
+        home = canonicalize_url(website if urlparse(website).scheme else f"https://{website}")
+        site = site_key(home)
+        self.frontier.mark_seen(crawl, home)
+        next_url = (home, 0)
+        candidates = {}
+        pages = 0
+        home_fetched = False
+        while next_url and pages < self.max_pages_per_site:
+            url, depth = next_url
+            if pages == 0 and self.page_validators is not None:
+                final_url, html, status = await self.fetch_page(session, url, conditional=True)
+                if status in ('not_modified', 'unchanged'):
+                    if previous_candidates is not None:
+                        self.sites_not_modified += 1
+                        return [dict(candidate) for candidate in previous_candidates]
+                    if html is None:
+                        # validators without stored candidates (the place lost them), the body is needed
+                        final_url, html, status = await self.fetch_page(session, url)
+            else:
+                final_url, html, status = await self.fetch_page(session, url)
+            if pages == 0:
+                home_fetched = html is not None
+            pages += 1
+            if html is not None:
+                for score, link in self.collect_candidates(candidates, html, final_url, depth):
+                    if site_key(link) != site or depth + 1 > self.max_depth or link.lower().endswith('.pdf'):
+                        continue
+                    # the most promising links are visited first, so the page budget is spent on the menu-ish pages
+                    self.frontier.push(crawl, link, depth + 1, score)
+            next_url = self.frontier.pop(crawl)
+        self.frontier.drop_crawl(crawl)
+        if not home_fetched:
+            # a site that is down for a moment does not lose its known menu links, it is crawled again on the next run
+            self.logger.info(f"{self.crawl_site.__name__} - Home page not fetched, keeping the previous menu links of {home}")
+            return None
+
+        # only a home page that was fetched but had no menu links in its static html is rendered (most likely a javascript rendered site), a home
+        # page that is disallowed by robots.txt or failed to download is not retried in the browser
+        if not candidates and self.browser_fallback:
+            robots = await self.load_robots(session, home)
+            if robots.can_fetch(self.user_agent, home):
+                final_url, html = await self.render_page(home)
+                if html is not None:
+                    self.collect_candidates(candidates, html, final_url, 0)
+        return sorted(candidates.values(), key=lambda candidate: (-candidate['score'], candidate['depth']))
+
+    async def crawl_websites(self, websites, previous_candidates=None):
+        '''{place_id: website} -> {place_id: menu link candidates}, all sites are crawled concurrently over one session. previous_candidates
+        ({website fingerprint: candidates of the last crawl}) are reused for the sites whose home page did not change. the places of the sites
+        that failed or whose home page could not be fetched are left out'''
+        previous_candidates = previous_candidates or {}
+        # the asyncio locks belong to the event loop of this run
+        self.host_locks = {}
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, limit_per_host=self.per_host_limit, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        headers = {'User-Agent': self.user_agent, 'Accept': 'text/html,application/xhtml+xml'}
+        # places that share a website (chain locations, food halls) are crawled once
+        place_ids_by_site = {}
+        for place_id, website in websites.items():
+            place_ids_by_site.setdefault(website_fingerprint(website), []).append(place_id)
+        sites = list(place_ids_by_site)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            results = await asyncio.gather(*(self.crawl_site(session, websites[place_ids_by_site[site][0]], site, previous_candidates.get(site))
+                                             for site in sites), return_exceptions=True)
+        menu_links = {}
+        for site, result in zip(sites, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"{self.crawl_websites.__name__} - Crawl failed for {site}: {result}")
+                continue
+            if result is None:
+                self.sites_unreachable += 1
+                continue
+            for place_id in place_ids_by_site[site]:
+                menu_links[place_id] = [dict(candidate) for candidate in result]
+        return menu_links
+
+    def needs_crawl(self, place):
+        if not place.get('website'):
+            return False
+        try:
+            last_crawled = datetime.fromisoformat(place.get('menu_links_last_updated', '1970-01-01T00:00:00'))
+        except ValueError:
+            last_crawled = datetime(1970, 1, 1)
+        return datetime.now() - last_crawled >= timedelta(days=self.data_shelf_life)
+
+    def record_menu_links(self, places):
+        '''crawls the websites of the places that were never crawled (or longer ago than the shelf life) and records the menu link candidates
+        on the place dicts in place. returns the number of places crawled'''
+        websites = {}
+        fresh_candidates = {}
+        previous_candidates = {}
+        for place_id, place in places.items():
+            if not isinstance(place, dict) or not place.get('website'):
+                continue
+            if self.needs_crawl(place):
+                websites[place_id] = place['website']
+                if 'menu_link_candidates' in place:
+                    previous_candidates[website_fingerprint(place['website'])] = place['menu_link_candidates']
+            elif 'menu_link_candidates' in place:
+                fresh_candidates[website_fingerprint(place['website'])] = place
+        # a new place on a website that was crawled recently for another place (same chain) reuses those menu links
+        for place_id in list(websites):
+            shared = fresh_candidates.get(website_fingerprint(websites[place_id]))
+            if shared is not None:
+                places[place_id]['menu_link_candidates'] = [dict(candidate) for candidate in shared['menu_link_candidates']]
+                places[place_id]['menu_links_last_updated'] = shared['menu_links_last_updated']
+                del websites[place_id]
+        if not websites:
+            return 0
+        print(f"Crawling {len(websites)} restaurant websites for menu links...")
+        started = time.perf_counter()
+        self.pages_fetched = 0
+        self.fetch_seconds = 0.0
+        self.browser_fallbacks = 0
+        self.sites_not_modified = 0
+        self.sites_unreachable = 0
+        self.frontier = CrawlFrontier(max_pending=self.max_pending_urls)
+        try:
+            menu_links = asyncio.run(self.crawl_websites(websites, previous_candidates))
+        finally:
+            self.close_browser_pool()
+        if self.page_validators is not None:
+            self.page_validators.save()
+        now = datetime.now().isoformat()
+        for place_id, candidates in menu_links.items():
+            places[place_id]['menu_link_candidates'] = candidates
+            places[place_id]['menu_links_last_updated'] = now
+        found = sum(1 for candidates in menu_links.values() if candidates)
+        print(f"Menu links found for {found}/{len(websites)} websites, {self.pages_fetched} pages in {time.perf_counter() - started:.1f} seconds "
+              f"({self.sites_unreachable} sites unreachable, their previous menu links are kept)")
+        self.logger.info(f"{self.record_menu_links.__name__} - {found}/{len(websites)} websites with menu links, {self.pages_fetched} pages fetched")
+        self.report_metrics(len(websites))
+        return len(menu_links)
+
+    def report_metrics(self, site_count):
+        http_seconds_per_page = self.fetch_seconds / max(self.pages_fetched, 1)
+        print(f"Static http: {self.pages_fetched} pages, {http_seconds_per_page:.3f} seconds per page, {self.sites_not_modified} sites "
+              f"not modified since the last crawl, frontier {self.frontier.stats()}")
+        if self.browser_fallbacks:
+            browser_metrics = self.browser_metrics or {}
+            print(f"Browser fallback: {self.browser_fallbacks}/{site_count} sites ({self.browser_fallbacks / site_count:.0%}), "
+                  f"{browser_metrics.get('seconds_per_page', 0):.3f} seconds per page "
+                  f"+ {browser_metrics.get('startup_seconds_per_page', 0):.3f} seconds browser start up per page")
+        self.logger.info(f"{self.report_metrics.__name__} - http pages {self.pages_fetched} ({http_seconds_per_page:.3f}s/page), "
+                         f"browser fallbacks {self.browser_fallbacks}/{site_count}, browser metrics {self.browser_metrics}")
+
+    def close_browser_pool(self):
+        self.browser_metrics = self.browser_pool.metrics() if self.browser_pool else None
+        if self.browser_executor:
+            self.browser_executor.shutdown(wait=True)
+        if self.browser_pool:
+            self.browser_pool.close()
+        self.browser_pool = None
+        self.browser_executor = None
+
+# MAIN EXECUTION ###################################################################################################################################
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    FILE_DROP_PATH = os.getenv('FILE_DROP_PATH')
+    logging.basicConfig(filename='menu_crawler.log', level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    scraper = SpiderCrawlerMenuScraper(page_validators_path=os.path.join(FILE_DROP_PATH, 'menu_page_validators.json'))
+    for json_file_path in sorted(glob.glob(os.path.join(FILE_DROP_PATH, 'restaurant_data_*.json'))):
+        with open(json_file_path, 'r') as file:
+            places = json.load(file)
+        if scraper.record_menu_links(places):
+            with open(json_file_path, 'w') as file:
+                json.dump(places, file, indent=4)
+            print(f"Menu links saved to {json_file_path}")
@@ -0,0 +1,160 @@
+'''
+
+This module parses the extracted menu text (menu_text_extraction.py) into priced menu lines and attaches the menu price summary statistics from the
+google_api_data_feed.py roadmap ("average appetizer price, average salad price, average entree price, ...") to the places.
+
+All the menus of a batch are parsed together as one frame of lines with precompiled patterns and pandas string methods:
+    - section headers (Appetizers, Starters, Mains, By the Glass, ...) are detected with one vectorized match per section and forward filled
+      over the lines that follow them in the same document
+    - the price of every line is extracted with one vectorized regex ($14, 14, 14.50, "glass / bottle" pairs take the first price)
+    - the per section mean / median / min / max / count are computed with a single groupby for all the places at once
+
+Documents shared by several places (chain menus, same content_hash) are parsed once and joined back to every place.
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from datetime import datetime
+import logging
+import numpy as np
+import pandas as pd
+import re
+
+# CONSTANTS ###################################################################################################################################
+
+# section -> header words, checked in this order (the first section whose header pattern matches wins)
+MENU_SECTION_KEYWORDS = {
+    'wine_glass': ['wines? by the glass', 'by the glass', 'glass pours'],
+    'wine_bottle': ['wines? by the bottle', 'by the bottle', 'bottle list'],
+    'appetizer': ['appetizers?', 'starters?', 'small plates', 'snacks', 'shareables', 'to share', 'antipasti', 'apps', 'first course', 'raw bar'],
+    'salad': ['salads?', 'greens'],
+    'soup': ['soups?', 'soups? (?:and|&) salads?'],
+    'entree': ['entrees?', 'entrées?', 'mains?', 'main courses?', 'large plates', 'secondi', 'plates', 'second course', 'from the grill', 'dinner'],
+    'pasta': ['pastas?', 'primi', 'noodles'],
+    'pizza': ['pizzas?', 'pies'],
+    'sandwich': ['sandwich(?:es)?', 'burgers?', 'handhelds', 'tacos'],
+    'side': ['sides?', 'side dishes', 'accompaniments', 'contorni', 'extras', 'add ons?'],
+    'dessert': ['desserts?', 'sweets', 'dolci', 'after dinner'],
+    'cocktail': ['cocktails?', 'signature cocktails?', 'craft cocktails?', 'spirits', 'mocktails?'],
+    'wine': ['wines?', 'wine list', 'sparkling', 'whites?', 'reds?', 'rosés?', 'roses?'],
+    'beer': ['beers?', 'drafts?', 'draughts?', 'on tap', 'bottles (?:and|&) cans', 'cans'],
+    'non_alcoholic': ['coffee', 'tea', 'coffee (?:and|&) tea', 'soft drinks', 'non alcoholic', 'beverages', 'juices?'],
+    'breakfast': ['breakfast', 'brunch', 'morning'],
+}
+
+# a header line is short, has no price and is only the section words (with optional "our" / "house" and punctuation around them)
+MAX_HEADER_LENGTH = 40
+SECTION_HEADER_PATTERNS = {
+    section: re.compile(rf"^\W*(?:our |the |house )?(?:{'|'.join(keywords)})\W*$", re.IGNORECASE)
+    for section, keywords in MENU_SECTION_KEYWORDS.items()
+}
+
+# $14 / $ 14.50 anywhere in the line, or a bare 1-3 digit price at the end of the line ("Steak Frites 32", "Burrata 16.5 / 30")
+PRICE_PATTERN = re.compile(r'\$\s?(?P<dollar>\d{1,4}(?:\.\d{1,2})?)|(?<![\d.])(?P<trailing>\d{1,3}(?:\.\d{1,2})?)(?:\s*/\s*\d{1,4}(?:\.\d{1,2})?)?\s*$')
+# lines that end with a number but are not priced items (phone numbers, "est. 1998", street addresses)
+NOT_PRICE_PATTERN = re.compile(r'\d{3}[-. ]\d{4}|\b(?:19|20)\d{2}\s*$|\b(?:suite|ste|unit|floor|zip)\b', re.IGNORECASE)
+
+MIN_MENU_PRICE = 1.0
+MAX_MENU_PRICE = 1000.0
+
+SUMMARY_STATISTICS = ['mean', 'median', 'min', 'max', 'count']
+
+# FUNCTIONS ###################################################################################################################################
+
+def menu_lines_frame(texts_by_document):
+    '''{document key: menu text} -> frame of (document, line_number, text), one row per non empty line of every document'''
+    documents = []
+    lines = []
+    for document, text in texts_by_document.items():
+        document_lines = (text or '').split('\n')
+        documents.extend([document] * len(document_lines))
+        lines.extend(document_lines)
+    frame = pd.DataFrame({'document': documents, 'text': lines})
+    frame['line_number'] = frame.groupby('document', sort=False).cumcount()
+    frame['text'] = frame['text'].str.strip()
+    return frame[frame['text'] != ''].reset_index(drop=True)
+
+def classify_menu_sections(lines):
+    '''adds the section column: the section of the closest header above each line in the same document (NaN before the first header)'''
+    text = lines['text']
+    is_header_candidate = (text.str.len() <= MAX_HEADER_LENGTH).to_numpy()
+    header_section = pd.Series(np.nan, index=lines.index, dtype=object)
+    for section, pattern in SECTION_HEADER_PATTERNS.items():
+        matches = is_header_candidate & header_section.isna().to_numpy() & text.str.match(pattern).to_numpy()
+        header_section[matches] = section
+    lines['is_header'] = header_section.notna()
+    lines['section'] = header_section.groupby(lines['document'], sort=False).ffill()
+    return lines
+
+def extract_menu_prices(lines):
+    '''adds the price column (float, NaN for the lines without a price)'''
+    prices = lines['text'].str.extract(PRICE_PATTERN)
+    price = pd.to_numeric(prices['dollar'].fillna(prices['trailing']), errors='coerce')
+    # a bare trailing number only counts as a price on a line that also has words (not a lone page number) and is not a phone number / year
+    bare = prices['dollar'].isna()
+    has_words = lines['text'].str.contains(r'[A-Za-z]{2,}', regex=True)
+    not_price = lines['text'].str.contains(NOT_PRICE_PATTERN)
+    price = price.where(~bare | (has_words & ~not_price))
+    lines['price'] = price.where((price >= MIN_MENU_PRICE) & (price <= MAX_MENU_PRICE))
+    return lines
+
+def parse_menu_texts(texts_by_document):
+    '''parses a batch of menus in one pass, returns the priced item lines: document, line_number, text, section, price'''
+    lines = menu_lines_frame(texts_by_document)
+    if lines.empty:
+        return lines.assign(section=pd.Series(dtype=object), price=pd.Series(dtype=float))
+    lines = extract_menu_prices(classify_menu_sections(lines))
+    return lines[~lines['is_header'] & lines['price'].notna()].drop(columns='is_header')
+
+def summarize_menu_prices(items, place_documents):
+    '''items: parse_menu_texts output, place_documents: frame of (place_id, document).
+    returns {place_id: {section: {mean, median, min, max, count}}} with an 'all_items' entry over every priced line of the place'''
+    priced = place_documents.merge(items[['document', 'section', 'price']], on='document', how='inner')
+    if priced.empty:
+        return {}
+    priced['section'] = priced['section'].fillna('unsectioned')
+    by_section = priced.groupby(['place_id', 'section'], sort=False)['price'].agg(SUMMARY_STATISTICS)
+    overall = priced.groupby('place_id', sort=False)['price'].agg(SUMMARY_STATISTICS)
+    overall['section'] = 'all_items'
+    summary = pd.concat([by_section.reset_index(), overall.reset_index()], ignore_index=True)
+    summary[['mean', 'median', 'min', 'max']] = summary[['mean', 'median', 'min', 'max']].round(2)
+    summary['count'] = summary['count'].astype(int)
+
+    summaries = {}
+    for row in summary.itertuples(index=False):
+        summaries.setdefault(row.place_id, {})[row.section] = {
+            'mean': float(row.mean), 'median': float(row.median), 'min': float(row.min), 'max': float(row.max), 'count': int(row.count),
+        }
+    return summaries
+
+def record_menu_price_summaries(places, menu_text_cache):
+    '''parses the menu documents of all the places in one batch and sets menu_price_summary on each place dict whose menu documents changed'''
+    logger = logging.getLogger('record_menu_price_summaries')
+    place_documents = []
+    texts_by_document = {}
+    for place_id, place in places.items():
+        if not isinstance(place, dict) or not place.get('menu_documents'):
+            continue
+        document_hashes = sorted(document['content_hash'] for document in place['menu_documents'])
+        # unchanged menus (304 / same content hash on the refresh) keep their summary without being parsed again
+        if 'menu_price_summary' in place and place.get('menu_price_summary_documents') == document_hashes:
+            continue
+        for document in place['menu_documents']:
+            digest = document['content_hash']
+            place_documents.append((place_id, digest))
+            if digest not in texts_by_document:
+                texts_by_document[digest] = menu_text_cache.get(digest) or ''
+    if not place_documents:
+        return 0
+
+    started = datetime.now()
+    items = parse_menu_texts(texts_by_document)
+    summaries = summarize_menu_prices(items, pd.DataFrame(place_documents, columns=['place_id', 'document']).drop_duplicates())
+    now = datetime.now().isoformat()
+    for place_id in {place_id for place_id, _ in place_documents}:
+        places[place_id]['menu_price_summary'] = summaries.get(place_id, {})
+        places[place_id]['menu_price_summary_documents'] = sorted(document['content_hash'] for document in places[place_id]['menu_documents'])
+        places[place_id]['menu_price_summary_last_updated'] = now
+    print(f"Menu prices: {len(items)} priced items from {len(texts_by_document)} menus, summaries for {len(summaries)} places in {datetime.now() - started}")
+    logger.info(f"record_menu_price_summaries - {len(items)} priced items, {len(texts_by_document)} documents, {len(summaries)} places")
+    return len(summaries)
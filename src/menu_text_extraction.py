@@ -0,0 +1,330 @@
+'''
+
+This module turns the menu link candidates found by the SpiderCrawlerMenuScraper into normalized menu text (the body text of the menu page or the
+menu pdf) for the menu parsing steps.
+
+The work is split in two stages connected by a queue:
+    - the download stage is asynchronous (aiohttp) and reuses the crawler politeness (robots.txt cache and the per host delay)
+    - the extraction stage (pypdf for pdfs, BeautifulSoup for html) is CPU bound, so it runs in a ProcessPoolExecutor and never stalls the event loop
+
+Every downloaded document is hashed (sha256 of the raw bytes) and the extracted text is cached on disk by that hash, so the same menu pdf shared by
+all the locations of a chain (or downloaded again on the next run) is only extracted once. Identical documents that are in flight at the same time
+share one extraction job. A url shared by several places is downloaded once per run.
+
+Refreshes are conditional (http_validators.py): the ETag / Last-Modified / content hash of every url are stored, a 304 Not Modified or an unchanged
+content hash reuses the cached text without any parsing, so a refresh of unchanged menus costs mostly header round trips.
+
+The places get a menu_documents list (url, content_hash, kind, text_length), the text itself is read with MenuTextCache.get(content_hash).
+
+usage: python menu_text_extraction.py  (extracts the menus of every restaurant_data_*.json file in FILE_DROP_PATH)
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from http_validators import ValidatorStore
+from menu_crawler import CRAWLER_USER_AGENT, SpiderCrawlerMenuScraper, site_key
+from pypdf import PdfReader
+import aiohttp
+import asyncio
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+
+# CONSTANTS ###################################################################################################################################
+
+MAX_DOCUMENT_BYTES = 20 * 1024 * 1024  # menus bigger than this are image scans or not menus at all
+MAX_DOCUMENTS_PER_PLACE = 3
+
+# page parts that never hold the menu text
+HTML_TAGS_TO_DROP = ['script', 'style', 'noscript', 'template', 'svg', 'iframe', 'nav', 'header', 'footer', 'form']
+
+MULTIPLE_SPACES_PATTERN = re.compile(r'[ \t\u00a0\u2000-\u200b]+')
+DOT_LEADER_PATTERN = re.compile(r'(?:\s*\.){3,}\s*')  # "Burger ........ 14" -> "Burger 14"
+PRICE_SPACING_PATTERN = re.compile(r'\$\s+(?=\d)')
+
+# FUNCTIONS ###################################################################################################################################
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+def document_kind(url, content_type, content):
+    if content.startswith(b'%PDF') or 'pdf' in (content_type or '') or url.lower().split('?')[0].endswith('.pdf'):
+        return 'pdf'
+    return 'html'
+
+def normalize_menu_text(text):
+    '''unicode / whitespace normalization that keeps one menu line per line'''
+    text = unicodedata.normalize('NFKC', text).replace('–', '-').replace('—', '-')
+    lines = []
+    for line in text.splitlines():
+        line = DOT_LEADER_PATTERN.sub(' ', line)
+        line = PRICE_SPACING_PATTERN.sub('$', line)
+        line = MULTIPLE_SPACES_PATTERN.sub(' ', line).strip()
+        if line:
+            lines.append(line)
+    return '\n'.join(lines)
+
+def extract_pdf_text(content):
+    reader = PdfReader(io.BytesIO(content))
+    return '\n'.join(page.extract_text() or '' for page in reader.pages)
+
+def extract_html_text(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    for tag in soup(HTML_TAGS_TO_DROP):
+        tag.decompose()
+    return soup.get_text('\n')
+
+def extract_menu_text(content, kind):
+    '''runs in the worker processes, so it only takes and returns plain picklable values'''
+    try:
+        text = extract_pdf_text(content) if kind == 'pdf' else extract_html_text(content)
+    except Exception as e:
+        # broken / encrypted pdfs are cached as empty text so they are not extracted again
+        logging.getLogger('extract_menu_text').warning(f"extract_menu_text - Could not extract {kind} text: {e}")
+        return ''
+    return normalize_menu_text(text)
+
+# CLASSES ###################################################################################################################################
+
+class MenuTextCache:
+    '''extracted menu text stored as {content_hash}.txt files'''
+    def __init__(self, cache_folder):
+        self.cache_folder = cache_folder
+        if not os.path.exists(self.cache_folder):
+            os.makedirs(self.cache_folder)
+
+    def path(self, digest):
+        return os.path.join(self.cache_folder, f'{digest}.txt')
+
+    def contains(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def get(self, digest):
+        if not self.contains(digest):
+            return None
+        with open(self.path(digest), 'r', encoding='utf-8') as file:
+            return file.read()
+
+    def put(self, digest, text):
+        temp_path = f"{self.path(digest)}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(temp_path, self.path(digest))
+
+class MenuTextExtractor:
+    def __init__(self, cache_folder, crawler=None, max_workers=None, download_concurrency=32, queue_size=64, max_documents_per_place=MAX_DOCUMENTS_PER_PLACE,
+                 request_timeout=30, data_shelf_life=30):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.cache = MenuTextCache(cache_folder)
+        self.validators = ValidatorStore(os.path.join(cache_folder, 'menu_validators.json'))
+        # the crawler holds the robots.txt cache and the per host delay, the downloads here follow the same rules
+        self.crawler = crawler or SpiderCrawlerMenuScraper(browser_fallback=False)
+        self.max_workers = max_workers or os.cpu_count()
+        self.download_concurrency = download_concurrency
+        self.queue_size = queue_size
+        self.max_documents_per_place = max_documents_per_place
+        self.request_timeout = request_timeout
+        self.data_shelf_life = data_shelf_life  # Days
+        self.stats = {}
+
+    def needs_extraction(self, place):
+        if not place.get('menu_link_candidates'):
+            return False
+        # new menu links since the last extraction are picked up even inside the shelf life
+        if place.get('menu_documents_last_updated', '') < place.get('menu_links_last_updated', ''):
+            return True
+        try:
+            last_extracted = datetime.fromisoformat(place.get('menu_documents_last_updated', '1970-01-01T00:00:00'))
+        except ValueError:
+            last_extracted = datetime(1970, 1, 1)
+        return datetime.now() - last_extracted >= timedelta(days=self.data_shelf_life)
+
+    async def download(self, session, url):
+        '''returns ('not_modified', None, None), ('ok', content bytes, response headers) or (None, None, None)'''
+        robots = await self.crawler.load_robots(session, url)
+        if not robots.can_fetch(self.crawler.user_agent, url):
+            return None, None, None
+        # the validators are only sent when the text of the stored version is still in the cache, otherwise the body is needed
+        validator = self.validators.get(url)
+        headers = self.validators.conditional_headers(url) if validator and self.cache.contains(validator['content_hash']) else {}
+        await self.crawler.wait_for_host(site_key(url))
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and headers:
+                    return 'not_modified', None, None
+                if response.status >= 400 or (response.content_length or 0) > MAX_DOCUMENT_BYTES:
+                    return None, None, None
+                content = bytearray()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    content.extend(chunk)
+                    if len(content) > MAX_DOCUMENT_BYTES:
+                        return None, None, None
+                return 'ok', bytes(content), response.headers
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.warning(f"{self.download.__name__} - Error downloading {url}: {e}")
+            return None, None, None
+
+    def cached_document(self, url, digest, kind):
+        return {'url': url, 'content_hash': digest, 'kind': kind, 'text_length': len(self.cache.get(digest) or '')}
+
+    async def download_worker(self, session, jobs, documents, results):
+        while True:
+            url = await jobs.get()
+            if url is None:
+                jobs.task_done()
+                return
+            status, content, response_headers = await self.download(session, url)
+            if status == 'not_modified':
+                # 304: the cached text is current, nothing to download or parse
+                self.stats['not_modified'] += 1
+                self.validators.mark_not_modified(url)
+                validator = self.validators.get(url)
+                results[url] = self.cached_document(url, validator['content_hash'], validator['kind'])
+            elif status == 'ok':
+                self.stats['downloaded'] += 1
+                self.stats['downloaded_bytes'] += len(content)
+                kind = document_kind(url, response_headers.get('Content-Type', ''), content)
+                digest = content_hash(content)
+                changed = self.validators.update(url, response_headers, digest, kind)
+                if not changed and self.cache.contains(digest):
+                    # same bytes as last time (no validators on the server), the cached text is reused
+                    self.stats['unchanged'] += 1
+                    results[url] = self.cached_document(url, digest, kind)
+                else:
+                    await documents.put((url, content, kind, digest))
+            jobs.task_done()
+
+    async def extraction_worker(self, documents, process_pool, in_flight, results):
+        loop = asyncio.get_running_loop()
+        while True:
+            document = await documents.get()
+            if document is None:
+                documents.task_done()
+                return
+            url, content, kind, digest = document
+            try:
+                if self.cache.contains(digest):
+                    self.stats['cache_hits'] += 1
+                elif digest in in_flight:
+                    # the same document (another location of the chain) is being extracted right now
+                    self.stats['cache_hits'] += 1
+                    await in_flight[digest]
+                else:
+                    in_flight[digest] = loop.run_in_executor(process_pool, extract_menu_text, content, kind)
+                    text = await in_flight[digest]
+                    self.cache.put(digest, text)
+                    self.stats['extracted'] += 1
+                results[url] = self.cached_document(url, digest, kind)
+            except Exception as e:
+                # a broken process pool or a failed cache write loses this document only, it is recorded without text (and not cached, so the
+                # next run extracts it again) and the worker keeps draining the queue so the downloaders never block on it
+                self.logger.error(f"{self.extraction_worker.__name__} - Extraction failed for {url}: {e!r}")
+                self.stats['failed'] += 1
+                results[url] = {'url': url, 'content_hash': digest, 'kind': kind, 'text_length': 0}
+            finally:
+                documents.task_done()
+
+    async def close_documents(self, downloaders, documents, extractor_count):
+        '''waits for the downloads and then sends one end marker per extraction worker'''
+        await asyncio.gather(*downloaders)
+        for _ in range(extractor_count):
+            await documents.put(None)
+
+    async def extract_urls(self, urls):
+        '''[menu urls] -> {url: menu document} for the urls that could be downloaded (or were not modified)'''
+        # the documents queue is bounded so the downloads never run far ahead of the extraction (the raw bytes stay in memory until extracted)
+        jobs = asyncio.Queue()
+        documents = asyncio.Queue(maxsize=self.queue_size)
+        results = {}
+        in_flight = {}
+        for url in urls:
+            jobs.put_nowait(url)
+
+        # the asyncio locks in the crawler belong to the event loop of the previous run
+        self.crawler.host_locks = {}
+        connector = aiohttp.TCPConnector(limit=self.download_concurrency, limit_per_host=self.crawler.per_host_limit, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        headers = {'User-Agent': self.crawler.user_agent or CRAWLER_USER_AGENT}
+        with ProcessPoolExecutor(max_workers=self.max_workers) as process_pool:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+                downloaders = [asyncio.create_task(self.download_worker(session, jobs, documents, results)) for _ in range(self.download_concurrency)]
+                extractors = [asyncio.create_task(self.extraction_worker(documents, process_pool, in_flight, results)) for _ in range(self.max_workers)]
+                for _ in downloaders:
+                    jobs.put_nowait(None)
+                closing = asyncio.create_task(self.close_documents(downloaders, documents, len(extractors)))
+                extraction = asyncio.gather(*extractors, return_exceptions=True)
+                await asyncio.wait([closing, extraction], return_when=asyncio.FIRST_COMPLETED)
+                if not closing.done():
+                    # every extraction worker has exited, nothing drains the documents queue anymore and the downloaders would block on it forever
+                    self.logger.error(f"{self.extract_urls.__name__} - All extraction workers exited, cancelling the remaining downloads")
+                    for task in downloaders + [closing]:
+                        task.cancel()
+                    await asyncio.gather(*downloaders, closing, return_exceptions=True)
+                elif closing.exception() is not None:
+                    extraction.cancel()
+                    await asyncio.gather(extraction, return_exceptions=True)
+                    raise closing.exception()
+                for error in await extraction:
+                    if isinstance(error, BaseException):
+                        self.logger.error(f"{self.extract_urls.__name__} - Extraction worker failed: {error!r}")
+        return results
+
+    def record_menu_texts(self, places):
+        '''extracts the text of the best menu links of the places that need it and records the menu_documents on the place dicts in place'''
+        urls_by_place = {}
+        for place_id, place in places.items():
+            if isinstance(place, dict) and self.needs_extraction(place):
+                urls_by_place[place_id] = [candidate['url'] for candidate in place['menu_link_candidates'][:self.max_documents_per_place]]
+        if not urls_by_place:
+            return 0
+        # a url shared by several places (chain menus) is downloaded once
+        urls = list(dict.fromkeys(url for place_urls in urls_by_place.values() for url in place_urls))
+        print(f"Extracting menu text for {len(urls_by_place)} places ({len(urls)} documents)...")
+        started = time.perf_counter()
+        self.stats = {'downloaded': 0, 'downloaded_bytes': 0, 'not_modified': 0, 'unchanged': 0, 'cache_hits': 0, 'extracted': 0, 'failed': 0}
+        documents_by_url = asyncio.run(self.extract_urls(urls))
+        self.validators.save()
+        now = datetime.now().isoformat()
+        unreachable = 0
+        for place_id, place_urls in urls_by_place.items():
+            documents = [dict(documents_by_url[url]) for url in place_urls if url in documents_by_url]
+            if not documents:
+                # every download failed (site down for a moment): the previous documents and timestamp are kept so the next run tries again
+                unreachable += 1
+                continue
+            places[place_id]['menu_documents'] = documents
+            places[place_id]['menu_documents_last_updated'] = now
+        if unreachable:
+            print(f"No menu document could be downloaded for {unreachable} places, their previous menu documents are kept")
+            self.logger.info(f"{self.record_menu_texts.__name__} - {unreachable} places without any downloaded document kept their previous documents")
+        print(f"Menu text: {self.stats['not_modified']} not modified (304), {self.stats['downloaded']} documents downloaded "
+              f"({self.stats['downloaded_bytes'] / 1e6:.1f} MB, {self.stats['unchanged']} unchanged), {self.stats['extracted']} extracted ({self.stats['failed']} failed), "
+              f"{self.stats['cache_hits']} served from the content hash cache in {time.perf_counter() - started:.1f} seconds")
+        self.logger.info(f"{self.record_menu_texts.__name__} - {self.stats}")
+        return len(urls_by_place)
+
+# MAIN EXECUTION ###################################################################################################################################
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    FILE_DROP_PATH = os.getenv('FILE_DROP_PATH')
+    logging.basicConfig(filename='menu_text_extraction.log', level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    extractor = MenuTextExtractor(os.path.join(FILE_DROP_PATH, 'menu_text_cache'))
+    for json_file_path in sorted(glob.glob(os.path.join(FILE_DROP_PATH, 'restaurant_data_*.json'))):
+        with open(json_file_path, 'r') as file:
+            places = json.load(file)
+        if extractor.record_menu_texts(places):
+            with open(json_file_path, 'w') as file:
+                json.dump(places, file, indent=4)
+            print(f"Menu documents saved to {json_file_path}")
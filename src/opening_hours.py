@@ -0,0 +1,145 @@
+'''
+
+This module compiles the google opening_hours.periods of the places into a 168 bit weekly mask (one bit per hour of the week, in the local time of
+the place) so opening hours questions over the whole corpus are array operations instead of re-parsing the nested period dicts of every record.
+
+    - bit day * 24 + hour is set when the place is open for any part of that hour, days follow the google convention (0 = sunday ... 6 = saturday)
+    - periods that run past midnight (or past saturday night) wrap into the next day / the start of the week, an open period without a close is
+      open 24/7
+    - the mask is stored on the place as a 42 character hex string (opening_hours_mask), so it is a plain column in the json, csv and frames
+    - unpack_masks turns a column of hex masks into an (n places, 168) boolean matrix, the queries below work on that matrix:
+      open_at(hours, 'friday', 22), open_late(hours), weekly_open_hours(hours), day_period_labels(hours)
+
+The day period labels are the "operating hours by day period" labels from the google_api_data_feed.py roadmap (early only, early to mid day, early
+to late, mid day to late, late only, ...).
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+
+# CONSTANTS ###################################################################################################################################
+
+HOURS_PER_WEEK = 168
+MINUTES_PER_WEEK = HOURS_PER_WEEK * 60
+MASK_HEX_LENGTH = HOURS_PER_WEEK // 4
+
+WEEKDAY_INDEX = {
+    'sunday': 0, 'monday': 1, 'tuesday': 2, 'wednesday': 3, 'thursday': 4, 'friday': 5, 'saturday': 6,
+    'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6,
+}
+
+# hours of the day of each day period, late runs past midnight (the early hours of the next day belong to the night before)
+DAY_PERIOD_HOURS = {
+    'early': range(5, 11),
+    'mid day': range(11, 17),
+    'late': list(range(17, 24)) + list(range(0, 2)),
+}
+LATE_NIGHT_HOURS = [22, 23, 0, 1]  # open in any of these hours (on any day) counts as serving late
+
+# FUNCTIONS ###################################################################################################################################
+
+def period_minutes(point):
+    '''{'day': 5, 'time': '2230'} -> minutes since sunday 00:00'''
+    time_text = str(point.get('time', '0000')).zfill(4)
+    return int(point['day']) * 1440 + int(time_text[:2]) * 60 + int(time_text[2:])
+
+def compile_opening_hours(opening_hours_values):
+    '''opening_hours dicts (or None) of n places -> (n, 168) boolean open matrix and the boolean array of the places that have periods.
+    all the periods of all the places are flattened into interval arrays and painted with one cumulative sum'''
+    place_rows = []
+    starts = []
+    ends = []
+    has_hours = np.zeros(len(opening_hours_values), dtype=bool)
+    for row, opening_hours in enumerate(opening_hours_values):
+        periods = (opening_hours or {}).get('periods') if isinstance(opening_hours, dict) else None
+        if not periods:
+            continue
+        has_hours[row] = True
+        for period in periods:
+            if 'open' not in period:
+                continue
+            start = period_minutes(period['open'])
+            if not period.get('close'):
+                start, end = 0, MINUTES_PER_WEEK  # open 24/7
+            else:
+                end = period_minutes(period['close'])
+                if end <= start:
+                    end += MINUTES_PER_WEEK  # runs past saturday night into sunday
+            place_rows.append(row)
+            starts.append(start)
+            ends.append(end)
+
+    changes = np.zeros((len(opening_hours_values), HOURS_PER_WEEK + 1), dtype=np.int32)
+    if place_rows:
+        place_rows = np.array(place_rows)
+        start_hours = np.array(starts) // 60
+        end_hours = -(-np.array(ends) // 60)  # ceil, a period closing at 22:30 covers the 22:00 hour
+        # intervals past the end of the week are split in a tail [start, 168) and a head [0, end - 168)
+        wraps = end_hours > HOURS_PER_WEEK
+        np.add.at(changes, (place_rows, start_hours), 1)
+        np.add.at(changes, (place_rows, np.minimum(end_hours, HOURS_PER_WEEK)), -1)
+        np.add.at(changes, (place_rows[wraps], np.zeros(wraps.sum(), dtype=int)), 1)
+        np.add.at(changes, (place_rows[wraps], np.minimum(end_hours[wraps] - HOURS_PER_WEEK, HOURS_PER_WEEK)), -1)
+    hours = np.cumsum(changes[:, :HOURS_PER_WEEK], axis=1) > 0
+    return hours, has_hours
+
+def pack_masks(hours, has_hours=None):
+    '''(n, 168) boolean matrix -> list of 42 character hex masks (None for the places without opening hours)'''
+    packed = np.packbits(hours, axis=1)
+    masks = [row.tobytes().hex() for row in packed]
+    if has_hours is not None:
+        masks = [mask if has else None for mask, has in zip(masks, has_hours)]
+    return masks
+
+def unpack_masks(masks):
+    '''column / list of hex masks -> ((n, 168) boolean matrix, boolean array of the places that have a mask). missing masks are closed'''
+    masks = pd.Series(list(masks), dtype=object)
+    has_hours = masks.map(lambda mask: isinstance(mask, str) and len(mask) == MASK_HEX_LENGTH).to_numpy()
+    filled = masks.where(has_hours, '0' * MASK_HEX_LENGTH)
+    packed = np.frombuffer(bytes.fromhex(''.join(filled)), dtype=np.uint8).reshape(len(masks), HOURS_PER_WEEK // 8)
+    return np.unpackbits(packed, axis=1).astype(bool), has_hours
+
+def hour_of_week(day, hour):
+    day = WEEKDAY_INDEX[day.lower()] if isinstance(day, str) else int(day)
+    if not 0 <= int(hour) <= 23:
+        raise ValueError(f"Hour must be between 0 and 23, got {hour}")
+    return (day * 24 + int(hour)) % HOURS_PER_WEEK
+
+def open_at(hours, day, hour):
+    '''boolean array of the places open at that hour, e.g. open_at(hours, 'friday', 22)'''
+    return hours[:, hour_of_week(day, hour)]
+
+def open_late(hours, late_hours=LATE_NIGHT_HOURS):
+    '''boolean array of the places open late (22:00 - 02:00) on at least one night'''
+    return hours.reshape(-1, 7, 24)[:, :, late_hours].any(axis=(1, 2))
+
+def weekly_open_hours(hours):
+    return hours.sum(axis=1)
+
+def day_period_labels(hours, has_hours=None):
+    '''"early only", "early to mid day", "early to late", "mid day to late", "late only", ... from the day periods the place is open in on any day'''
+    by_day = hours.reshape(-1, 7, 24)
+    periods = list(DAY_PERIOD_HOURS)
+    open_in = np.column_stack([by_day[:, :, list(DAY_PERIOD_HOURS[period])].any(axis=(1, 2)) for period in periods])
+    first = open_in.argmax(axis=1)
+    last = len(periods) - 1 - open_in[:, ::-1].argmax(axis=1)
+    names = np.array(periods, dtype=object)
+    labels = np.where(first == last, names[first] + ' only', names[first] + ' to ' + names[last])
+    labels = np.where(open_in.any(axis=1), labels, 'closed')
+    if has_hours is not None:
+        labels = np.where(has_hours, labels, None)
+    return labels
+
+def record_opening_hours_masks(places):
+    '''sets opening_hours_mask (hex) and opening_hours_day_period on every place dict, compiled for all the places at once'''
+    place_ids = [place_id for place_id, place in places.items() if isinstance(place, Mapping)]
+    hours, has_hours = compile_opening_hours([places[place_id].get('opening_hours') for place_id in place_ids])
+    masks = pack_masks(hours, has_hours)
+    labels = day_period_labels(hours, has_hours)
+    for place_id, mask, label in zip(place_ids, masks, labels):
+        places[place_id]['opening_hours_mask'] = mask
+        places[place_id]['opening_hours_day_period'] = label
+    return int(has_hours.sum())
@@ -0,0 +1,253 @@
+'''
+
+This module keeps the precomputed aggregate cube for the planned Dash dashboard, so the usual dashboard questions (rating distribution, price level
+mix, counts by distance band per source address, ...) are answered from a few hundred grouped rows instead of a scan over the combined records.
+
+    - the cube is grouped over source_address_file, city, price_level, distance_band and cuisine (missing values are 'unknown')
+    - each cell holds additive measures: place_count, the count / sum / sum of squares of the ratings and of the review sentiment means, the sum of
+      user_ratings_total and the rating histogram (half star bins), so any roll up over a subset of the dimensions is a plain sum and the means and
+      standard deviations are derived from the sums
+    - the merge step (google_api_model_data.py) calls update with the combined places: the dimension / measure values of every place are compared
+      with the ones stored at the previous merge and only the places that changed, appeared or disappeared are subtracted from / added to the cube
+    - the cube and the per place values are saved as parquet files (atomically, temp file + os.replace), the dashboard only loads the cube. both
+      files carry the run id of the save that wrote them (parquet metadata): when one of them is missing or the ids differ (a crash between the two
+      writes, a file copied from another run) the rows no longer describe the cube, so update rebuilds it from the places instead of applying a
+      delta that would double count or drift
+
+Query API (all filters are dimension=value or dimension=[values]):
+    aggregates.query(group_by=['price_level'], city='Chicago')          -> counts, rating / sentiment mean and std per group
+    aggregates.rating_distribution(group_by=['cuisine'])                 -> rating histogram per group
+    aggregates.price_level_mix(source_address_file='restaurant_data_x.json')  -> share of the places per price level
+    aggregates.distance_band_counts()                                     -> places per source address x distance band
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from collections.abc import Mapping
+import logging
+import numpy as np
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import uuid
+
+# CONSTANTS ###################################################################################################################################
+
+CUBE_DIMENSIONS = ['source_address_file', 'city', 'price_level', 'distance_band', 'cuisine']
+UNKNOWN_VALUE = 'unknown'
+RUN_ID_METADATA_KEY = b'place_aggregates_run_id'
+
+# upper bounds of the crow fly distance bands in km, the last band is open ended
+DISTANCE_BAND_EDGES_KM = [1, 2, 5, 10, 20, 50]
+DISTANCE_BAND_LABELS = ['0-1 km', '1-2 km', '2-5 km', '5-10 km', '10-20 km', '20-50 km', '50+ km']
+
+# half star rating bins from 1.0 to 5.0, a rating of 5.0 falls in the last bin
+RATING_BIN_EDGES = np.arange(1.0, 5.01, 0.5)
+RATING_BIN_COLUMNS = [f"rating_{low:.1f}-{low + 0.5:.1f}" for low in RATING_BIN_EDGES[:-1]]
+
+# the per place values the cube measures are derived from
+PLACE_VALUE_COLUMNS = ['rating', 'sentiment', 'user_ratings_total']
+MEASURE_COLUMNS = (['place_count', 'rating_count', 'rating_sum', 'rating_sumsq', 'sentiment_count', 'sentiment_sum', 'sentiment_sumsq',
+                    'user_ratings_total_sum'] + RATING_BIN_COLUMNS)
+
+# address_components types tried in order for the city of a place
+CITY_COMPONENT_TYPES = ['locality', 'postal_town', 'sublocality', 'administrative_area_level_3', 'administrative_area_level_2']
+
+# FUNCTIONS ###################################################################################################################################
+
+def place_city(address_components):
+    names = {}
+    for component in address_components or []:
+        if not isinstance(component, Mapping):
+            continue
+        for component_type in component.get('types') or []:
+            names.setdefault(component_type, component.get('long_name'))
+    for component_type in CITY_COMPONENT_TYPES:
+        if names.get(component_type):
+            return names[component_type]
+    return UNKNOWN_VALUE
+
+def number_or_nan(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else np.nan
+
+def places_to_cube_rows(places):
+    '''one row per place (indexed by place_id) with the cube dimensions and the raw values the measures are derived from'''
+    place_ids = []
+    columns = {column: [] for column in ['source_address_file', 'city', 'price_level', 'distance_km', 'cuisine'] + PLACE_VALUE_COLUMNS}
+    for place_id, details in places.items():
+        if not isinstance(details, Mapping):
+            continue
+        place_ids.append(place_id)
+        columns['source_address_file'].append(details.get('source_address_file') or UNKNOWN_VALUE)
+        columns['city'].append(place_city(details.get('address_components')))
+        price_level = details.get('price_level')
+        columns['price_level'].append(str(price_level) if isinstance(price_level, int) and not isinstance(price_level, bool) else UNKNOWN_VALUE)
+        columns['distance_km'].append(number_or_nan(details.get('crow_fly_distance_km')))
+        columns['cuisine'].append((details.get('place_labels') or {}).get('cuisine') or UNKNOWN_VALUE)
+        columns['rating'].append(number_or_nan(details.get('rating')))
+        columns['sentiment'].append(number_or_nan((details.get('review_sentiment') or {}).get('mean')))
+        columns['user_ratings_total'].append(number_or_nan(details.get('user_ratings_total')))
+
+    rows = pd.DataFrame(columns, index=pd.Index(place_ids, name='place_id'))
+    bands = np.searchsorted(DISTANCE_BAND_EDGES_KM, rows['distance_km'].to_numpy(), side='right')
+    rows['distance_band'] = np.where(rows['distance_km'].notna(), np.array(DISTANCE_BAND_LABELS, dtype=object)[np.minimum(bands, len(DISTANCE_BAND_LABELS) - 1)],
+                                     UNKNOWN_VALUE)
+    return rows[CUBE_DIMENSIONS + PLACE_VALUE_COLUMNS]
+
+def cube_measures(rows):
+    '''the additive measures of each place row (same index), summing them over a group gives the cube cell'''
+    rating = rows['rating'].to_numpy()
+    sentiment = rows['sentiment'].to_numpy()
+    has_rating = ~np.isnan(rating)
+    has_sentiment = ~np.isnan(sentiment)
+    measures = pd.DataFrame({
+        'place_count': np.ones(len(rows)),
+        'rating_count': has_rating.astype(float),
+        'rating_sum': np.where(has_rating, rating, 0.0),
+        'rating_sumsq': np.where(has_rating, rating * rating, 0.0),
+        'sentiment_count': has_sentiment.astype(float),
+        'sentiment_sum': np.where(has_sentiment, sentiment, 0.0),
+        'sentiment_sumsq': np.where(has_sentiment, sentiment * sentiment, 0.0),
+        'user_ratings_total_sum': rows['user_ratings_total'].fillna(0).to_numpy(),
+    }, index=rows.index)
+    # ratings under 1 go in the first bin and 5.0 in the last one
+    bins = np.clip(np.searchsorted(RATING_BIN_EDGES, np.where(has_rating, rating, 0.0), side='right') - 1, 0, len(RATING_BIN_COLUMNS) - 1)
+    for position, column in enumerate(RATING_BIN_COLUMNS):
+        measures[column] = (has_rating & (bins == position)).astype(float)
+    return measures
+
+def empty_cube():
+    return pd.DataFrame({**{dimension: pd.Series(dtype=object) for dimension in CUBE_DIMENSIONS},
+                         **{measure: pd.Series(dtype=np.float64) for measure in MEASURE_COLUMNS}})
+
+def group_measures(rows, sign=1.0):
+    if rows.empty:
+        return empty_cube()
+    measures = cube_measures(rows) * sign
+    measures[CUBE_DIMENSIONS] = rows[CUBE_DIMENSIONS]
+    return measures.groupby(CUBE_DIMENSIONS, as_index=False)[MEASURE_COLUMNS].sum()
+
+def summarize_measures(grouped):
+    '''adds the means and standard deviations derived from the sums'''
+    summary = grouped.copy()
+    # the counts are summed as floats (the removed places are subtracted), they are whole numbers again in the result
+    count_columns = ['place_count', 'rating_count', 'sentiment_count'] + RATING_BIN_COLUMNS
+    summary[count_columns] = summary[count_columns].round().astype(int)
+    for prefix in ['rating', 'sentiment']:
+        count = summary[f"{prefix}_count"].where(summary[f"{prefix}_count"] > 0)
+        mean = summary[f"{prefix}_sum"] / count
+        summary[f"{prefix}_mean"] = mean.round(3)
+        # the sums are updated incrementally, tiny negative variances from the float subtractions are clipped
+        summary[f"{prefix}_std"] = np.sqrt((summary[f"{prefix}_sumsq"] / count - mean * mean).clip(lower=0)).round(3)
+    summary['user_ratings_total_mean'] = (summary['user_ratings_total_sum'] / summary['place_count'].where(summary['place_count'] > 0)).round(1)
+    return summary
+
+def write_parquet_atomic(frame, file_path, run_id):
+    '''writes the frame with the run id in the parquet metadata (next to the pandas metadata, so the index still round trips)'''
+    table = pa.Table.from_pandas(frame)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), RUN_ID_METADATA_KEY: run_id.encode('utf-8')})
+    temp_path = f"{file_path}.tmp"
+    pq.write_table(table, temp_path)
+    os.replace(temp_path, file_path)
+
+def read_run_id(file_path):
+    '''the run id stored in the parquet file, None when the file is missing or was written without one'''
+    if not os.path.exists(file_path):
+        return None
+    run_id = (pq.read_schema(file_path).metadata or {}).get(RUN_ID_METADATA_KEY)
+    return run_id.decode('utf-8') if run_id else None
+
+# CLASSES ###################################################################################################################################
+
+class PlaceAggregates:
+    def __init__(self, folder):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.cube_path = os.path.join(folder, 'place_aggregate_cube.parquet')
+        self.rows_path = os.path.join(folder, 'place_aggregate_rows.parquet')
+        self.cube = pd.read_parquet(self.cube_path) if os.path.exists(self.cube_path) else empty_cube()
+        self.rows = None  # the per place rows are only loaded by update (the dashboard only reads the cube)
+
+    def stored_files_match(self):
+        '''True when the cube and rows files both exist and were written by the same save'''
+        cube_run_id = read_run_id(self.cube_path)
+        return cube_run_id is not None and cube_run_id == read_run_id(self.rows_path)
+
+    def load_rows(self):
+        if self.rows is None:
+            self.rows = pd.read_parquet(self.rows_path) if os.path.exists(self.rows_path) else places_to_cube_rows({})
+        return self.rows
+
+    def update(self, places):
+        '''brings the cube in line with the places ({place_id: place}, the full combined set), returns the number of places re-aggregated'''
+        if self.rows is None and (os.path.exists(self.cube_path) or os.path.exists(self.rows_path)) and not self.stored_files_match():
+            print(f"The aggregate cube and rows in {self.folder} are missing or from different runs, rebuilding the cube")
+            self.logger.warning(f"{self.update.__name__} - Cube / rows run ids do not match, rebuilding from {len(places)} places")
+            return self.rebuild(places)
+        previous = self.load_rows()
+        current = places_to_cube_rows(places)
+
+        aligned = previous.reindex(current.index)
+        same = ((aligned == current) | (aligned.isna() & current.isna())).all(axis=1)
+        changed_ids = current.index[~same.to_numpy()]
+        stale_ids = previous.index.difference(current.index).union(previous.index.intersection(changed_ids))
+
+        if len(changed_ids) or len(stale_ids):
+            delta = pd.concat([group_measures(current.loc[changed_ids]), group_measures(previous.loc[stale_ids], sign=-1.0)])
+            cube = pd.concat([self.cube, delta]).groupby(CUBE_DIMENSIONS, as_index=False)[MEASURE_COLUMNS].sum()
+            # cells whose places all moved to other cells (or disappeared) are dropped
+            self.cube = cube[cube['place_count'] > 0.5].reset_index(drop=True)
+        self.rows = current
+        self.logger.info(f"{self.update.__name__} - {len(changed_ids)} places added or changed, {len(previous.index.difference(current.index))} removed, "
+                         f"{len(self.cube)} cube cells")
+        return len(changed_ids) + len(previous.index.difference(current.index))
+
+    def rebuild(self, places):
+        '''recomputes the cube from scratch (same result as update, without the stored rows)'''
+        self.rows = places_to_cube_rows(places)
+        self.cube = group_measures(self.rows)
+        return len(self.rows)
+
+    def save(self):
+        '''writes the rows and the cube under one new run id (without rows in memory there is nothing that keeps the pair consistent, the cube
+        alone is not saved)'''
+        if self.rows is None:
+            return
+        run_id = uuid.uuid4().hex
+        write_parquet_atomic(self.rows, self.rows_path, run_id)
+        write_parquet_atomic(self.cube, self.cube_path, run_id)
+
+    def filtered_cube(self, filters):
+        mask = np.ones(len(self.cube), dtype=bool)
+        for dimension, value in filters.items():
+            if dimension not in CUBE_DIMENSIONS:
+                raise ValueError(f"Unknown cube dimension: {dimension}. Available dimensions: {', '.join(CUBE_DIMENSIONS)}")
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= self.cube[dimension].isin([str(item) for item in values]).to_numpy()
+        return self.cube[mask]
+
+    def query(self, group_by=(), **filters):
+        '''the summed measures with their means / standard deviations, one row per group (a single row when group_by is empty)'''
+        cube = self.filtered_cube(filters)
+        if group_by:
+            grouped = cube.groupby(list(group_by))[MEASURE_COLUMNS].sum()
+        else:
+            grouped = cube[MEASURE_COLUMNS].sum().to_frame('all').T
+        return summarize_measures(grouped)
+
+    def rating_distribution(self, group_by=(), **filters):
+        return self.query(group_by, **filters)[RATING_BIN_COLUMNS]
+
+    def price_level_mix(self, group_by=(), **filters):
+        '''share of the places per price level (columns), per group'''
+        counts = self.query(list(group_by) + ['price_level'], **filters)['place_count']
+        counts = counts.unstack('price_level', fill_value=0) if group_by else counts.to_frame('all').T
+        return (counts.div(counts.sum(axis=1), axis=0)).round(3)
+
+    def distance_band_counts(self, by='source_address_file', **filters):
+        '''places per `by` value (rows) and distance band (columns, in band order)'''
+        counts = self.query([by, 'distance_band'], **filters)['place_count'].unstack('distance_band', fill_value=0)
+        return counts[[band for band in DISTANCE_BAND_LABELS + [UNKNOWN_VALUE] if band in counts.columns]]
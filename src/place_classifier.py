@@ -0,0 +1,333 @@
+'''
+
+This module adds the cuisine and service style labels from the google_api_data_feed.py roadmap ("label the baseline dataset with classification
+labels for the type of cuisine ... style of service ... then train a classification model to predict the labels for future results").
+
+    - every place becomes one text document: name, types, editorial_summary.overview, price level and the review texts
+    - the documents are turned into sparse term count rows with a HashingVectorizer (stateless, so the row of a place never depends on the other
+      places) and weighted with TF-IDF. the count rows are cached on disk with the hash of the document they came from, each run only vectorizes
+      the new and changed places and reuses the cached rows of the others. the cache is shared by every address file, so the features index also
+      keeps the seed labels of every cached row
+    - seed labels come from keyword rules over the name, types and overview (high precision, "sushi" in the name is a japanese place). the seeded
+      places train one SGD logistic regression per label set, which labels the places the keywords do not cover from all the words of the document,
+      reviews included
+    - labels are predicted in one batch (one sparse matrix product) and only for the places whose document changed since they were labeled. the
+      model is trained again from scratch (on the seeded rows of the whole cache, not only the places of the current call) when the number of
+      places grew by more than retrain_growth since the last training, in between the new seeded places are added with partial_fit
+
+The places get a place_labels dict: cuisine, cuisine_confidence, service_style, service_style_confidence, label_source (keyword / model) and the
+document_hash the labels were computed from.
+
+usage: python place_classifier.py  (labels the places of every restaurant_data_*.json file in FILE_DROP_PATH)
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from collections.abc import Mapping
+from datetime import datetime
+from dotenv import load_dotenv
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.linear_model import SGDClassifier
+from sklearn.utils.class_weight import compute_sample_weight
+import glob
+import hashlib
+import json
+import joblib
+import logging
+import numpy as np
+import os
+import pandas as pd
+import re
+
+# CONSTANTS ###################################################################################################################################
+
+# bump when the document format, the vectorizer or the seed rules change, the cached features and the model are rebuilt
+PLACE_CLASSIFIER_VERSION = 2
+
+# label -> keywords (regex fragments, matched on word boundaries in the lower cased name, types and overview)
+CUISINE_KEYWORDS = {
+    'american': ['american', 'diner', 'burgers?', 'new american', 'comfort food', 'southern', 'soul food', 'cajun', 'creole', 'tex mex', 'wings'],
+    'barbecue': ['barbecue', 'bbq', 'bar b q', 'smokehouse', 'brisket', 'pit'],
+    'italian': ['italian', 'trattoria', 'osteria', 'pasta', 'ristorante', 'enoteca', 'pizzeria', 'pizza'],
+    'mexican': ['mexican', 'taqueria', 'tacos?', 'cantina', 'burritos?', 'mezcaleria', 'tortilleria'],
+    'japanese': ['japanese', 'sushi', 'ramen', 'izakaya', 'omakase', 'yakitori', 'udon', 'soba', 'tempura', 'teppanyaki'],
+    'chinese': ['chinese', 'dim sum', 'szechuan', 'sichuan', 'cantonese', 'dumplings?', 'hot pot', 'noodle house'],
+    'korean': ['korean', 'kbbq', 'bibimbap', 'bulgogi'],
+    'thai': ['thai'],
+    'vietnamese': ['vietnamese', 'pho', 'banh mi'],
+    'pan_asian': ['asian', 'pan asian', 'asian fusion', 'noodle bar'],
+    'indian': ['indian', 'tandoori?', 'curry', 'masala', 'biryani', 'punjabi'],
+    'mediterranean': ['mediterranean', 'greek', 'lebanese', 'turkish', 'falafel', 'gyros?', 'mezze', 'shawarma', 'kebabs?', 'middle eastern'],
+    'spanish': ['spanish', 'tapas', 'paella', 'basque', 'pintxos'],
+    'french': ['french', 'bistro', 'brasserie', 'creperie', 'patisserie'],
+    'caribbean': ['caribbean', 'jamaican', 'cuban', 'puerto rican', 'haitian', 'jerk'],
+    'latin_american': ['latin', 'peruvian', 'brazilian', 'argentinian', 'colombian', 'venezuelan', 'salvadoran', 'churrascaria', 'arepas?', 'empanadas?'],
+    'seafood': ['seafood', 'oyster bar', 'oysters', 'fish', 'crab', 'lobster', 'raw bar'],
+    'steakhouse': ['steakhouse', 'steak house', 'chophouse', 'steaks?'],
+    'vegan': ['vegan', 'vegetarian', 'plant based'],
+    'cafe_bakery': ['cafe', 'coffee', 'bakery', 'bagels?', 'donuts?', 'espresso'],
+    'bar': ['bar', 'pub', 'tavern', 'brewery', 'taproom', 'wine bar', 'cocktail', 'lounge', 'gastropub', 'saloon'],
+}
+SERVICE_STYLE_KEYWORDS = {
+    'tasting_menu': ['tasting menu', 'omakase', 'prix fixe', 'chef s counter', 'chefs counter', 'kaiseki', 'multi course'],
+    'fine_dining': ['fine dining', 'upscale', 'michelin', 'elegant', 'sophisticated', 'refined', 'price level 4'],
+    'fast_casual': ['fast casual', 'bowls?', 'build your own', 'grab and go', 'quick bites?', 'poke'],
+    'counter_service': ['counter service', 'counter', 'food truck', 'deli', 'takeaway', 'meal takeaway', 'takeout only', 'to go', 'window'],
+    'bar_service': ['bar', 'pub', 'tavern', 'brewery', 'taproom', 'lounge', 'saloon'],
+    'full_service': ['full service', 'bistro', 'brasserie', 'trattoria', 'steakhouse', 'supper club', 'dining room', 'reservations'],
+}
+# one pattern per label set with a named group per label, so the seed text is scanned once per label set. at the same position the label listed
+# first wins ("oyster bar" is seafood, not bar)
+CUISINE_PATTERN = re.compile(r'\b(?:' + '|'.join(rf"(?P<{label}>{'|'.join(keywords)})" for label, keywords in CUISINE_KEYWORDS.items()) + r')\b')
+SERVICE_STYLE_PATTERN = re.compile(r'\b(?:' + '|'.join(rf"(?P<{label}>{'|'.join(keywords)})" for label, keywords in SERVICE_STYLE_KEYWORDS.items()) + r')\b')
+
+# how much a label word counts in the seed text: a word in the name outweighs the generic google types ("restaurant", "bar")
+SEED_NAME_WEIGHT = 3
+
+HASHING_FEATURES = 2 ** 20
+MIN_SEEDS_PER_LABEL = 5
+MIN_MODEL_CONFIDENCE = 0.35  # below this the model label is 'unknown'
+
+NON_WORD_PATTERN = re.compile(r'[^a-z0-9]+')
+
+# FUNCTIONS ###################################################################################################################################
+
+def normalize_label_text(text):
+    return NON_WORD_PATTERN.sub(' ', (text or '').lower()).strip()
+
+def place_seed_text(place):
+    '''the short text the keyword rules run on: name (weighted), types and overview, no reviews (a review that mentions "better than any italian
+    place" says nothing about the cuisine of this one)'''
+    name = normalize_label_text(place.get('name'))
+    types = ' '.join(normalize_label_text(place_type) for place_type in place.get('types', []))
+    overview = normalize_label_text((place.get('editorial_summary') or {}).get('overview'))
+    price_level = f"price level {place['price_level']}" if place.get('price_level') is not None else ''
+    return ' '.join([name] * SEED_NAME_WEIGHT + [types, overview, price_level])
+
+def place_document(place):
+    '''the text the features are built from: the seed text and the review texts (the vectorizer lower cases and tokenizes the reviews itself)'''
+    reviews = ' '.join(review.get('text') or '' for review in place.get('reviews', []) if isinstance(review, dict))
+    return f"{place_seed_text(place)} {reviews}"
+
+def document_hash(document):
+    return hashlib.sha256(f"{PLACE_CLASSIFIER_VERSION}:{document}".encode('utf-8')).hexdigest()
+
+def seed_labels(seed_texts, pattern):
+    '''vectorized keyword labeling: one extractall over all the places gives the keyword hits per label, the label with the most hits wins (None
+    without any hit)'''
+    seed_texts = pd.Series(seed_texts, dtype=object)
+    labels = list(pattern.groupindex)
+    matches = seed_texts.str.extractall(pattern)
+    if matches.empty:
+        return np.full(len(seed_texts), None, dtype=object)
+    hits = matches.notna().groupby(level=0).sum().reindex(index=range(len(seed_texts)), columns=labels, fill_value=0).to_numpy()
+    best = hits.argmax(axis=1)
+    return np.where(hits.max(axis=1) > 0, np.array(labels, dtype=object)[best], None)
+
+# CLASSES ###################################################################################################################################
+
+class PlaceClassifier:
+    LABEL_SETS = {'cuisine': CUISINE_PATTERN, 'service_style': SERVICE_STYLE_PATTERN}
+
+    def __init__(self, cache_folder, retrain_growth=0.2):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.cache_folder = cache_folder
+        self.retrain_growth = retrain_growth  # share of new places since the last training before the model is trained from scratch again
+        os.makedirs(cache_folder, exist_ok=True)
+        self.features_path = os.path.join(cache_folder, 'place_features.npz')
+        self.features_index_path = os.path.join(cache_folder, 'place_features_index.json')
+        self.model_path = os.path.join(cache_folder, 'place_classifier.joblib')
+        self.vectorizer = HashingVectorizer(n_features=HASHING_FEATURES, alternate_sign=False, norm=None, dtype=np.float32)
+        self.place_ids, self.document_hashes, self.row_seeds, self.counts = self.load_features()
+        self.model = self.load_model()
+
+    def load_features(self):
+        '''returns (place_ids, document hashes, {label set: seed labels}, sparse count matrix) of the cached rows'''
+        if os.path.exists(self.features_path) and os.path.exists(self.features_index_path):
+            with open(self.features_index_path, 'r') as file:
+                index = json.load(file)
+            if index.get('version') == PLACE_CLASSIFIER_VERSION:
+                row_seeds = {label_set: index['seeds'][label_set] for label_set in self.LABEL_SETS}
+                return index['place_ids'], index['document_hashes'], row_seeds, sparse.load_npz(self.features_path).tocsr()
+        return [], [], {label_set: [] for label_set in self.LABEL_SETS}, sparse.csr_matrix((0, HASHING_FEATURES), dtype=np.float32)
+
+    def save_features(self):
+        # np.savez appends .npz to any other name, so the temp file keeps the extension
+        temp_path = f"{self.features_path[:-4]}.tmp.npz"
+        sparse.save_npz(temp_path, self.counts, compressed=False)
+        os.replace(temp_path, self.features_path)
+        temp_path = f"{self.features_index_path}.tmp"
+        with open(temp_path, 'w') as file:
+            json.dump({'version': PLACE_CLASSIFIER_VERSION, 'place_ids': self.place_ids, 'document_hashes': self.document_hashes,
+                       'seeds': self.row_seeds}, file)
+        os.replace(temp_path, self.features_index_path)
+
+    def load_model(self):
+        if os.path.exists(self.model_path):
+            model = joblib.load(self.model_path)
+            if model.get('version') == PLACE_CLASSIFIER_VERSION:
+                return model
+        return None
+
+    def save_model(self):
+        temp_path = f"{self.model_path}.tmp"
+        joblib.dump(self.model, temp_path)
+        os.replace(temp_path, self.model_path)
+
+    def update_features(self, place_ids, documents, hashes, seed_texts):
+        '''vectorizes and seeds only the new / changed documents, returns the row of every place id in self.counts'''
+        cached_rows = {place_id: row for row, place_id in enumerate(self.place_ids)}
+        keep_rows = []
+        changed = []
+        for position, (place_id, digest) in enumerate(zip(place_ids, hashes)):
+            row = cached_rows.get(place_id)
+            if row is not None and self.document_hashes[row] == digest:
+                keep_rows.append(row)
+            else:
+                changed.append(position)
+        # the cached rows of the places not in this batch stay in the cache
+        requested = set(place_ids)
+        other_rows = [row for row, place_id in enumerate(self.place_ids) if place_id not in requested]
+        started = datetime.now()
+        if changed:
+            new_counts = self.vectorizer.transform([documents[position] for position in changed])
+        else:
+            new_counts = sparse.csr_matrix((0, HASHING_FEATURES), dtype=np.float32)
+        # the seed text is part of the document, an unchanged document hash keeps its cached seeds
+        new_seeds = {label_set: seed_labels([seed_texts[position] for position in changed], pattern) if changed else []
+                     for label_set, pattern in self.LABEL_SETS.items()}
+
+        kept_ids = [self.place_ids[row] for row in keep_rows]
+        kept_hashes = [self.document_hashes[row] for row in keep_rows]
+        self.counts = sparse.vstack([self.counts[keep_rows], new_counts, self.counts[other_rows]], format='csr')
+        self.place_ids = kept_ids + [place_ids[position] for position in changed] + [self.place_ids[row] for row in other_rows]
+        self.document_hashes = kept_hashes + [hashes[position] for position in changed] + [self.document_hashes[row] for row in other_rows]
+        self.row_seeds = {label_set: [seeds[row] for row in keep_rows] + list(new_seeds[label_set]) + [seeds[row] for row in other_rows]
+                          for label_set, seeds in self.row_seeds.items()}
+        if changed:
+            print(f"Place features: {len(changed)} new / changed places vectorized in {datetime.now() - started}, {len(keep_rows)} from the cache")
+        return {place_id: row for row, place_id in enumerate(self.place_ids)}
+
+    def needs_training(self):
+        if self.model is None:
+            return True
+        return len(self.place_ids) > self.model['trained_place_count'] * (1 + self.retrain_growth)
+
+    def train(self, seeds):
+        '''seeds: {label set: array of seed labels (None for unseeded) aligned with the rows of self.counts}'''
+        started = datetime.now()
+        tfidf = TfidfTransformer(sublinear_tf=True).fit(self.counts)
+        features = tfidf.transform(self.counts)
+        classifiers = {}
+        for label_set, labels in seeds.items():
+            classifier = self.fit_classifier(features, labels)
+            if classifier is not None:
+                classifiers[label_set] = classifier
+        self.model = {'version': PLACE_CLASSIFIER_VERSION, 'tfidf': tfidf, 'classifiers': classifiers, 'trained_place_count': len(self.place_ids),
+                      'trained': datetime.now().isoformat()}
+        print(f"Place classifier trained on {len(self.place_ids)} places ({', '.join(classifiers) or 'no label set had enough seeds'}) in {datetime.now() - started}")
+
+    def fit_classifier(self, features, labels):
+        labels = pd.Series(labels, dtype=object)
+        counts = labels.value_counts()
+        usable = counts[counts >= MIN_SEEDS_PER_LABEL].index
+        rows = np.flatnonzero(labels.isin(usable).to_numpy())
+        if len(usable) < 2:
+            return None
+        labels = labels.iloc[rows].to_numpy()
+        # balanced sample weights instead of class_weight='balanced', which partial_fit does not support
+        classifier = SGDClassifier(loss='log_loss', alpha=1e-5, max_iter=30, tol=1e-4, random_state=0)
+        classifier.fit(features[rows], labels, sample_weight=compute_sample_weight('balanced', labels))
+        return classifier
+
+    def update_model(self, rows, seeds):
+        '''adds the newly seeded places to the existing classifiers (labels the classifier was not trained on wait for the next full training)'''
+        if not len(rows):
+            return
+        features = self.model['tfidf'].transform(self.counts[rows])
+        for label_set, classifier in self.model['classifiers'].items():
+            labels = seeds[label_set]
+            known = np.flatnonzero(pd.Series(labels, dtype=object).isin(classifier.classes_).to_numpy())
+            if len(known):
+                classifier.partial_fit(features[known], labels[known], sample_weight=compute_sample_weight('balanced', labels[known]))
+
+    def predict(self, rows):
+        '''{label set: (labels, confidences)} for the given rows of self.counts, one sparse matrix product per label set'''
+        predictions = {}
+        if self.model is None or not len(rows):
+            return predictions
+        features = self.model['tfidf'].transform(self.counts[rows])
+        for label_set, classifier in self.model['classifiers'].items():
+            probabilities = classifier.predict_proba(features)
+            best = probabilities.argmax(axis=1)
+            confidences = probabilities[np.arange(len(best)), best]
+            labels = np.where(confidences >= MIN_MODEL_CONFIDENCE, classifier.classes_[best], 'unknown')
+            predictions[label_set] = (labels, confidences)
+        return predictions
+
+    def record_place_labels(self, places):
+        '''sets place_labels on the place dicts whose document changed since they were labeled (or all of them after a full training)'''
+        place_ids = [place_id for place_id, place in places.items() if isinstance(place, Mapping)]
+        if not place_ids:
+            return 0
+        documents = [place_document(places[place_id]) for place_id in place_ids]
+        hashes = [document_hash(document) for document in documents]
+        seed_texts = [place_seed_text(places[place_id]) for place_id in place_ids]
+        rows_by_id = self.update_features(place_ids, documents, hashes, seed_texts)
+        rows = np.array([rows_by_id[place_id] for place_id in place_ids])
+        changed = np.array([(places[place_id].get('place_labels') or {}).get('document_hash') != digest
+                            for place_id, digest in zip(place_ids, hashes)], dtype=bool)
+        retrained = self.needs_training()
+        if retrained:
+            changed[:] = True
+        to_label = np.flatnonzero(changed)
+
+        # seed labels of every cached row (the places of the other address files included), the ones of the places to label are aligned with
+        # to_label
+        row_seeds = {label_set: np.array(labels, dtype=object) for label_set, labels in self.row_seeds.items()}
+        seeds = {label_set: labels[rows[to_label]] for label_set, labels in row_seeds.items()}
+        if retrained:
+            self.train(row_seeds)
+        else:
+            self.update_model(rows[to_label], seeds)
+        predictions = self.predict(rows[to_label])
+        now = datetime.now().isoformat()
+        for position_in_batch, position in enumerate(to_label):
+            labels = {}
+            sources = set()
+            for label_set in self.LABEL_SETS:
+                seed = seeds[label_set][position_in_batch]
+                if seed is not None:
+                    labels[label_set], labels[f"{label_set}_confidence"] = seed, 1.0
+                    sources.add('keyword')
+                elif label_set in predictions:
+                    labels[label_set] = str(predictions[label_set][0][position_in_batch])
+                    labels[f"{label_set}_confidence"] = round(float(predictions[label_set][1][position_in_batch]), 3)
+                    sources.add('model')
+                else:
+                    labels[label_set], labels[f"{label_set}_confidence"] = 'unknown', 0.0
+            labels['label_source'] = '/'.join(sorted(sources)) or 'none'
+            labels['document_hash'] = hashes[position]
+            labels['last_updated'] = now
+            places[place_ids[position]]['place_labels'] = labels
+
+        self.save_features()
+        if retrained or len(to_label):
+            self.save_model()
+        print(f"Place labels: {len(to_label)} of {len(place_ids)} places labeled{' (model retrained)' if retrained else ''}")
+        self.logger.info(f"{self.record_place_labels.__name__} - {len(to_label)} places labeled, {len(place_ids) - len(to_label)} unchanged")
+        return len(to_label)
+
+# MAIN EXECUTION ###################################################################################################################################
+
+if __name__ == "__main__":
+    load_dotenv()
+    FILE_DROP_PATH = os.getenv('FILE_DROP_PATH')
+    classifier = PlaceClassifier(os.path.join(FILE_DROP_PATH, 'place_classifier'))
+    for file_path in glob.glob(os.path.join(FILE_DROP_PATH, 'restaurant_data_*.json')):
+        with open(file_path, 'r') as file:
+            places = json.load(file)
+        if classifier.record_place_labels(places):
+            with open(file_path, 'w') as file:
+                json.dump(places, file, indent=4)
@@ -0,0 +1,226 @@
+'''
+
+This module compiles place filter expressions into vectorized column masks. It is shared by viz_map.py, viz_testing_map.py and ad-hoc analysis.
+
+Filters are written as python style boolean expressions over the place columns, for example:
+    rating >= 4.2 and price_level in (3, 4) and serves_wine and distance_km < 5
+    'bar' in types and not reservable and user_ratings_total > 500
+    open_fri_22 and open_late and weekly_open_hours >= 60
+
+The opening hours columns come from the 168 hour weekly masks (opening_hours.py): open_late, weekly_open_hours, day_period and any open_<day>_<hour>
+column (open_sat_23, open_sunday_10), which is computed from the mask column when the expression uses it.
+
+The expression is parsed once with the ast module (only comparisons, and / or / not, column names and literals are allowed) and compiled into
+a tree of numpy / pandas operations, so evaluating it over 100k places is a handful of array operations instead of a python loop over the records.
+Missing values never match a comparison, and a bare column name (serves_wine) matches the truthy values.
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from collections.abc import Mapping
+from functools import lru_cache
+from opening_hours import compile_opening_hours, day_period_labels, open_at, open_late, pack_masks, unpack_masks, weekly_open_hours, WEEKDAY_INDEX
+import ast
+import numpy as np
+import operator
+import pandas as pd
+import re
+
+# CONSTANTS ###################################################################################################################################
+
+# scalar place record fields that become filter columns, nested fields are added in places_to_frame
+PLACE_FILTER_FIELDS = [
+    'name',
+    'rating',
+    'user_ratings_total',
+    'price_level',
+    'business_status',
+    'crow_fly_distance_km',
+    'utc_offset',
+    'reservable',
+    'dine_in',
+    'takeout',
+    'delivery',
+    'curbside_pickup',
+    'wheelchair_accessible_entrance',
+    'serves_breakfast',
+    'serves_brunch',
+    'serves_lunch',
+    'serves_dinner',
+    'serves_wine',
+    'serves_beer',
+    'serves_vegetarian_food',
+    'website',
+    'source_address_file',
+]
+
+# short names that can be used in the expressions
+FILTER_COLUMN_ALIASES = {
+    'distance_km': 'crow_fly_distance_km',
+    'ratings_total': 'user_ratings_total',
+}
+
+# open_fri_22 / open_friday_22 style columns (hours 0 - 23), computed from the opening hours masks
+OPEN_AT_COLUMN_PATTERN = re.compile(rf"^open_({'|'.join(WEEKDAY_INDEX)})_([01]?\d|2[0-3])$")
+
+# list fields are stored as ';' delimited strings so "'bar' in types" is a vectorized substring match
+LIST_COLUMNS = ['types']
+
+COMPARISON_OPERATORS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+# FUNCTIONS ###################################################################################################################################
+
+def places_to_frame(places):
+    '''builds the filter column frame (indexed by place_id) from the combined place dict in a single pass over the records'''
+    columns = {field: [] for field in PLACE_FILTER_FIELDS}
+    columns.update({'lat': [], 'lng': [], 'overview': [], 'types': [], 'opening_hours_mask': []})
+    missing_masks = []
+    place_ids = []
+    for place_id, details in places.items():
+        if not isinstance(details, Mapping):
+            continue
+        place_ids.append(place_id)
+        for field in PLACE_FILTER_FIELDS:
+            columns[field].append(details.get(field))
+        location = (details.get('geometry') or {}).get('location') or {}
+        columns['lat'].append(location.get('lat'))
+        columns['lng'].append(location.get('lng'))
+        columns['overview'].append((details.get('editorial_summary') or {}).get('overview'))
+        columns['types'].append(f";{';'.join(details.get('types', []))};")
+        columns['opening_hours_mask'].append(details.get('opening_hours_mask'))
+        if 'opening_hours_mask' not in details:
+            missing_masks.append((len(place_ids) - 1, details.get('opening_hours')))
+
+    # records saved before the masks existed are compiled in one batch
+    if missing_masks:
+        hours, has_hours = compile_opening_hours([opening_hours for _, opening_hours in missing_masks])
+        for (row, _), mask in zip(missing_masks, pack_masks(hours, has_hours)):
+            columns['opening_hours_mask'][row] = mask
+
+    frame = pd.DataFrame(columns, index=pd.Index(place_ids, name='place_id'))
+    return add_derived_filter_columns(frame)
+
+def add_derived_filter_columns(frame):
+    '''adds the opening hours columns computed from the masks and makes the numeric columns floats (shared with place_snapshot.snapshot_to_frame)'''
+    hours, has_hours = unpack_masks(frame['opening_hours_mask'])
+    frame['open_late'] = open_late(hours)
+    frame['weekly_open_hours'] = np.where(has_hours, weekly_open_hours(hours), np.nan)
+    frame['day_period'] = day_period_labels(hours, has_hours)
+    # numeric columns as floats so missing values are NaN and the comparisons stay vectorized
+    for field in ['rating', 'user_ratings_total', 'price_level', 'crow_fly_distance_km', 'utc_offset', 'lat', 'lng']:
+        frame[field] = pd.to_numeric(frame[field], errors='coerce').astype(np.float64)
+    return frame
+
+def _column(frame, name):
+    name = FILTER_COLUMN_ALIASES.get(name, name)
+    open_at_match = OPEN_AT_COLUMN_PATTERN.match(name)
+    if name not in frame.columns and open_at_match and 'opening_hours_mask' in frame.columns:
+        hours, _ = unpack_masks(frame['opening_hours_mask'])
+        return pd.Series(open_at(hours, open_at_match.group(1), open_at_match.group(2)), index=frame.index)
+    if name not in frame.columns:
+        raise ValueError(f"Unknown filter column: {name}. Available columns: {', '.join(frame.columns)}")
+    return frame[name]
+
+def _as_mask(values):
+    '''converts a column or comparison result into a plain boolean numpy array, missing values are False'''
+    if isinstance(values, pd.Series):
+        if values.dtype == bool:
+            return values.to_numpy()
+        if values.dtype == object:
+            return values.fillna(False).astype(bool).to_numpy()
+        return values.fillna(0).astype(bool).to_numpy()
+    return np.asarray(values, dtype=bool)
+
+def _literal(node):
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise ValueError(f"Unsupported value in filter expression: {ast.dump(node)}")
+
+def _compile_node(node):
+    '''returns a function of the frame for the ast node, every function returns a boolean mask except the column / literal leaves'''
+    if isinstance(node, ast.BoolOp):
+        parts = [_compile_node(value) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        return lambda frame: combine.reduce([_as_mask(part(frame)) for part in parts])
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        operand = _compile_node(node.operand)
+        return lambda frame: ~_as_mask(operand(frame))
+
+    if isinstance(node, ast.Compare):
+        # chained comparisons (1 <= price_level < 4) are compiled as an and of the pairs
+        comparisons = []
+        left = node.left
+        for op, right in zip(node.ops, node.comparators):
+            comparisons.append(_compile_comparison(left, op, right))
+            left = right
+        if len(comparisons) == 1:
+            return comparisons[0]
+        return lambda frame: np.logical_and.reduce([comparison(frame) for comparison in comparisons])
+
+    if isinstance(node, ast.Name):
+        return lambda frame: _column(frame, node.id)
+
+    raise ValueError(f"Unsupported syntax in filter expression: {ast.dump(node)}")
+
+def _compile_comparison(left, op, right):
+    if isinstance(op, (ast.In, ast.NotIn)):
+        negate = isinstance(op, ast.NotIn)
+        # 'bar' in types -> substring match on the ';' delimited list column
+        if isinstance(right, ast.Name) and FILTER_COLUMN_ALIASES.get(right.id, right.id) in LIST_COLUMNS:
+            value = _literal(left)
+            def list_membership(frame):
+                mask = _column(frame, right.id).str.contains(f';{value};', regex=False).fillna(False).to_numpy(dtype=bool)
+                return ~mask if negate else mask
+            return list_membership
+        # price_level in (3, 4) -> isin on the column
+        if isinstance(left, ast.Name):
+            values = _literal(right)
+            if not isinstance(values, (tuple, list, set)):
+                values = (values,)
+            values = list(values)
+            def column_membership(frame):
+                mask = _column(frame, left.id).isin(values).to_numpy()
+                return ~mask if negate else mask
+            return column_membership
+        raise ValueError("The 'in' operator needs a column on one side and a literal on the other")
+
+    if type(op) not in COMPARISON_OPERATORS:
+        raise ValueError(f"Unsupported comparison in filter expression: {type(op).__name__}")
+    compare = COMPARISON_OPERATORS[type(op)]
+
+    # column <op> literal, literal <op> column and column <op> column are all vectorized
+    left_value = _compile_node(left) if isinstance(left, ast.Name) else (lambda frame, value=_literal(left): value)
+    right_value = _compile_node(right) if isinstance(right, ast.Name) else (lambda frame, value=_literal(right): value)
+
+    def comparison(frame):
+        result = compare(left_value(frame), right_value(frame))
+        # comparisons against NaN / None are already False, except != which we also treat as no match for missing values
+        if isinstance(op, ast.NotEq):
+            for side, node in ((left_value, left), (right_value, right)):
+                if isinstance(node, ast.Name):
+                    result = result & side(frame).notna()
+        return _as_mask(result)
+    return comparison
+
+@lru_cache(maxsize=128)
+def compile_filter(expression):
+    '''compiles the filter expression once, the returned function takes a places_to_frame frame and returns a boolean numpy mask'''
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid filter expression: {expression} ({e.msg})")
+    compiled = _compile_node(tree.body)
+    return lambda frame: _as_mask(compiled(frame))
+
+def filter_places(frame, expression):
+    '''returns the rows of the frame that match the expression'''
+    return frame[compile_filter(expression)(frame)]
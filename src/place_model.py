@@ -0,0 +1,217 @@
+'''
+
+This module is the compact in memory model of a place record for the steps that hold the whole corpus (google_api_model_data.py).
+
+A place read from the json files is a deep nested dict: every record repeats the same key strings, every review is a dict of ten strings and the
+address components / opening hours periods are lists of small dicts. The Place class keeps the same data in a fraction of the memory:
+    - the scalar fields (name, rating, price_level, ...) are __slots__ attributes instead of dict entries
+    - the yes / no / unknown service flags (reservable, serves_wine, ...) are packed into two integers
+    - types and business_status are interned: the same types list is one shared tuple of interned strings for all the places that have it
+    - the bulky nested fields that are only read now and then (reviews, address_components, opening_hours, photos, ...) are kept as zlib
+      compressed json and only materialized when they are read. the materialized value is kept on the place, so every read returns the same
+      object and changes made to it in place (place.setdefault('field_sources', {})[field] = ...) are kept like on a dict. compact / compact_places
+      pack the materialized fields again (with those changes) once a step that read them is done
+    - everything else (geometry, editorial_summary, the fields added by the pipeline steps) stays a plain value in a small dict
+    - the field order of the record is one interned tuple shared by all the places with the same fields, so to_dict gives back the keys in the
+      order of the json
+
+Place is a MutableMapping, so the pipeline steps read and write it like the place dict (place.get('name'), place['place_labels'] = ...), and
+Place.from_dict / Place.to_dict convert from / to the json shape. read_places_json and write_places_json load and save a {place_id: place} file
+one record at a time, so only one file of nested dicts (on load) or one record (on save) is materialized at any moment.
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from collections.abc import Mapping, MutableMapping
+import json
+import sys
+import zlib
+
+# CONSTANTS ###################################################################################################################################
+
+PLACE_SCALAR_FIELDS = ('place_id', 'name', 'rating', 'user_ratings_total', 'price_level', 'business_status', 'formatted_address', 'vicinity',
+                       'website', 'url', 'international_phone_number', 'formatted_phone_number', 'utc_offset', 'crow_fly_distance_km',
+                       'last_updated', 'source_address_file', 'opening_hours_mask', 'opening_hours_day_period', 'types')
+PLACE_FLAG_FIELDS = ('reservable', 'dine_in', 'takeout', 'delivery', 'curbside_pickup', 'wheelchair_accessible_entrance', 'serves_breakfast',
+                     'serves_brunch', 'serves_lunch', 'serves_dinner', 'serves_wine', 'serves_beer', 'serves_vegetarian_food')
+PLACE_PACKED_FIELDS = ('reviews', 'address_components', 'opening_hours', 'photos', 'field_sources', 'menu_link_candidates', 'menu_documents')
+
+FLAG_BITS = {field: 1 << bit for bit, field in enumerate(PLACE_FLAG_FIELDS)}
+PACKED_COMPRESSION_LEVEL = 1  # the fast level, the json of a few reviews still shrinks to about a third
+
+# FUNCTIONS ###################################################################################################################################
+
+_interned_types = {}
+_interned_key_orders = {}
+
+def intern_types(types):
+    '''one shared tuple of interned strings per distinct types list'''
+    key = tuple(types)
+    interned = _interned_types.get(key)
+    if interned is None:
+        interned = _interned_types[key] = tuple(sys.intern(place_type) for place_type in key)
+    return interned
+
+def intern_key_order(keys):
+    '''one shared tuple per distinct field order'''
+    return _interned_key_orders.setdefault(keys, keys)
+
+def pack_value(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'), PACKED_COMPRESSION_LEVEL)
+
+def unpack_value(packed):
+    return json.loads(zlib.decompress(packed))
+
+def compact_places(places):
+    '''packs the fields the last steps materialized again on every Place of {place_id: place}, returns the number of fields packed'''
+    return sum(place.compact() for place in places.values() if isinstance(place, Place))
+
+def read_places_json(file_path, skipped=None):
+    '''{place_id: Place} from a json file of place dicts. the records that are not dicts are skipped, (place_id, value) of each is appended to the
+    skipped list when one is given'''
+    with open(file_path, 'r') as file:
+        data = json.load(file)
+    places = {}
+    # pop the records while converting, so the nested dicts of the file are freed as the compact records are built
+    while data:
+        place_id, details = data.popitem()
+        if isinstance(details, dict):
+            places[place_id] = Place.from_dict(details)
+        elif skipped is not None:
+            skipped.append((place_id, details))
+    return dict(reversed(places.items()))
+
+def write_places_json(file_path, places, indent=4):
+    '''writes {place_id: place} (or an iterable of (place_id, record) pairs) as the same json as json.dump(dict(places), indent=indent), one record
+    materialized at a time'''
+    items = places.items() if isinstance(places, Mapping) else places
+    written = 0
+    with open(file_path, 'w') as file:
+        file.write('{')
+        for place_id, place in items:
+            record = place.to_dict() if isinstance(place, Place) else place
+            body = json.dumps(record, indent=indent)
+            if indent is not None:
+                body = body.replace('\n', '\n' + ' ' * indent)
+            file.write(f"{',' if written else ''}\n{' ' * (indent or 0)}{json.dumps(place_id)}: {body}")
+            written += 1
+        file.write('\n}' if written else '}')
+    return written
+
+# CLASSES ###################################################################################################################################
+
+class Place(MutableMapping):
+    __slots__ = PLACE_SCALAR_FIELDS + ('key_order', 'flags_known', 'flags_value', 'packed', 'extra')
+
+    def __init__(self):
+        self.key_order = ()
+        self.flags_known = 0
+        self.flags_value = 0
+        self.packed = None  # {field: compressed json}, only created for the places that have packed fields
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, details):
+        place = cls()
+        for key, value in details.items():
+            place.store(key, value)  # the keys of a dict are unique, no existing value to clear
+        place.key_order = intern_key_order(tuple(details))
+        return place
+
+    def to_dict(self):
+        # the packed fields are unpacked into the dict without keeping them materialized on the place (writing a file does not grow the records)
+        packed = self.packed or {}
+        return {key: unpack_value(packed[key]) if isinstance(packed.get(key), bytes) else self[key] for key in self}
+
+    def compact(self):
+        '''packs the materialized fields again, changes made to them in place included. returns the number of fields packed'''
+        if not self.packed:
+            return 0
+        count = 0
+        for key, value in self.packed.items():
+            if not isinstance(value, bytes):
+                self.packed[key] = pack_value(value)
+                count += 1
+        return count
+
+    def __getitem__(self, key):
+        if key in FLAG_BITS and self.flags_known & FLAG_BITS[key]:
+            return bool(self.flags_value & FLAG_BITS[key])
+        if key in PLACE_SCALAR_FIELDS and hasattr(self, key):
+            value = getattr(self, key)
+            return list(value) if key == 'types' else value
+        if self.packed and key in self.packed:
+            value = self.packed[key]
+            # json values are never bytes, bytes are the still packed field. the materialized value is kept so writes into it are not lost
+            if isinstance(value, bytes):
+                value = self.packed[key] = unpack_value(value)
+            return value
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self.clear_value(key)
+        else:
+            self.key_order = intern_key_order(self.key_order + (key,))
+        # an assigned packed field keeps the object itself until the next compact, later changes to it are kept like on a dict
+        self.store(key, value, pack=False)
+
+    def store(self, key, value, pack=True):
+        '''stores a field that is not set yet, in the slot / flag bits / packed / extra storage of its kind (a packed field is only compressed when
+        pack is True)'''
+        if key in FLAG_BITS and isinstance(value, bool):
+            self.flags_known |= FLAG_BITS[key]
+            if value:
+                self.flags_value |= FLAG_BITS[key]
+            else:
+                self.flags_value &= ~FLAG_BITS[key]
+        elif key == 'types' and isinstance(value, list) and all(isinstance(place_type, str) for place_type in value):
+            self.types = intern_types(value)
+        elif key == 'business_status' and isinstance(value, str):
+            self.business_status = sys.intern(value)
+        elif key in PLACE_SCALAR_FIELDS and key != 'types':
+            setattr(self, key, value)
+        elif key in PLACE_PACKED_FIELDS:
+            if self.packed is None:
+                self.packed = {}
+            self.packed[key] = pack_value(value) if pack else value
+        else:
+            # the other fields, and the flag / types values of an unexpected shape (null, strings, ...)
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        self.clear_value(key)
+        self.key_order = intern_key_order(tuple(field for field in self.key_order if field != key))
+
+    def clear_value(self, key):
+        if key in FLAG_BITS and self.flags_known & FLAG_BITS[key]:
+            self.flags_known &= ~FLAG_BITS[key]
+            return
+        if key in PLACE_SCALAR_FIELDS and hasattr(self, key):
+            delattr(self, key)
+            return
+        for store in (self.packed, self.extra):
+            if store and key in store:
+                del store[key]
+                return
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.key_order)
+
+    def __len__(self):
+        return len(self.key_order)
+
+    def __contains__(self, key):
+        if key in FLAG_BITS and self.flags_known & FLAG_BITS[key]:
+            return True
+        if key in PLACE_SCALAR_FIELDS and hasattr(self, key):
+            return True
+        return bool((self.packed and key in self.packed) or (self.extra and key in self.extra))
+
+    def __repr__(self):
+        return f"Place({getattr(self, 'place_id', None)!r}, {getattr(self, 'name', None)!r})"
@@ -0,0 +1,220 @@
+'''
+
+This module publishes the combined places as an immutable columnar snapshot (Arrow IPC file format, restaurant_data_snapshot.arrow) so the map and
+dashboard scripts do not have to json.load the whole restaurant_data_all_combined.json at startup.
+
+    - the merge step (google_api_model_data.py) writes the snapshot with write_place_snapshot: one flat column per field the maps / filters use
+      (name, rating, price_level, lat / lng, the service flags, types, opening hours mask, sentiment, cuisine labels, ...), uncompressed so the
+      column buffers can be used in place
+    - the snapshot is written to a temp file and published with os.replace, a reader never sees a half written file and the readers that have the
+      previous snapshot open keep reading it (the old file stays alive until they close it)
+    - open_place_snapshot memory maps the file, opening it only reads the schema and the record batch metadata (milliseconds), the column data is
+      paged in by the os when it is read and the pages are shared by every process that maps the same file (several dashboard workers hold one
+      page cached copy)
+    - snapshot_column gives a column as a numpy array without copying (numeric columns without missing values), snapshot_to_frame gives the
+      place_filters.py filter frame, snapshot_place_records rebuilds json shaped records (geometry.location, editorial_summary.overview, ...) for
+      only the rows that are drawn on the map
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from collections.abc import Mapping
+from datetime import datetime
+from place_filters import add_derived_filter_columns, PLACE_FILTER_FIELDS
+import logging
+import os
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# CONSTANTS ###################################################################################################################################
+
+SNAPSHOT_FILE_NAME = 'restaurant_data_snapshot.arrow'
+SNAPSHOT_FORMAT_VERSION = '1'
+
+PLACE_FLAG_COLUMNS = ['reservable', 'dine_in', 'takeout', 'delivery', 'curbside_pickup', 'wheelchair_accessible_entrance', 'serves_breakfast',
+                      'serves_brunch', 'serves_lunch', 'serves_dinner', 'serves_wine', 'serves_beer', 'serves_vegetarian_food']
+
+# the repeated text columns (a handful of distinct values) are dictionary encoded, each value is stored once
+DICTIONARY_STRING = pa.dictionary(pa.int32(), pa.string())
+
+SNAPSHOT_SCHEMA = pa.schema(
+    [
+        ('place_id', pa.string()),
+        ('name', pa.string()),
+        ('formatted_address', pa.string()),
+        ('formatted_phone_number', pa.string()),
+        ('website', pa.string()),
+        ('url', pa.string()),
+        ('lat', pa.float64()),
+        ('lng', pa.float64()),
+        ('rating', pa.float64()),
+        ('user_ratings_total', pa.int64()),
+        ('price_level', pa.int8()),
+        ('business_status', DICTIONARY_STRING),
+        ('crow_fly_distance_km', pa.float64()),
+        ('utc_offset', pa.int16()),
+    ]
+    + [(field, pa.bool_()) for field in PLACE_FLAG_COLUMNS]
+    + [
+        ('types', pa.list_(pa.string())),
+        ('overview', pa.string()),
+        ('weekday_text', pa.list_(pa.string())),
+        ('review_texts', pa.list_(pa.string())),
+        ('opening_hours_mask', DICTIONARY_STRING),
+        ('opening_hours_day_period', DICTIONARY_STRING),
+        ('sentiment_mean', pa.float64()),
+        ('sentiment_review_count', pa.int32()),
+        ('cuisine', DICTIONARY_STRING),
+        ('service_style', DICTIONARY_STRING),
+        ('source_address_file', DICTIONARY_STRING),
+        ('last_updated', pa.string()),
+    ]
+)
+
+# snapshot column -> path of the value in the place json record
+NESTED_COLUMN_PATHS = {
+    'lat': ('geometry', 'location', 'lat'),
+    'lng': ('geometry', 'location', 'lng'),
+    'overview': ('editorial_summary', 'overview'),
+    'weekday_text': ('opening_hours', 'weekday_text'),
+    'review_texts': ('reviews',),
+    'sentiment_mean': ('review_sentiment', 'mean'),
+    'sentiment_review_count': ('review_sentiment', 'count'),
+    'cuisine': ('place_labels', 'cuisine'),
+    'service_style': ('place_labels', 'service_style'),
+}
+
+# FUNCTIONS ###################################################################################################################################
+
+def to_bool(value):
+    return value if value is True or value is False else None
+
+def to_int(value):
+    if type(value) is int:
+        return value
+    return int(value) if type(value) is float and value.is_integer() else None
+
+def to_float(value):
+    return float(value) if type(value) in (int, float) else None
+
+def to_text(value):
+    return value if isinstance(value, str) else None
+
+def to_text_list(value):
+    return [str(item) for item in value] if isinstance(value, list) else None
+
+def to_review_texts(value):
+    '''the text of each review (the popups only show the texts), turned back into [{'text': ...}] by snapshot_place_records'''
+    return [review.get('text') if isinstance(review, Mapping) else None for review in value] if isinstance(value, list) else None
+
+def column_converter(arrow_type):
+    '''the function that keeps a value when it fits the column type and gives None otherwise (so a stray string in a numeric field does not fail
+    the whole snapshot)'''
+    if pa.types.is_dictionary(arrow_type):
+        arrow_type = arrow_type.value_type
+    if pa.types.is_boolean(arrow_type):
+        return to_bool
+    if pa.types.is_integer(arrow_type):
+        return to_int
+    if pa.types.is_floating(arrow_type):
+        return to_float
+    if pa.types.is_list(arrow_type):
+        return to_text_list
+    return to_text
+
+def places_to_table(places):
+    '''the snapshot table of the {place_id: place} records (dicts or place_model.Place), built column by column in a single pass'''
+    columns = {field.name: [] for field in SNAPSHOT_SCHEMA}
+    # (column append, path of the value in the record, converter) of every column, resolved once instead of per place
+    plan = [(columns[field.name].append, NESTED_COLUMN_PATHS.get(field.name, (field.name,)),
+             to_review_texts if field.name == 'review_texts' else column_converter(field.type))
+            for field in SNAPSHOT_SCHEMA if field.name != 'place_id']
+    for place_id, details in places.items():
+        if not isinstance(details, Mapping):
+            continue
+        columns['place_id'].append(place_id)
+        for append, path, convert in plan:
+            value = details.get(path[0])
+            for key in path[1:]:
+                value = value.get(key) if isinstance(value, Mapping) else None
+            append(convert(value))
+
+    arrays = []
+    for field in SNAPSHOT_SCHEMA:
+        if pa.types.is_dictionary(field.type):
+            arrays.append(pa.array(columns[field.name], type=field.type.value_type).dictionary_encode())
+        else:
+            arrays.append(pa.array(columns[field.name], type=field.type))
+    return pa.Table.from_arrays(arrays, schema=SNAPSHOT_SCHEMA)
+
+def write_place_snapshot(places, snapshot_path):
+    '''writes the snapshot of the places and publishes it atomically, returns the number of places in it'''
+    table = places_to_table(places)
+    metadata = {'format_version': SNAPSHOT_FORMAT_VERSION, 'created': datetime.now().isoformat(), 'place_count': str(table.num_rows)}
+    table = table.replace_schema_metadata(metadata)
+    temp_path = f"{snapshot_path}.tmp"
+    # uncompressed ipc file format, the record batches are read straight from the memory map
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, snapshot_path)
+    logging.getLogger(__name__).info(f"{write_place_snapshot.__name__} - {table.num_rows} places published to {snapshot_path}")
+    return table.num_rows
+
+def open_place_snapshot(snapshot_path):
+    '''the snapshot table backed by a memory map of the file (no column data is read or copied until it is used)'''
+    source = pa.memory_map(snapshot_path, 'r')
+    return pa.ipc.open_file(source).read_all()
+
+def snapshot_metadata(table):
+    return {key.decode(): value.decode() for key, value in (table.schema.metadata or {}).items()}
+
+def snapshot_column(table, name):
+    '''the column as a numpy array, zero copy for the numeric columns without missing values (a float copy with NaN for the missing values
+    otherwise), the dictionary columns are decoded'''
+    column = table.column(name)
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    if column.num_chunks == 1 and column.null_count == 0 and (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)):
+        return column.chunk(0).to_numpy(zero_copy_only=True)
+    if pa.types.is_integer(column.type):
+        column = column.cast(pa.float64())
+    return column.to_numpy(zero_copy_only=False)
+
+def snapshot_to_frame(table):
+    '''the place_filters.py filter frame (indexed by place_id) of the snapshot, same columns as places_to_frame'''
+    columns = [field for field in PLACE_FILTER_FIELDS + ['lat', 'lng', 'overview', 'opening_hours_mask'] if field != 'types']
+    selected = table.select(['place_id'] + columns)
+    # the dictionary columns are decoded so the frame has the same plain object columns as the one built from the records
+    for position, field in enumerate(selected.schema):
+        if pa.types.is_dictionary(field.type):
+            selected = selected.set_column(position, field.name, selected.column(position).cast(field.type.value_type))
+    frame = selected.to_pandas().set_index('place_id')
+    # types as the ';' delimited string the filters match against, joined in arrow instead of per row
+    joined_types = pc.binary_join(table.column('types'), ';')
+    frame['types'] = pc.binary_join_element_wise('', joined_types, '', ';', null_handling='replace', null_replacement='').to_numpy(zero_copy_only=False)
+    return add_derived_filter_columns(frame)
+
+def snapshot_place_records(table, place_ids=None):
+    '''(place_id, details) pairs in the json record shape for the given place ids (all the places when None), only the fields of the snapshot are
+    present and missing values are left out, so the map_layers.py / popup getters work on them as on the full records'''
+    if place_ids is not None:
+        positions = {place_id: position for position, place_id in enumerate(table.column('place_id').to_pylist())}
+        table = table.take(pa.array([positions[place_id] for place_id in place_ids], type=pa.int64()))
+    records = []
+    for row in table.to_pylist():
+        place_id = row.pop('place_id')
+        details = {'types': row.pop('types') or []}
+        review_texts = row.pop('review_texts')
+        if review_texts is not None:
+            details['reviews'] = [{'text': text} if text is not None else {} for text in review_texts]
+        for name, value in row.items():
+            if value is None:
+                continue
+            path = NESTED_COLUMN_PATHS.get(name, (name,))
+            target = details
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[path[-1]] = value
+        records.append((place_id, details))
+    return records
@@ -0,0 +1,130 @@
+'''
+
+This module is the relevance gate from the google_api_data_feed.py roadmap ("classify all entities as relevant or non-relevant to our needs, begin
+keeping record of business names / types that are not relevant, and then ... filter out those non-relevant records before calling the google place
+details api to avoid unnecessary api calls and charges").
+
+The text search and nearby search results already carry name, types, rating, user_ratings_total, price_level and business_status, so the gate
+runs on those search payloads and only the relevant place ids go on to the (billed) place details call. A place is non-relevant when:
+    - its business_status is one of the excluded statuses (closed permanently by default)
+    - its primary (first) type is an excluded type (gas station, convenience store, supermarket, lodging, ...) or none of its types is a food type
+    - its name matches an excluded name pattern (fast food chains by default)
+    - its name or one of its types is in the persisted non-relevant list
+    - it is under the optional minimum rating / number of ratings
+
+The rules are a json file (written with the defaults on the first run, edit it to change the gate). The non-relevant list is a second json file:
+the names and types in it are excluded, every rejected place is recorded in it with the reason (and the names rejected by a name pattern are
+added to the names), so the list grows with every run and can be curated by hand.
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from datetime import datetime
+import json
+import logging
+import os
+import re
+
+# CONSTANTS ###################################################################################################################################
+
+DEFAULT_RELEVANCE_RULES = {
+    'excluded_business_statuses': ['CLOSED_PERMANENTLY'],
+    'excluded_primary_types': ['gas_station', 'convenience_store', 'grocery_or_supermarket', 'supermarket', 'lodging', 'liquor_store',
+                               'department_store', 'shopping_mall', 'movie_theater', 'bowling_alley', 'casino', 'gym', 'hospital', 'school',
+                               'university', 'car_wash', 'car_repair', 'pharmacy', 'drugstore', 'store', 'fast_food_restaurant'],
+    # at least one of these types is required (the search is type=restaurant, this drops the stray results)
+    'required_types': ['restaurant', 'bar', 'cafe', 'bakery', 'meal_takeaway', 'meal_delivery', 'night_club', 'food'],
+    'excluded_name_patterns': [
+        "mcdonald'?s", 'burger king', "wendy'?s", 'subway', 'taco bell', 'kfc', 'kentucky fried chicken', "popeyes", "domino'?s", 'pizza hut',
+        "papa john'?s", 'little caesars', "dunkin'?", 'starbucks', 'chick-fil-a', 'sonic drive-in', "arby'?s", 'jack in the box', 'dairy queen',
+        "carl'?s jr", "hardee'?s", 'white castle', 'del taco', "church'?s (?:texas )?chicken", 'panda express', 'tim hortons', 'krispy kreme',
+        '7-eleven', 'wawa', 'sheetz', 'quiznos', "jimmy john'?s", "jersey mike'?s", 'firehouse subs', 'wingstop', 'checkers', "rally'?s",
+    ],
+    'min_rating': None,  # e.g. 3.5, places without a rating are kept
+    'min_user_ratings_total': 0,
+}
+
+NON_WORD_PATTERN = re.compile(r'[^a-z0-9]+')
+
+# FUNCTIONS ###################################################################################################################################
+
+def normalize_place_name(name):
+    return NON_WORD_PATTERN.sub(' ', (name or '').lower()).strip()
+
+def load_json(file_path, default):
+    if file_path and os.path.exists(file_path):
+        with open(file_path, 'r') as file:
+            return json.load(file)
+    return default
+
+def write_json_atomic(file_path, data):
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'w') as file:
+        json.dump(data, file, indent=4)
+    os.replace(temp_path, file_path)
+
+# CLASSES ###################################################################################################################################
+
+class RelevanceGate:
+    def __init__(self, rules_path=None, non_relevant_path=None):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.rules_path = rules_path
+        self.non_relevant_path = non_relevant_path
+        self.rules = {**DEFAULT_RELEVANCE_RULES, **load_json(rules_path, {})}
+        if rules_path and not os.path.exists(rules_path):
+            write_json_atomic(rules_path, self.rules)
+        self.non_relevant = {'names': {}, 'types': {}, 'places': {}, **load_json(non_relevant_path, {})}
+        self.compile_rules()
+
+    def compile_rules(self):
+        self.excluded_statuses = set(self.rules['excluded_business_statuses'])
+        self.excluded_primary_types = set(self.rules['excluded_primary_types'])
+        self.required_types = set(self.rules['required_types'])
+        patterns = self.rules['excluded_name_patterns']
+        self.excluded_name_pattern = re.compile(rf"\b(?:{'|'.join(patterns)})\b", re.IGNORECASE) if patterns else None
+
+    def non_relevant_reason(self, payload):
+        '''the reason the search result is not relevant, None when it is'''
+        name = payload.get('name') or ''
+        types = payload.get('types') or []
+        if payload.get('business_status') in self.excluded_statuses:
+            return f"business_status {payload['business_status']}"
+        if types and types[0] in self.excluded_primary_types:
+            return f"primary type {types[0]}"
+        if types and self.required_types and not self.required_types.intersection(types):
+            return 'no food type'
+        listed_types = [place_type for place_type in types if place_type in self.non_relevant['types']]
+        if listed_types:
+            return f"non-relevant type {listed_types[0]}"
+        if normalize_place_name(name) in self.non_relevant['names']:
+            return 'non-relevant name'
+        if self.excluded_name_pattern and self.excluded_name_pattern.search(name):
+            return 'excluded name pattern'
+        if self.rules['min_rating'] is not None and payload.get('rating') is not None and payload['rating'] < self.rules['min_rating']:
+            return f"rating {payload['rating']}"
+        if (payload.get('user_ratings_total') or 0) < self.rules['min_user_ratings_total']:
+            return f"{payload.get('user_ratings_total') or 0} ratings"
+        return None
+
+    def filter_place_ids(self, place_ids, search_payloads):
+        '''returns (relevant place ids, {rejected place id: reason}). place ids without a search payload are kept (nothing to judge them on)'''
+        relevant = set()
+        rejected = {}
+        now = datetime.now().isoformat()
+        for place_id in place_ids:
+            payload = search_payloads.get(place_id)
+            reason = self.non_relevant_reason(payload) if payload else None
+            if reason is None:
+                relevant.add(place_id)
+                self.non_relevant['places'].pop(place_id, None)  # reopened / renamed places leave the list
+                continue
+            rejected[place_id] = reason
+            self.non_relevant['places'][place_id] = {'name': payload.get('name'), 'types': payload.get('types', []), 'reason': reason, 'last_seen': now}
+            if reason == 'excluded name pattern':
+                self.non_relevant['names'].setdefault(normalize_place_name(payload.get('name')), reason)
+        self.logger.info(f"{self.filter_place_ids.__name__} - {len(relevant)} relevant, {len(rejected)} non-relevant of {len(relevant) + len(rejected)} places")
+        return relevant, rejected
+
+    def save(self):
+        if self.non_relevant_path:
+            write_json_atomic(self.non_relevant_path, self.non_relevant)
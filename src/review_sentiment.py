@@ -0,0 +1,170 @@
+'''
+
+This module adds the "overall sentiment" from the google_api_data_feed.py roadmap: an offline, lexicon based sentiment score for every stored review
+(review_store.py) and a per place summary (mean score, number of reviews, trend over time).
+
+Scoring is vectorized over the whole batch of reviews: the texts are tokenized into one long token frame, the token scores come from a restaurant
+lexicon with a single map, negations ("not good") and boosters ("really good") are applied with shifted token columns, and the per review totals are
+one groupby. The total is squashed into -1..1 the same way VADER does (x / sqrt(x^2 + 15)).
+
+Scores are cached in the review store by the sha256 of the review text (and the lexicon version), so each run only scores the reviews it has never
+seen, and identical review texts are scored once.
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from collections.abc import Mapping
+from datetime import datetime
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+import re
+
+# CONSTANTS ###################################################################################################################################
+
+# bump when the lexicon / rules change, the cached scores of older versions are recomputed
+SENTIMENT_LEXICON_VERSION = 1
+
+SENTIMENT_LEXICON = {
+    # positive
+    'amazing': 3.0, 'incredible': 3.0, 'outstanding': 3.0, 'exceptional': 3.0, 'perfect': 3.0, 'perfection': 3.0, 'phenomenal': 3.0,
+    'best': 2.8, 'excellent': 2.8, 'fantastic': 2.8, 'wonderful': 2.7, 'superb': 2.8, 'spectacular': 2.8, 'stellar': 2.6, 'divine': 2.6,
+    'delicious': 2.5, 'exquisite': 2.7, 'impeccable': 2.7, 'memorable': 2.2, 'love': 2.5, 'loved': 2.5, 'lovely': 2.2, 'favorite': 2.3,
+    'great': 2.2, 'awesome': 2.5, 'tasty': 2.0, 'flavorful': 2.0, 'fresh': 1.6, 'beautiful': 2.0, 'beautifully': 2.0, 'gorgeous': 2.2,
+    'good': 1.6, 'nice': 1.4, 'friendly': 1.8, 'attentive': 1.8, 'welcoming': 1.8, 'warm': 1.2, 'cozy': 1.5, 'charming': 1.8, 'recommend': 1.8,
+    'recommended': 1.8, 'enjoyed': 1.8, 'enjoy': 1.6, 'pleasant': 1.5, 'helpful': 1.5, 'knowledgeable': 1.6, 'generous': 1.5, 'worth': 1.4,
+    'tender': 1.4, 'crispy': 1.0, 'juicy': 1.4, 'creative': 1.5, 'authentic': 1.4, 'solid': 1.0, 'fun': 1.5, 'happy': 1.8, 'glad': 1.4,
+    'impressed': 2.0, 'impressive': 2.0, 'fabulous': 2.6, 'yum': 2.0, 'yummy': 2.0, 'gem': 2.2, 'reasonable': 1.0, 'fair': 0.8, 'clean': 1.0,
+    'professional': 1.4, 'polite': 1.4, 'prompt': 1.2, 'quick': 0.8, 'fast': 0.8, 'cute': 1.2, 'elegant': 1.8, 'romantic': 1.5, 'satisfied': 1.5,
+    # negative
+    'terrible': -3.0, 'horrible': -3.0, 'awful': -3.0, 'disgusting': -3.0, 'worst': -3.0, 'inedible': -3.0, 'rude': -2.6, 'dirty': -2.4,
+    'disappointing': -2.3, 'disappointed': -2.3, 'disappointment': -2.3, 'bad': -2.2, 'poor': -2.0, 'mediocre': -1.8, 'bland': -1.8,
+    'overpriced': -2.0, 'cold': -1.0, 'slow': -1.4, 'stale': -2.0, 'soggy': -1.8, 'burnt': -1.8, 'undercooked': -2.0, 'overcooked': -1.8,
+    'raw': -0.8, 'greasy': -1.4, 'salty': -1.2, 'dry': -1.2, 'tough': -1.2, 'chewy': -1.0, 'noisy': -1.2, 'loud': -1.0, 'cramped': -1.2,
+    'crowded': -0.8, 'wait': -0.6, 'waited': -1.0, 'waiting': -0.8, 'ignored': -2.2, 'forgot': -1.6, 'forgotten': -1.6, 'wrong': -1.6,
+    'never': -0.6, 'unfriendly': -2.2, 'unprofessional': -2.3, 'dismissive': -2.0, 'condescending': -2.2, 'sick': -2.6, 'hair': -1.5,
+    'avoid': -2.4, 'waste': -2.4, 'wasted': -2.4, 'meh': -1.2, 'okay': 0.2, 'ok': 0.2, 'average': -0.4, 'underwhelming': -2.0, 'lacking': -1.4,
+    'expensive': -0.8, 'pricey': -0.6, 'tiny': -0.8, 'hate': -2.7, 'hated': -2.7, 'unacceptable': -2.6, 'mess': -1.8, 'sticky': -1.2,
+}
+# multiply the score of the next sentiment word, sign preserving
+SENTIMENT_BOOSTERS = {
+    'very': 0.3, 'really': 0.3, 'so': 0.25, 'extremely': 0.45, 'incredibly': 0.45, 'super': 0.3, 'truly': 0.3, 'absolutely': 0.4,
+    'totally': 0.3, 'most': 0.3, 'quite': 0.15, 'pretty': 0.1, 'somewhat': -0.3, 'slightly': -0.4, 'kinda': -0.3, 'bit': -0.3,
+}
+SENTIMENT_NEGATIONS = {'not', 'no', 'never', 'nothing', 'nobody', 'neither', 'nor', 'none', 'isnt', 'wasnt', 'werent', 'dont', 'didnt',
+                       'doesnt', 'cant', 'couldnt', 'wouldnt', 'wont', 'aint', 'hardly', 'without'}
+NEGATION_SCALE = -0.74
+COMPOUND_NORMALIZATION = 15.0
+
+# apostrophes are dropped first so "wasn't" becomes the single token "wasnt"
+TOKEN_PATTERN = re.compile(r"[a-z]+")
+APOSTROPHE_PATTERN = re.compile(r"['’]")
+
+SECONDS_PER_YEAR = 365.25 * 24 * 3600
+
+SENTIMENT_CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS review_sentiment (
+    review_hash TEXT PRIMARY KEY,
+    lexicon_version INTEGER NOT NULL,
+    score REAL NOT NULL
+);
+'''
+
+# FUNCTIONS ###################################################################################################################################
+
+def review_hash(text):
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
+
+def score_review_texts(texts):
+    '''returns a numpy array with the -1..1 sentiment of every text, computed for the whole batch at once'''
+    texts = pd.Series(list(texts), dtype=object).fillna('')
+    if texts.empty:
+        return np.zeros(0)
+    tokens = texts.str.lower().str.replace(APOSTROPHE_PATTERN, '', regex=True).str.findall(TOKEN_PATTERN).explode().dropna()
+    if tokens.empty:
+        return np.zeros(len(texts))
+    review_index = tokens.index.to_numpy()
+    tokens = tokens.reset_index(drop=True)
+    by_review = tokens.groupby(review_index, sort=False)
+    previous_1 = by_review.shift(1)
+    previous_2 = by_review.shift(2)
+    previous_3 = by_review.shift(3)
+
+    scores = tokens.map(SENTIMENT_LEXICON).fillna(0.0).to_numpy()
+    boost = previous_1.map(SENTIMENT_BOOSTERS).fillna(0.0).to_numpy()
+    scores = scores * (1.0 + boost)
+    # a negation up to three words back flips (and dampens) the sentiment word: "not very good", "never had a bad"
+    negated = (previous_1.isin(SENTIMENT_NEGATIONS) | previous_2.isin(SENTIMENT_NEGATIONS) | previous_3.isin(SENTIMENT_NEGATIONS)).to_numpy()
+    scores = np.where(negated, scores * NEGATION_SCALE, scores)
+
+    totals = np.zeros(len(texts))
+    np.add.at(totals, review_index, scores)
+    return totals / np.sqrt(totals * totals + COMPOUND_NORMALIZATION)
+
+def summarize_place_sentiment(reviews):
+    '''reviews: frame of place_id, time (unix seconds), score. returns a frame indexed by place_id with the mean, count and trend (score change
+    per year, least squares slope over the review times, 0 for a single review)'''
+    frame = reviews[['place_id', 'time', 'score']].copy()
+    # years since the first review of the batch, small numbers keep the sums below precise
+    frame['years'] = (frame['time'] - frame['time'].min()).astype(np.float64) / SECONDS_PER_YEAR
+    frame['years_x_score'] = frame['years'] * frame['score']
+    frame['years_squared'] = frame['years'] * frame['years']
+    sums = frame.groupby('place_id').agg(count=('score', 'size'), score_sum=('score', 'sum'), years_sum=('years', 'sum'),
+                                         years_x_score_sum=('years_x_score', 'sum'), years_squared_sum=('years_squared', 'sum'),
+                                         first_review_time=('time', 'min'), last_review_time=('time', 'max'))
+    count = sums['count']
+    covariance = sums['years_x_score_sum'] - sums['years_sum'] * sums['score_sum'] / count
+    variance = sums['years_squared_sum'] - sums['years_sum'] ** 2 / count
+    summary = pd.DataFrame({
+        'mean': (sums['score_sum'] / count).round(3),
+        'count': count.astype(int),
+        # reviews on (almost) the same day carry no trend
+        'trend_per_year': (covariance / variance.where(variance > 1e-6)).fillna(0.0).round(3),
+        'first_review_time': sums['first_review_time'].astype(int),
+        'last_review_time': sums['last_review_time'].astype(int),
+    })
+    return summary
+
+# CLASSES ###################################################################################################################################
+
+class ReviewSentimentScorer:
+    def __init__(self, review_store):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.review_store = review_store
+        self.connection = review_store.connection
+        self.connection.executescript(SENTIMENT_CACHE_SCHEMA)
+
+    def score_stored_reviews(self):
+        '''scores the stored reviews that have no cached score yet, returns a frame of place_id, time, score for all the stored reviews'''
+        reviews = pd.read_sql_query('SELECT place_id, time, text FROM reviews', self.connection)
+        if reviews.empty:
+            return reviews.assign(score=pd.Series(dtype=float))
+        reviews['review_hash'] = [review_hash(text) for text in reviews['text']]
+        cached = pd.read_sql_query('SELECT review_hash, score FROM review_sentiment WHERE lexicon_version = ?', self.connection,
+                                   params=(SENTIMENT_LEXICON_VERSION,))
+        reviews = reviews.merge(cached, on='review_hash', how='left')
+
+        missing = reviews[reviews['score'].isna()].drop_duplicates('review_hash')
+        if not missing.empty:
+            started = datetime.now()
+            new_scores = score_review_texts(missing['text'])
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO review_sentiment (review_hash, lexicon_version, score) VALUES (?, ?, ?)',
+                                            zip(missing['review_hash'], [SENTIMENT_LEXICON_VERSION] * len(missing), new_scores.tolist()))
+            score_by_hash = pd.Series(new_scores, index=missing['review_hash'].to_numpy())
+            reviews['score'] = reviews['score'].fillna(reviews['review_hash'].map(score_by_hash))
+            print(f"Scored the sentiment of {len(missing)} new reviews in {datetime.now() - started}")
+        self.logger.info(f"{self.score_stored_reviews.__name__} - {len(missing)} reviews scored, {len(reviews) - len(missing)} from the cache")
+        # the merge with an empty cache leaves an object column
+        reviews['score'] = reviews['score'].astype(float)
+        return reviews[['place_id', 'time', 'score']]
+
+    def record_place_sentiment(self, places):
+        '''sets review_sentiment (mean, count, trend_per_year, first / last review time) on the place dicts that have stored reviews'''
+        summary = summarize_place_sentiment(self.score_stored_reviews())
+        summary = summary[summary.index.isin(list(places))]
+        for place_id, row in zip(summary.index, summary.to_dict('records')):
+            if isinstance(places[place_id], Mapping):
+                places[place_id]['review_sentiment'] = row
+        return len(summary)
@@ -0,0 +1,140 @@
+'''
+
+This module keeps the Google place reviews in a normalized SQLite table instead of the nested reviews lists of every place dict.
+
+The place details api only returns the latest 5 reviews, and the same place is stored again in every address file that found it. The review table
+is keyed by (place_id, author_name, time), so ingesting the place dicts of every run (and of every address file) only adds the reviews that were never
+seen before and the reviews accumulate over time.
+
+A full text index (SQLite FTS5, external content tables kept in sync by triggers) covers the review text and the editorial_summary.overview of the
+places, so keyword queries ("omakase", "natural wine", "patio") over all the reviews take milliseconds.
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from collections.abc import Mapping
+from datetime import datetime
+import logging
+import sqlite3
+
+# CONSTANTS ###################################################################################################################################
+
+REVIEW_STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS reviews (
+    place_id TEXT NOT NULL,
+    author_name TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    rating REAL,
+    text TEXT,
+    language TEXT,
+    original_language TEXT,
+    translated INTEGER,
+    author_url TEXT,
+    first_seen TEXT,
+    UNIQUE (place_id, author_name, time)
+);
+CREATE INDEX IF NOT EXISTS reviews_place_time ON reviews (place_id, time DESC);
+
+CREATE TABLE IF NOT EXISTS places (
+    place_id TEXT PRIMARY KEY,
+    name TEXT,
+    overview TEXT
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(text, content='reviews', content_rowid='rowid', tokenize='porter unicode61');
+CREATE TRIGGER IF NOT EXISTS reviews_fts_insert AFTER INSERT ON reviews BEGIN
+    INSERT INTO reviews_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS reviews_fts_delete AFTER DELETE ON reviews BEGIN
+    INSERT INTO reviews_fts (reviews_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS places_fts USING fts5(name, overview, content='places', content_rowid='rowid', tokenize='porter unicode61');
+CREATE TRIGGER IF NOT EXISTS places_fts_insert AFTER INSERT ON places BEGIN
+    INSERT INTO places_fts (rowid, name, overview) VALUES (new.rowid, new.name, new.overview);
+END;
+CREATE TRIGGER IF NOT EXISTS places_fts_delete AFTER DELETE ON places BEGIN
+    INSERT INTO places_fts (places_fts, rowid, name, overview) VALUES ('delete', old.rowid, old.name, old.overview);
+END;
+CREATE TRIGGER IF NOT EXISTS places_fts_update AFTER UPDATE OF name, overview ON places BEGIN
+    INSERT INTO places_fts (places_fts, rowid, name, overview) VALUES ('delete', old.rowid, old.name, old.overview);
+    INSERT INTO places_fts (rowid, name, overview) VALUES (new.rowid, new.name, new.overview);
+END;
+'''
+
+# CLASSES ###################################################################################################################################
+
+class ReviewStore:
+    def __init__(self, db_path):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(REVIEW_STORE_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def ingest_places(self, places):
+        '''adds the reviews never seen before and upserts the place overviews, returns the number of new reviews'''
+        now = datetime.now().isoformat()
+        review_rows = []
+        place_rows = []
+        for place_id, place in places.items():
+            if not isinstance(place, Mapping):
+                continue
+            place_rows.append((place_id, place.get('name'), (place.get('editorial_summary') or {}).get('overview')))
+            for review in place.get('reviews', []):
+                if not isinstance(review, dict):
+                    continue
+                review_rows.append((place_id, review.get('author_name') or 'Anonymous', int(review.get('time') or 0), review.get('rating'),
+                                    review.get('text'), review.get('language'), review.get('original_language'),
+                                    int(bool(review.get('translated'))), review.get('author_url'), now))
+
+        with self.connection:
+            # the unique key makes the reviews already stored (same place, author and time) a no-op
+            cursor = self.connection.executemany('''INSERT OR IGNORE INTO reviews (place_id, author_name, time, rating, text, language, original_language,
+                                           translated, author_url, first_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', review_rows)
+            # rowcount only counts the inserted reviews, not the full text index rows added by the trigger
+            new_reviews = cursor.rowcount
+            # only a changed name / overview rewrites the row (and its full text index entry)
+            self.connection.executemany('''INSERT INTO places (place_id, name, overview) VALUES (?, ?, ?)
+                                           ON CONFLICT (place_id) DO UPDATE SET name = excluded.name, overview = excluded.overview
+                                           WHERE places.name IS NOT excluded.name OR places.overview IS NOT excluded.overview''', place_rows)
+        self.logger.info(f"{self.ingest_places.__name__} - {new_reviews} new reviews from {len(review_rows)} reviews of {len(place_rows)} places")
+        return new_reviews
+
+    def latest_reviews(self, place_id, limit=5):
+        return [dict(row) for row in self.connection.execute(
+            'SELECT * FROM reviews WHERE place_id = ? ORDER BY time DESC LIMIT ?', (place_id, limit))]
+
+    def review_counts(self):
+        '''{place_id: number of stored reviews}'''
+        return dict(self.connection.execute('SELECT place_id, COUNT(*) FROM reviews GROUP BY place_id').fetchall())
+
+    def search_reviews(self, query, limit=50):
+        '''full text search over the review text (FTS5 query syntax: words, "phrases", OR, NOT, prefix*), best matches first'''
+        return [dict(row) for row in self.connection.execute(
+            '''SELECT reviews.place_id, places.name, reviews.author_name, reviews.time, reviews.rating,
+                      snippet(reviews_fts, 0, '[', ']', '...', 16) AS snippet, bm25(reviews_fts) AS score
+               FROM reviews_fts
+               JOIN reviews ON reviews.rowid = reviews_fts.rowid
+               LEFT JOIN places ON places.place_id = reviews.place_id
+               WHERE reviews_fts MATCH ? ORDER BY score LIMIT ?''', (query, limit))]
+
+    def search_places(self, query, limit=50):
+        '''full text search over the place names and editorial overviews'''
+        return [dict(row) for row in self.connection.execute(
+            '''SELECT places.place_id, places.name, places.overview, bm25(places_fts) AS score
+               FROM places_fts JOIN places ON places.rowid = places_fts.rowid
+               WHERE places_fts MATCH ? ORDER BY score LIMIT ?''', (query, limit))]
+
+    def place_ids_matching(self, query):
+        '''place ids whose reviews or overview match the query, for filtering the place data'''
+        rows = self.connection.execute(
+            '''SELECT reviews.place_id FROM reviews_fts JOIN reviews ON reviews.rowid = reviews_fts.rowid WHERE reviews_fts MATCH ?
+               UNION
+               SELECT places.place_id FROM places_fts JOIN places ON places.rowid = places_fts.rowid WHERE places_fts MATCH ?''', (query, query))
+        return {row[0] for row in rows}
@@ -1,6 +1,9 @@
 
 import folium
 from folium import IFrame, CustomIcon
+from map_layers import add_density_layer_from_arrays, add_place_layer, add_sharded_place_layer
+from place_snapshot import open_place_snapshot, snapshot_place_records, snapshot_to_frame, SNAPSHOT_FILE_NAME
+from place_filters import compile_filter, places_to_frame
 import json
 import os
 from dotenv import load_dotenv
@@ -19,9 +22,13 @@ if not os.path.exists(map_file_drop_folder):
 with open(f'{script_directory}/address_secrets_restaurants.json', 'r') as file:
     data = json.load(file)
 
-# Load the json data for comparison locations
-with open(f'{ROOT}/reports_processed/restaurant_data_all_combined.json', 'r') as file:
-    comp_data = json.load(file)
+# Load the comparison locations from the columnar snapshot published by the merge step (memory mapped, opens in milliseconds)
+# the combined json is only loaded for the reports processed before the snapshot existed
+comp_snapshot_path = f'{ROOT}/reports_processed/{SNAPSHOT_FILE_NAME}'
+comp_snapshot = open_place_snapshot(comp_snapshot_path) if os.path.exists(comp_snapshot_path) else None
+if comp_snapshot is None:
+    with open(f'{ROOT}/reports_processed/restaurant_data_all_combined.json', 'r') as file:
+        comp_data = json.load(file)
 
 # Initialize a map object with a dark theme
 m = folium.Map(location=[41.881832, -87.623177], tiles='CartoDB dark_matter', zoom_start=5)
@@ -45,60 +52,41 @@ for restaurant, details in data.items():
     icon = CustomIcon(logo_icon_path, icon_size=(20, 20))
     folium.Marker([lat, lng], icon=icon, popup=popup).add_to(m)
 
-# Function to map price level to grey scale color
-def price_to_color(price_level):
-    colors = ['#d4d4d4', '#a9a9a9', '#7e7e7e', '#535353']  # Example grey scale colors
-    return colors[price_level-1] if price_level <= len(colors) else colors[-1]
-
-# Define filters
-min_rating = 4.2  # Minimum acceptable rating
-allowed_price_levels = [3, 4]  # Only include these price levels
-
-# Initialize a counter for the number of locations included
-included_locations_count = 0
-
-# Loop through comparison data and add grey dots with popups to the map
-for comp_id, details in comp_data.items():
-    geometry = details.get('geometry', {})
-    location = geometry.get('location', {})
-    lat = location.get('lat')
-    lng = location.get('lng')
-    price_level = details.get('price_level', None)
-    rating = details.get('rating', 0)
-
-    # Skip locations that don't meet the criteria
-    if price_level not in allowed_price_levels or rating < min_rating:
-        continue
-    
-    # Increment the counter for included locations
-    included_locations_count += 1
-    
-    # Construct the popup content with a more angular aesthetic
-    popup_content = f"""
-    <div style="font-family: 'Arial', sans-serif; font-size: 14px;">
-        <strong>{details.get('name')}</strong><br>
-        Address: {details.get('formatted_address', 'N/A')}<br>
-        Phone: {details.get('formatted_phone_number', 'N/A')}<br>
-        Rating: {rating}<br>
-        Price Level: {price_level}<br>
-        Editorial Summary: {details.get('editorial_summary', 'N/A')}<br>
-        <a href='{details.get('website', '#')}' target='_blank'>Website</a><br>
-        <a href='{details.get('url', '#')}' target='_blank'>Maps URL</a><br>
-    </div>
-    """
-    iframe = IFrame(html=popup_content, width=300, height=150)
-    popup = folium.Popup(iframe, max_width=300)
-
-    # Only proceed if lat and lng are available
-    if lat is not None and lng is not None:
-        folium.CircleMarker(
-            location=[lat, lng],
-            radius=3.5,
-            color=price_to_color(price_level),
-            fill=True,
-            fill_color=price_to_color(price_level),
-            fill_opacity=0.5
-        ).add_to(m).add_child(popup)
+# Define filters (see place_filters.py for the expression syntax and the available columns)
+comp_filter_expression = "rating >= 4.2 and price_level in (3, 4)"
+
+# Collect the comparison places that meet the criteria with one vectorized mask over the place columns
+comp_frame = snapshot_to_frame(comp_snapshot) if comp_snapshot is not None else places_to_frame(comp_data)
+included_place_ids = comp_frame.index[compile_filter(comp_filter_expression)(comp_frame)]
+if comp_snapshot is not None:
+    included_places = snapshot_place_records(comp_snapshot, included_place_ids)  # only the included rows are turned into records
+else:
+    included_places = [(comp_id, comp_data[comp_id]) for comp_id in included_place_ids]
+
+# Counter for the number of locations included
+included_locations_count = len(included_places)
+
+# Zoom level where the map switches from the density overlay to the individual places
+place_dots_min_zoom = 9
+
+# Add the rating weighted density overlay of all comparison places for the zoomed out views, the aggregates are cached between runs
+density_cache_folder = os.path.join(map_file_drop_folder, 'density_cache')
+comp_located = comp_frame[['lat', 'lng']].notna().all(axis=1)
+add_density_layer_from_arrays(m, comp_frame.loc[comp_located, 'lat'].to_numpy(), comp_frame.loc[comp_located, 'lng'].to_numpy(),
+                              comp_frame.loc[comp_located, 'rating'].fillna(0).to_numpy(), density_cache_folder, max_zoom=place_dots_min_zoom - 1)
+
+# Write the comparison places to region shard files that the page loads for the current viewport, instead of embedding every place in the html
+# the sharded map has to be served over http (python -m http.server from the map files folder), set this to False for a single self-contained file
+shard_place_data = True
+place_shard_folder_name = 'restaurant_map_shards'
+
+# Add the comparison places as one GeoJSON layer, the dots are colored by price level and the popups are built in the browser
+if shard_place_data:
+    mapped_locations_count = add_sharded_place_layer(m, included_places, os.path.join(map_file_drop_folder, place_shard_folder_name), f'{place_shard_folder_name}/',
+                                                     min_zoom=place_dots_min_zoom)
+else:
+    mapped_locations_count = add_place_layer(m, included_places, min_zoom=place_dots_min_zoom)
+print(f"Comparison locations added to the map: {mapped_locations_count}")
 
 # Print the number of locations included after filtering
 print(f"Included locations after filtering: {included_locations_count}")
@@ -1,6 +1,9 @@
 
 import folium
 from folium import IFrame, CustomIcon
+from map_layers import add_place_layer
+from place_snapshot import open_place_snapshot, snapshot_place_records, snapshot_to_frame, SNAPSHOT_FILE_NAME
+from place_filters import compile_filter, places_to_frame
 import json
 import os
 from dotenv import load_dotenv
@@ -19,9 +22,13 @@ if not os.path.exists(map_file_drop_folder):
 with open(f'{script_directory}/address_secrets_restaurants.json', 'r') as file:
     data = json.load(file)
 
-# Load the json data for comparison locations
-with open(f'{ROOT}/reports_processed/restaurant_data_all_combined.json', 'r') as file:
-    comp_data = json.load(file)
+# Load the comparison locations from the columnar snapshot published by the merge step (memory mapped, opens in milliseconds)
+# the combined json is only loaded for the reports processed before the snapshot existed
+comp_snapshot_path = f'{ROOT}/reports_processed/{SNAPSHOT_FILE_NAME}'
+comp_snapshot = open_place_snapshot(comp_snapshot_path) if os.path.exists(comp_snapshot_path) else None
+if comp_snapshot is None:
+    with open(f'{ROOT}/reports_processed/restaurant_data_all_combined.json', 'r') as file:
+        comp_data = json.load(file)
 
 # Initialize a map object with a dark theme
 m = folium.Map(location=[41.881832, -87.623177], tiles='CartoDB dark_matter', zoom_start=5)
@@ -61,71 +68,46 @@ for restaurant, details in data.items():
     icon = CustomIcon(logo_icon_path, icon_size=(20, 20))
     folium.Marker([lat, lng], icon=icon, popup=popup).add_to(m)
 
-# Function to map price level to grey scale color
-def price_to_color(price_level):
-    colors = ['#d4d4d4', '#a9a9a9', '#7e7e7e', '#535353']  # Example grey scale colors
-    return colors[price_level-1] if price_level <= len(colors) else colors[-1]
-
-# Define filters
-min_rating = 4.0  # Minimum acceptable rating
-allowed_price_levels = [3, 4]  # Only include these price levels
-
-# Initialize a counter for the number of locations included
-included_locations_count = 0
-
-# Loop through comparison data and add grey dots with popups to the map
-for comp_id, details in comp_data.items():
-    geometry = details.get('geometry', {})
-    location = geometry.get('location', {})
-    lat = location.get('lat')
-    lng = location.get('lng')
-    price_level = details.get('price_level', None)
-    rating = details.get('rating', 0)
-
-    # Skip locations that don't meet the criteria
-    if price_level not in allowed_price_levels or rating < min_rating:
-        continue
-    
-    # Increment the counter for included locations
-    included_locations_count += 1
-    
-    # Construct the popup content with a more angular aesthetic
-    popup_content = f"""
-    <div style="font-family: 'Arial', sans-serif; font-size: 14px;">
-        <strong>{details.get('name')}</strong><br>
-        <a href='{details.get('website', '#')}' target='_blank'>Website</a><br>
-        <a href='{details.get('url', '#')}' target='_blank'>Maps URL</a><br><br>
-        Address: {details.get('formatted_address', 'N/A')}<br>
-        Phone: {details.get('formatted_phone_number', 'N/A')}<br><br>
-        Rating: {rating}<br>
-        Total Ratings: {details.get('user_ratings_total', 'N/A')}<br>
-        Price Level: {price_level}<br><br>
-        Types: {', '.join(details.get('types', []))}<br><br>
-        Editorial Summary: {details.get('editorial_summary', {}).get('overview', 'N/A')}<br><br>
-        Operating Hours: <br>{'<br>'.join(details.get('opening_hours', {}).get('weekday_text', ['N/A']))}<br><br>
-        Reservations: {details.get('reservable', 'N/A')}<br>
-        Dine In: {details.get('dine_in', 'N/A')}<br>
-        Serves Wine: {details.get('serves_wine', 'N/A')}<br>
-        Serves Breakfast: {details.get('serves_breakfast', 'N/A')}<br>
-        Serves Brunch: {details.get('serves_brunch', 'N/A')}<br>
-        Serves Lunch: {details.get('serves_lunch', 'N/A')}<br>
-        Serves Dinner: {details.get('serves_dinner', 'N/A')}<br><br>
-        Review Text: <br>{'<br><br>'.join(review.get('text', 'N/A') for review in details.get('reviews', [])[:5])}<br><br>
-    </div>
-    """
-    iframe = IFrame(html=popup_content, width=300, height=900)
-    popup = folium.Popup(iframe, max_width=300)
-
-    # Only proceed if lat and lng are available
-    if lat is not None and lng is not None:
-        folium.CircleMarker(
-            location=[lat, lng],
-            radius=3.5,
-            color='#d4d4d4',
-            fill=True,
-            fill_color='#d4d4d4',
-            fill_opacity=0.5
-        ).add_to(m).add_child(popup)
+# Popup fields for the comparison places: (property name, popup label, function that pulls the value out of a place record)
+comp_popup_fields = [
+    ('name', '', lambda details: details.get('name')),
+    ('website', 'Website', lambda details: details.get('website')),
+    ('url', 'Maps URL', lambda details: details.get('url')),
+    ('address', 'Address', lambda details: details.get('formatted_address')),
+    ('phone', 'Phone', lambda details: details.get('formatted_phone_number')),
+    ('rating', 'Rating', lambda details: details.get('rating', 0)),
+    ('ratings_total', 'Total Ratings', lambda details: details.get('user_ratings_total')),
+    ('price_level', 'Price Level', lambda details: details.get('price_level')),
+    ('types', 'Types', lambda details: ', '.join(details.get('types', []))),
+    ('summary', 'Editorial Summary', lambda details: details.get('editorial_summary', {}).get('overview')),
+    ('hours', 'Operating Hours', lambda details: details.get('opening_hours', {}).get('weekday_text')),
+    ('reservable', 'Reservations', lambda details: details.get('reservable')),
+    ('dine_in', 'Dine In', lambda details: details.get('dine_in')),
+    ('serves_wine', 'Serves Wine', lambda details: details.get('serves_wine')),
+    ('serves_breakfast', 'Serves Breakfast', lambda details: details.get('serves_breakfast')),
+    ('serves_brunch', 'Serves Brunch', lambda details: details.get('serves_brunch')),
+    ('serves_lunch', 'Serves Lunch', lambda details: details.get('serves_lunch')),
+    ('serves_dinner', 'Serves Dinner', lambda details: details.get('serves_dinner')),
+    ('reviews', 'Review Text', lambda details: [review.get('text', 'N/A') for review in details.get('reviews', [])[:5]]),
+]
+
+# Define filters (see place_filters.py for the expression syntax and the available columns)
+comp_filter_expression = "rating >= 4.0 and price_level in (3, 4)"
+
+# Collect the comparison places that meet the criteria with one vectorized mask over the place columns
+comp_frame = snapshot_to_frame(comp_snapshot) if comp_snapshot is not None else places_to_frame(comp_data)
+included_place_ids = comp_frame.index[compile_filter(comp_filter_expression)(comp_frame)]
+if comp_snapshot is not None:
+    included_places = snapshot_place_records(comp_snapshot, included_place_ids)  # only the included rows are turned into records
+else:
+    included_places = [(comp_id, comp_data[comp_id]) for comp_id in included_place_ids]
+
+# Counter for the number of locations included
+included_locations_count = len(included_places)
+
+# Add the comparison places as one GeoJSON layer of grey dots, the popups are built in the browser when they are opened
+mapped_locations_count = add_place_layer(m, included_places, popup_fields=comp_popup_fields, price_level_colors=None, popup_height=900)
+print(f"Comparison locations added to the map: {mapped_locations_count}")
 
 # Print the number of locations included after filtering
 print(f"Included locations after filtering: {included_locations_count}")
@@ -0,0 +1,626 @@
+'''
+
+This module holds the WikiCityDataResearcher class used by city_data_wikipedia.py and city_level_data_feed.py to pull the city infobox data from Wikipedia.
+
+fetch_wikipedia_data looks up one city with one blocking action=parse request. fetch_wikipedia_data_batch is the bulk mode for long city lists:
+the search phrases are resolved to their final page titles (normalization + redirects) 50 at a time with action=query, and the wikitext of the
+resolved pages is then fetched with a bounded thread pool over the shared session, so hundreds of cities take seconds instead of minutes.
+
+fetch_city_infoboxes adds the city context from address_secrets_restaurants.json: each city is resolved to a page title using its state and country
+(trying "City, State" first and scoring the links of a disambiguation page against the state and country when the plain name is ambiguous), and the
+chosen title is saved to the title map file, so later runs go straight to the right page with a single request.
+
+parse_infobox takes a fast path: the infobox template span is located with a regex and brace matching and only that span is parsed with
+mwparserfromhell (falling back to the full article parse when the span is ambiguous), and the values are normalized in the same pass
+(refs, comments and markup stripped, links replaced by their text, population / area / density / elevation figures parsed to numbers).
+benchmark_infobox_parsing.py compares it with the full parse.
+
+The parsed infoboxes are cached on disk by page title and revision id. Inside the cache ttl a city costs no request at all, after it one batched
+action=query request (50 titles each) checks the latest revision ids, and only the pages that were edited since are downloaded and parsed again.
+
+For large city lists fetch_city_infoboxes_from_dump skips the api entirely and streams a local pages-articles dump (.xml, .xml.bz2 or .xml.gz)
+once with constant memory, extracting the infoboxes of the requested titles and following their redirects.
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from xml.etree import ElementTree
+import bz2
+import difflib
+import gzip
+import json
+import logging
+import mwparserfromhell
+import os
+import re
+import requests
+
+# CONSTANTS ###################################################################################################################################
+
+WIKIPEDIA_API_URL = "https://en.wikipedia.org/w/api.php"
+
+# the mediawiki api accepts up to 50 titles per action=query request for regular clients
+TITLES_PER_QUERY = 50
+
+# action=parse error codes that mean the page itself is gone (any other failure is treated as transient)
+MISSING_PAGE_ERROR_CODES = ('missingtitle', 'invalidtitle')
+
+# wikipedia asks api clients for a descriptive user agent, requests without one are throttled more aggressively
+WIKIPEDIA_USER_AGENT = 'web_scraping_research_agent/1.0 (city level data feed)'
+
+# bump this when parse_infobox changes so the cached infoboxes are parsed again
+INFOBOX_CACHE_VERSION = 2
+
+# start of the first template whose name contains "infobox" ({{Infobox settlement, {{Template:Infobox U.S. city, ...)
+INFOBOX_START_PATTERN = re.compile(r'\{\{\s*[^{}|<\n]*infobox', re.IGNORECASE)
+# tokens that matter for finding the end of the template span
+INFOBOX_BRACE_PATTERN = re.compile(r'<!--|\{\{|\}\}')
+# markup that can hide or fake braces, the full parse handles these
+INFOBOX_AMBIGUOUS_PATTERN = re.compile(r'<\s*(nowiki|pre|math|syntaxhighlight|source)\b', re.IGNORECASE)
+
+# infobox fields that are parsed to numbers when normalizing
+NUMERIC_INFOBOX_FIELD_PATTERN = re.compile(r'^(population_(total|metro|urban|rural|est|density_.*)|area_.*|elevation_.*|pop_.*)$')
+NUMBER_PATTERN = re.compile(r'-?\d[\d,]*(?:\.\d+)?')
+
+# templates whose first parameter is the value we want ({{nowrap|...}}, {{convert|600.6|km2}}), every other template (citations, icons) is dropped
+VALUE_TEMPLATES = {'nowrap', 'nobr', 'small', 'big', 'convert', 'cvt', 'abbr', 'nbsp', 'plainlist', 'ubl', 'unbulleted list', 'hlist', 'flatlist'}
+LINK_PREFIXES_TO_DROP = ('file:', 'image:', 'category:')
+
+# minimum score for a disambiguation page candidate to be picked automatically (see score_title_candidate)
+MIN_CANDIDATE_SCORE = 0.6
+
+# FUNCTIONS ###################################################################################################################################
+
+def city_title_key(city, state=None, country=None):
+    # the same city name can be in several states (Springfield, Portland), so the state and country are part of the title map key
+    return '|'.join([city or '', state or '', country or ''])
+
+def score_title_candidate(candidate, city, state=None, country=None):
+    '''scores a page title from a disambiguation page against the geocoded city context, 0 means the candidate is not usable'''
+    candidate_lower = candidate.lower()
+    if city.lower() not in candidate_lower:
+        return 0.0
+    # when we know the state the title has to name it, otherwise "Springfield (band)" could win on string similarity alone
+    if state and state.lower() not in candidate_lower:
+        return 0.0
+    score = difflib.SequenceMatcher(None, candidate_lower, ', '.join(part for part in [city, state] if part).lower()).ratio()
+    if country and country.lower() in candidate_lower:
+        score += 0.25
+    # parenthesized titles are usually neighborhoods, ships, songs, etc. rather than the city article
+    if '(' in candidate:
+        score -= 0.25
+    return score
+
+def wikicode_to_text(wikicode):
+    '''renders the readable text of a parsed value: refs / comments / unknown templates dropped, links replaced by their label'''
+    parts = []
+    for node in wikicode.nodes:
+        if isinstance(node, mwparserfromhell.nodes.Text):
+            parts.append(str(node))
+        elif isinstance(node, mwparserfromhell.nodes.Wikilink):
+            if str(node.title).strip().lower().startswith(LINK_PREFIXES_TO_DROP):
+                continue
+            parts.append(wikicode_to_text(node.text if node.text else node.title))
+        elif isinstance(node, mwparserfromhell.nodes.ExternalLink):
+            parts.append(wikicode_to_text(node.title) if node.title else str(node.url))
+        elif isinstance(node, mwparserfromhell.nodes.HTMLEntity):
+            parts.append(node.normalize())
+        elif isinstance(node, mwparserfromhell.nodes.Tag):
+            tag = str(node.tag).strip().lower()
+            if tag == 'br':
+                parts.append(', ')
+            elif tag not in ('ref', 'references') and node.contents is not None:
+                parts.append(wikicode_to_text(node.contents))
+        elif isinstance(node, mwparserfromhell.nodes.Template):
+            name = str(node.name).strip()
+            if name.lower().startswith('formatnum:'):
+                # parser functions keep their argument in the name: {{formatnum:808437}}
+                parts.append(name.split(':', 1)[1])
+            elif name.lower() in VALUE_TEMPLATES and node.params:
+                values = [wikicode_to_text(param.value).strip() for param in node.params if not param.showkey]
+                # {{convert|600.6|km2}} -> 600.6 km2, list templates -> comma separated items
+                separator = ' ' if name.lower() in ('convert', 'cvt') else ', '
+                parts.append(separator.join(value for value in values[:2 if separator == ' ' else None] if value))
+        # comments, arguments and every other node are dropped
+    return ''.join(parts)
+
+def parse_infobox_number(text):
+    '''returns the first number in the text (commas removed) as an int or float, or None'''
+    match = NUMBER_PATTERN.search(text)
+    if not match:
+        return None
+    number = match.group().replace(',', '')
+    return float(number) if '.' in number else int(number)
+
+def infobox_template_to_dict(template, normalize=True):
+    if not normalize:
+        return {str(param.name).strip(): str(param.value).strip() for param in template.params}
+    infobox_data = {}
+    for param in template.params:
+        name = str(param.name).strip()
+        value = re.sub(r'\s+', ' ', wikicode_to_text(param.value)).strip(' ,')
+        if NUMERIC_INFOBOX_FIELD_PATTERN.match(name):
+            number = parse_infobox_number(value)
+            value = number if number is not None else value
+        infobox_data[name] = value
+    return infobox_data
+
+def find_infobox_span(wikitext):
+    '''returns the (start, end) offsets of the first infobox template, or None when there is no infobox or the span is ambiguous'''
+    # skip the matches inside html comments, those are not templates
+    start = None
+    for match in INFOBOX_START_PATTERN.finditer(wikitext):
+        if wikitext.rfind('<!--', 0, match.start()) <= wikitext.rfind('-->', 0, match.start()):
+            start = match.start()
+            break
+    if start is None:
+        return None
+    depth = 0
+    position = start
+    while True:
+        token = INFOBOX_BRACE_PATTERN.search(wikitext, position)
+        if token is None:
+            return None  # unbalanced braces
+        if token.group() == '<!--':
+            comment_end = wikitext.find('-->', token.end())
+            if comment_end == -1:
+                return None
+            position = comment_end + 3
+            continue
+        depth += 1 if token.group() == '{{' else -1
+        position = token.end()
+        if depth == 0:
+            break
+    if INFOBOX_AMBIGUOUS_PATTERN.search(wikitext, start, position):
+        return None
+    return start, position
+
+def parse_infobox_fast(wikitext, normalize=True):
+    '''parses only the infobox template span, returns None when the full parse is needed (no infobox found or ambiguous span)'''
+    span = find_infobox_span(wikitext)
+    if span is None:
+        return None
+    nodes = mwparserfromhell.parse(wikitext[span[0]:span[1]]).nodes
+    if len(nodes) != 1 or not isinstance(nodes[0], mwparserfromhell.nodes.Template) or 'infobox' not in str(nodes[0].name).lower():
+        return None
+    return infobox_template_to_dict(nodes[0], normalize)
+
+def parse_infobox_full(wikitext, normalize=True):
+    '''parses the whole article and returns the first infobox template, this was the only path before the fast path was added'''
+    parsed_wikitext = mwparserfromhell.parse(wikitext)
+    for template in parsed_wikitext.filter_templates():
+        template_name = str(template.name).strip()
+        if "infobox" in template_name.lower():
+            return infobox_template_to_dict(template, normalize)
+    return None
+
+def normalize_dump_title(title):
+    # dump titles use spaces and an upper case first letter, the same normalization the api applies to requested titles
+    title = title.replace('_', ' ').strip()
+    return title[:1].upper() + title[1:]
+
+def open_dump(dump_path):
+    if dump_path.endswith('.bz2'):
+        return bz2.open(dump_path, 'rb')
+    if dump_path.endswith('.gz'):
+        return gzip.open(dump_path, 'rb')
+    return open(dump_path, 'rb')
+
+def scan_dump_pages(dump_path, wanted_titles):
+    '''streams the dump once and yields (title, redirect target or None, wikitext) for the main namespace pages in wanted_titles.
+    wanted_titles can grow while the scan runs (the redirect targets are added by the caller). every processed page is cleared from the
+    element tree, so memory stays flat no matter how large the dump is'''
+    with open_dump(dump_path) as dump_file:
+        root = None
+        for event, element in ElementTree.iterparse(dump_file, events=('start', 'end')):
+            if root is None:
+                root = element
+            if event != 'end' or not element.tag.endswith('}page'):
+                continue
+            namespace = element.tag[:-len('page')]
+            title = element.findtext(f'{namespace}title')
+            if element.findtext(f'{namespace}ns') == '0' and title in wanted_titles:
+                redirect = element.find(f'{namespace}redirect')
+                if redirect is not None:
+                    yield title, normalize_dump_title(redirect.get('title', '')), None
+                else:
+                    yield title, None, element.findtext(f'{namespace}revision/{namespace}text') or ''
+            # drop the processed pages, otherwise iterparse keeps the whole dump in memory
+            root.clear()
+
+def stream_dump_infoboxes(dump_path, titles, normalize=True):
+    '''returns ({requested title: infobox dict or None}, {title: redirect target}) for the titles, reading the dump once.
+    a redirect whose target page came earlier in the dump than the redirect page is resolved with a second pass limited to those targets'''
+    requested = [normalize_dump_title(title) for title in titles]
+    wanted_titles = set(requested)
+    redirects = {}
+    infoboxes = {}
+    target_seen_before_redirect = set()
+    scanned_titles = set()
+
+    for title, redirect_target, wikitext in scan_dump_pages(dump_path, wanted_titles):
+        scanned_titles.add(title)
+        if redirect_target is not None:
+            redirects[title] = redirect_target
+            if redirect_target in scanned_titles or redirect_target in infoboxes:
+                continue
+            wanted_titles.add(redirect_target)
+        else:
+            infoboxes[title] = parse_infobox_fast(wikitext, normalize) or parse_infobox_full(wikitext, normalize)
+
+    # only the redirect targets that sit before their redirect page in the dump need another read
+    for title, target in redirects.items():
+        if target not in infoboxes and target not in redirects:
+            target_seen_before_redirect.add(target)
+    if target_seen_before_redirect:
+        print(f"Second dump pass for {len(target_seen_before_redirect)} redirect targets that came before their redirect pages")
+        for title, redirect_target, wikitext in scan_dump_pages(dump_path, set(target_seen_before_redirect)):
+            if redirect_target is None:
+                infoboxes[title] = parse_infobox_fast(wikitext, normalize) or parse_infobox_full(wikitext, normalize)
+
+    results = {}
+    for original_title, title in zip(titles, requested):
+        # follow redirect chains (at most a few hops, and never around a loop)
+        seen = set()
+        while title in redirects and title not in seen:
+            seen.add(title)
+            title = redirects[title]
+        results[original_title] = infoboxes.get(title)
+    return results, redirects
+
+# CLASSES ###################################################################################################################################
+
+class WikiCityDataResearcher:
+    def __init__(self, max_workers=8, title_map_path=None, infobox_cache_path=None, cache_ttl_days=7):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.url = WIKIPEDIA_API_URL
+        self.max_workers = max_workers
+        self.title_map_path = title_map_path
+        self.title_map = self.load_title_map()
+        self.infobox_cache_path = infobox_cache_path
+        self.infobox_cache = self.load_infobox_cache()
+        self.cache_ttl = timedelta(days=cache_ttl_days)
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': WIKIPEDIA_USER_AGENT})
+        # size the connection pool to the worker count so the concurrent fetches reuse the kept-alive connections
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def fetch_wikipedia_data(self, search_phrase):
+        print(f"Fetching Wikipedia data for: {search_phrase}")
+        wikitext = self.fetch_wikitext(search_phrase)
+        if wikitext is None:
+            print(f"Failed to fetch data for {search_phrase}")
+            return None
+        return self.parse_infobox(wikitext)
+
+    def fetch_wikitext(self, title):
+        wikitext, _ = self.fetch_wikitext_revision(title)
+        return wikitext
+
+    def fetch_wikitext_revision(self, title):
+        '''returns the (wikitext, revision id) of the current page revision, or (None, None) if the page couldn't be fetched'''
+        wikitext, revid, _ = self.fetch_wikitext_page(title)
+        return wikitext, revid
+
+    def fetch_wikitext_page(self, title):
+        '''returns (wikitext, revision id, missing) of the current page revision. the wikitext is None when the page couldn't be fetched, missing
+        is only True when the api reports the page as missing or invalid (not for connection errors, http errors or broken json)'''
+        # Define the parameters for the API request to get the raw wikitext
+        params = {
+            "action": "parse",
+            "page": title,
+            "format": "json",
+            "formatversion": 2,
+            "prop": "wikitext",
+            "redirects": True,
+        }
+        # runs in the batch thread pool, so a connection error / timeout / broken json of one title must not abort the other titles of the batch
+        try:
+            response = self.session.get(url=self.url, params=params)
+            if response.status_code != 200:
+                self.logger.error(f"{self.fetch_wikitext_page.__name__} - HTTP Error: {response.status_code} for {title}")
+                return None, None, False
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            self.logger.error(f"{self.fetch_wikitext_page.__name__} - Request failed for {title}: {e}")
+            return None, None, False
+        if 'parse' not in data:
+            error = data.get('error', {})
+            self.logger.error(f"{self.fetch_wikitext_page.__name__} - API error for {title}: {error.get('info')}")
+            return None, None, error.get('code') in MISSING_PAGE_ERROR_CODES
+        return data["parse"]["wikitext"], data["parse"].get("revid"), False
+
+    def resolve_titles(self, search_phrases):
+        '''resolves the search phrases to their final page titles, following the title normalization and redirects, 50 phrases per request.
+        returns {search_phrase: {'title': final title, 'missing': bool, 'disambiguation': bool, 'revid': latest revision id}}'''
+        resolved = {}
+        unique_phrases = list(dict.fromkeys(search_phrases))
+        for start in range(0, len(unique_phrases), TITLES_PER_QUERY):
+            batch = unique_phrases[start:start + TITLES_PER_QUERY]
+            params = {
+                "action": "query",
+                "titles": "|".join(batch),
+                "redirects": True,
+                "prop": "pageprops|info",
+                "ppprop": "disambiguation",
+                "format": "json",
+                "formatversion": 2,
+            }
+            # a failed batch leaves its phrases unresolved (the callers treat them as not found this run), the other batches still resolve
+            try:
+                response = self.session.get(url=self.url, params=params)
+                if response.status_code != 200:
+                    self.logger.error(f"{self.resolve_titles.__name__} - HTTP Error: {response.status_code} resolving {len(batch)} titles")
+                    continue
+                query = response.json().get('query', {})
+            except (requests.RequestException, ValueError) as e:
+                self.logger.error(f"{self.resolve_titles.__name__} - Request failed resolving {len(batch)} titles: {e}")
+                continue
+
+            # follow the normalization (san francisco -> San Francisco) and then the redirect (NYC -> New York City) of each phrase
+            normalized = {item['from']: item['to'] for item in query.get('normalized', [])}
+            redirects = {item['from']: item['to'] for item in query.get('redirects', [])}
+            pages = {page['title']: page for page in query.get('pages', [])}
+            for phrase in batch:
+                title = normalized.get(phrase, phrase)
+                title = redirects.get(title, title)
+                page = pages.get(title, {'missing': True})
+                resolved[phrase] = {
+                    'title': title,
+                    'missing': bool(page.get('missing') or page.get('invalid')),
+                    'disambiguation': 'disambiguation' in page.get('pageprops', {}),
+                    'revid': page.get('lastrevid'),
+                }
+        self.logger.info(f"{self.resolve_titles.__name__} - Resolved {len(resolved)} titles in {-(-len(unique_phrases) // TITLES_PER_QUERY)} requests")
+        return resolved
+
+    def fetch_wikipedia_data_batch(self, search_phrases):
+        '''bulk version of fetch_wikipedia_data, returns {search_phrase: infobox dict or None}'''
+        print(f"Resolving Wikipedia titles for {len(search_phrases)} search phrases...")
+        resolved = self.resolve_titles(search_phrases)
+
+        # several phrases can resolve to the same page, each page is only fetched once
+        titles = []
+        for phrase in search_phrases:
+            resolution = resolved.get(phrase)
+            if not resolution or resolution['missing']:
+                print(f"No Wikipedia page found for {phrase}")
+            elif resolution['disambiguation']:
+                print(f"{phrase} resolved to the disambiguation page {resolution['title']}")
+            elif resolution['title'] not in titles:
+                titles.append(resolution['title'])
+
+        infoboxes = self.fetch_infoboxes_for_titles(titles)
+        results = {}
+        for phrase in search_phrases:
+            resolution = resolved.get(phrase)
+            usable = resolution and not resolution['missing'] and not resolution['disambiguation']
+            results[phrase] = infoboxes.get(resolution['title']) if usable else None
+        return results
+
+    def fetch_infoboxes_for_titles(self, titles, missing_titles=None):
+        '''returns {title: infobox dict} for the pages that were fetched, served from the infobox cache when the page revision hasn't changed. the
+        titles the api reports as missing or invalid are added to the missing_titles set when one is given (a title that failed for any other
+        reason is only left out of the result)'''
+        infoboxes = {}
+        now = datetime.now()
+        titles_to_check = []
+        titles_to_fetch = []
+        for title in titles:
+            entry = self.infobox_cache.get(title)
+            if not entry or entry.get('version') != INFOBOX_CACHE_VERSION:
+                titles_to_fetch.append(title)
+            elif now - datetime.fromisoformat(entry['checked_at']) < self.cache_ttl:
+                infoboxes[title] = entry['infobox']
+            else:
+                titles_to_check.append(title)
+
+        # past the ttl, one batched metadata request per 50 titles tells us which pages were edited since they were cached
+        if titles_to_check:
+            latest_revisions = self.resolve_titles(titles_to_check)
+            for title in titles_to_check:
+                entry = self.infobox_cache[title]
+                latest = latest_revisions.get(title, {})
+                if latest.get('revid') is not None and latest['revid'] == entry['revid']:
+                    entry['checked_at'] = now.isoformat()
+                    infoboxes[title] = entry['infobox']
+                else:
+                    titles_to_fetch.append(title)
+        print(f"Infobox cache: {len(infoboxes)} pages unchanged, {len(titles_to_fetch)} pages to fetch ({len(titles_to_check)} revision checks)")
+
+        if titles_to_fetch:
+            print(f"Fetching wikitext for {len(titles_to_fetch)} pages with {self.max_workers} workers...")
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                revisions = dict(zip(titles_to_fetch, executor.map(self.fetch_wikitext_page, titles_to_fetch)))
+            for title, (wikitext, revid, missing) in revisions.items():
+                if wikitext is None:
+                    if missing and missing_titles is not None:
+                        missing_titles.add(title)
+                    continue
+                infoboxes[title] = self.parse_infobox(wikitext)
+                self.infobox_cache[title] = {
+                    'revid': revid,
+                    'checked_at': now.isoformat(),
+                    'version': INFOBOX_CACHE_VERSION,
+                    'infobox': infoboxes[title],
+                }
+
+        if titles_to_check or titles_to_fetch:
+            self.save_infobox_cache()
+        return infoboxes
+
+    def load_infobox_cache(self):
+        if self.infobox_cache_path and os.path.exists(self.infobox_cache_path):
+            with open(self.infobox_cache_path, 'r') as file:
+                return json.load(file)
+        return {}
+
+    def save_infobox_cache(self):
+        if not self.infobox_cache_path:
+            return
+        with open(self.infobox_cache_path, 'w') as file:
+            json.dump(self.infobox_cache, file, indent=4)
+        self.logger.info(f"{self.save_infobox_cache.__name__} - Infobox cache with {len(self.infobox_cache)} pages saved to {self.infobox_cache_path}")
+
+    def load_title_map(self):
+        if self.title_map_path and os.path.exists(self.title_map_path):
+            with open(self.title_map_path, 'r') as file:
+                return json.load(file)
+        return {}
+
+    def save_title_map(self):
+        if not self.title_map_path:
+            return
+        with open(self.title_map_path, 'w') as file:
+            json.dump(self.title_map, file, indent=4)
+        self.logger.info(f"{self.save_title_map.__name__} - Title map with {len(self.title_map)} cities saved to {self.title_map_path}")
+
+    def fetch_disambiguation_links(self, title):
+        '''returns the article links listed on a disambiguation page'''
+        links = []
+        params = {
+            "action": "query",
+            "titles": title,
+            "prop": "links",
+            "plnamespace": 0,
+            "pllimit": "max",
+            "format": "json",
+            "formatversion": 2,
+        }
+        while True:
+            try:
+                response = self.session.get(url=self.url, params=params)
+                if response.status_code != 200:
+                    self.logger.error(f"{self.fetch_disambiguation_links.__name__} - HTTP Error: {response.status_code} for {title}")
+                    break
+                data = response.json()
+            except (requests.RequestException, ValueError) as e:
+                self.logger.error(f"{self.fetch_disambiguation_links.__name__} - Request failed for {title}: {e}")
+                break
+            for page in data.get('query', {}).get('pages', []):
+                links.extend(link['title'] for link in page.get('links', []))
+            if 'continue' not in data:
+                break
+            params.update(data['continue'])
+        return links
+
+    def resolve_city_titles(self, city_contexts):
+        '''resolves {city: {'state': ..., 'country': ...}} to {city: page title or None}, using and updating the persisted title map'''
+        titles = {}
+        unmapped = {}
+        for city, context in city_contexts.items():
+            key = city_title_key(city, context.get('state'), context.get('country'))
+            if key in self.title_map:
+                titles[city] = self.title_map[key]['title']
+            else:
+                unmapped[city] = context
+
+        if unmapped:
+            print(f"Resolving Wikipedia titles for {len(unmapped)} cities without a saved title...")
+            # "City, State" is the article title convention for most us cities, the plain city name is the fallback
+            phrases = []
+            for city, context in unmapped.items():
+                if context.get('state'):
+                    phrases.append(f"{city}, {context['state']}")
+                phrases.append(city)
+            resolved = self.resolve_titles(phrases)
+
+            for city, context in unmapped.items():
+                state, country = context.get('state'), context.get('country')
+                title, method, score = None, None, None
+                state_resolution = resolved.get(f"{city}, {state}") if state else None
+                city_resolution = resolved.get(city)
+                if state_resolution and not state_resolution['missing'] and not state_resolution['disambiguation']:
+                    title, method = state_resolution['title'], 'city_state_title'
+                elif city_resolution and not city_resolution['missing'] and not city_resolution['disambiguation']:
+                    title, method = city_resolution['title'], 'city_title'
+                else:
+                    # score the candidates of whichever disambiguation page we landed on against the state and country
+                    for resolution in (state_resolution, city_resolution):
+                        if resolution and not resolution['missing'] and resolution['disambiguation']:
+                            candidates = self.fetch_disambiguation_links(resolution['title'])
+                            scored = sorted(((score_title_candidate(candidate, city, state, country), candidate) for candidate in candidates), reverse=True)
+                            if scored and scored[0][0] >= MIN_CANDIDATE_SCORE:
+                                score, title = scored[0]
+                                method = 'disambiguation'
+                                print(f"{city} resolved from the disambiguation page {resolution['title']} to {title} (score {score:.2f})")
+                            break
+
+                titles[city] = title
+                if title:
+                    self.title_map[city_title_key(city, state, country)] = {
+                        'title': title,
+                        'method': method,
+                        'score': score,
+                        'resolved_at': datetime.now().isoformat(),
+                    }
+                else:
+                    print(f"Could not resolve a Wikipedia title for {city}")
+            self.save_title_map()
+        return titles
+
+    def fetch_city_infoboxes(self, city_contexts):
+        '''fetches the infobox of each city in {city: {'state': ..., 'country': ...}}, returns {city: infobox dict or None}'''
+        titles = self.resolve_city_titles(city_contexts)
+        missing_titles = set()
+        infoboxes = self.fetch_infoboxes_for_titles(list(dict.fromkeys(title for title in titles.values() if title)), missing_titles)
+
+        results = {}
+        stale_mappings = False
+        for city, title in titles.items():
+            results[city] = infoboxes.get(title) if title else None
+            # a saved title the api reports as missing (page moved or deleted) is dropped so the next run resolves the city again, a title that
+            # only failed to load this time (connection error, 5xx, broken json) keeps its mapping
+            if title and title in missing_titles:
+                context = city_contexts[city]
+                self.title_map.pop(city_title_key(city, context.get('state'), context.get('country')), None)
+                stale_mappings = True
+        if stale_mappings:
+            self.save_title_map()
+        return results
+
+    def fetch_city_infoboxes_from_dump(self, dump_path, city_contexts):
+        '''offline version of fetch_city_infoboxes: {city: {'state': ..., 'country': ...}} -> {city: infobox dict or None} from a local dump'''
+        # the saved title map is used when we have it, otherwise both "City, State" and "City" are looked up in the same pass
+        candidates = {}
+        for city, context in city_contexts.items():
+            key = city_title_key(city, context.get('state'), context.get('country'))
+            if key in self.title_map:
+                candidates[city] = [self.title_map[key]['title']]
+            elif context.get('state'):
+                candidates[city] = [f"{city}, {context['state']}", city]
+            else:
+                candidates[city] = [city]
+
+        print(f"Streaming the Wikipedia dump {dump_path} for {len(city_contexts)} cities...")
+        started = datetime.now()
+        titles = list(dict.fromkeys(title for city_titles in candidates.values() for title in city_titles))
+        infoboxes, redirects = stream_dump_infoboxes(dump_path, titles)
+        print(f"Dump scan finished in {datetime.now() - started}, {sum(1 for infobox in infoboxes.values() if infobox)} infoboxes found, {len(redirects)} redirects followed")
+        self.logger.info(f"{self.fetch_city_infoboxes_from_dump.__name__} - {len(titles)} titles scanned from {dump_path}")
+
+        results = {}
+        for city, city_titles in candidates.items():
+            # disambiguation pages have no infobox, so the first candidate with an infobox is the city article
+            results[city] = next((infoboxes[title] for title in city_titles if infoboxes.get(title)), None)
+        return results
+
+    def parse_infobox(self, wikitext, normalize=True):
+        print("Parsing wikitext to find the infobox...")
+        infobox_data = parse_infobox_fast(wikitext, normalize)
+        if infobox_data is None:
+            # no unambiguous infobox span, parse the whole article
+            infobox_data = parse_infobox_full(wikitext, normalize)
+
+        if infobox_data is None:
+            print("No infobox found.")
+            return None
+        print("Infobox template found. Extracting data...")
+        return infobox_data
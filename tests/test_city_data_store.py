@@ -0,0 +1,43 @@
+'''
+
+Tests for the staleness rules of city_data_store.py.
+
+usage: python -m pytest tests  (or python -m unittest discover tests)
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from datetime import datetime, timedelta
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from city_data_store import CityDataStore
+
+# CLASSES ###################################################################################################################################
+
+class CityDataStoreStalenessTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.store = CityDataStore(os.path.join(self.folder.name, 'cities.json'), data_shelf_life=30)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_fetched_city_is_fresh_until_the_shelf_life(self):
+        self.store.update_city('Springfield', {'state': 'Illinois'}, {'population_total': 114394})
+        self.assertFalse(self.store.is_stale('Springfield'))
+        self.store.data['Springfield']['last_updated'] = (datetime.now() - timedelta(days=31)).isoformat()
+        self.assertTrue(self.store.is_stale('Springfield'))
+
+    def test_failed_fetch_is_retried(self):
+        self.store.update_city('Atlantis', {'state': None}, None)
+        self.assertFalse(self.store.data['Atlantis']['infobox_found'])
+        self.assertTrue(self.store.is_stale('Atlantis'))
+        self.assertEqual(self.store.cities_to_fetch(['Atlantis', 'Nowhere']), ['Atlantis', 'Nowhere'])
+
+if __name__ == '__main__':
+    unittest.main()
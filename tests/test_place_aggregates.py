@@ -0,0 +1,144 @@
+'''
+
+Tests for the incremental aggregate cube of place_aggregates.py: update must give the same cube as a rebuild over the same places, through adds,
+changes (missing values included) and removals, and the cube must be rebuilt when the stored cube / rows do not belong together.
+
+usage: python -m pytest tests  (or python -m unittest discover tests)
+
+'''
+# IMPORTS ###################################################################################################################################
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from place_aggregates import CUBE_DIMENSIONS, MEASURE_COLUMNS, PlaceAggregates, write_parquet_atomic
+import numpy as np
+import pandas as pd
+
+# FUNCTIONS ###################################################################################################################################
+
+def make_place(city, rating=None, price_level=None, distance_km=None, sentiment=None, cuisine=None, source='restaurant_data_a.json'):
+    place = {'source_address_file': source, 'address_components': [{'long_name': city, 'types': ['locality', 'political']}]}
+    for key, value in [('rating', rating), ('price_level', price_level), ('crow_fly_distance_km', distance_km), ('user_ratings_total', 100)]:
+        if value is not None:
+            place[key] = value
+    if sentiment is not None:
+        place['review_sentiment'] = {'mean': sentiment}
+    if cuisine is not None:
+        place['place_labels'] = {'cuisine': cuisine}
+    return place
+
+def sample_places():
+    return {
+        'p1': make_place('Chicago', rating=4.5, price_level=2, distance_km=0.4, sentiment=0.6, cuisine='italian'),
+        'p2': make_place('Chicago', rating=3.0, price_level=2, distance_km=3.2, cuisine='italian'),
+        'p3': make_place('Chicago', price_level=1, distance_km=12.0, sentiment=-0.2),
+        'p4': make_place('Evanston', rating=5.0, distance_km=60.0, cuisine='thai', source='restaurant_data_b.json'),
+        'p5': make_place('Evanston', rating=4.0, price_level=3, cuisine='thai', source='restaurant_data_b.json'),
+    }
+
+def sorted_cube(cube):
+    return cube.sort_values(CUBE_DIMENSIONS).reset_index(drop=True)[CUBE_DIMENSIONS + MEASURE_COLUMNS]
+
+# CLASSES ###################################################################################################################################
+
+class PlaceAggregatesTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def assertCubeMatchesRebuild(self, aggregates, places):
+        rebuilt = PlaceAggregates(os.path.join(self.folder.name, 'rebuilt'))
+        rebuilt.rebuild(places)
+        pd.testing.assert_frame_equal(sorted_cube(aggregates.cube), sorted_cube(rebuilt.cube), check_exact=False, atol=1e-9)
+
+    def test_update_matches_rebuild_through_changes_and_removals(self):
+        places = sample_places()
+        aggregates = PlaceAggregates(self.folder.name)
+        self.assertEqual(aggregates.update(places), 5)
+        self.assertCubeMatchesRebuild(aggregates, places)
+        # unchanged places, missing values included, are not re-aggregated
+        self.assertEqual(aggregates.update(places), 0)
+
+        # a changed rating, a rating that goes missing, a place moving to another cell, a removal and an addition
+        places['p1']['rating'] = 3.5
+        del places['p2']['rating']
+        places['p3']['place_labels'] = {'cuisine': 'mexican'}
+        del places['p4']
+        places['p6'] = make_place('Chicago', rating=4.2, price_level=4, distance_km=1.5, sentiment=0.9, cuisine='italian')
+        self.assertEqual(aggregates.update(places), 5)
+        self.assertCubeMatchesRebuild(aggregates, places)
+
+        # the cell of the removed place is dropped, not kept with a zero count
+        self.assertTrue((aggregates.cube['place_count'] > 0.5).all())
+        self.assertFalse(((aggregates.cube['city'] == 'Evanston') & (aggregates.cube['distance_band'] == '50+ km')).any())
+
+    def test_saved_state_round_trips_and_mismatch_rebuilds(self):
+        places = sample_places()
+        aggregates = PlaceAggregates(self.folder.name)
+        aggregates.update(places)
+        aggregates.save()
+
+        reloaded = PlaceAggregates(self.folder.name)
+        self.assertEqual(reloaded.update(places), 0)
+        self.assertCubeMatchesRebuild(reloaded, places)
+
+        # without the rows file the next update would add every place a second time, it rebuilds instead
+        os.remove(aggregates.rows_path)
+        missing_rows = PlaceAggregates(self.folder.name)
+        self.assertEqual(missing_rows.update(places), len(places))
+        self.assertCubeMatchesRebuild(missing_rows, places)
+        missing_rows.save()
+
+        # a cube from another save (a crash between the two writes) does not match the rows
+        stale_cube = PlaceAggregates(self.folder.name).cube.copy()
+        places['p6'] = make_place('Chicago', rating=2.0, price_level=1, distance_km=0.2, cuisine='italian')
+        newer = PlaceAggregates(self.folder.name)
+        newer.update(places)
+        newer.save()
+        write_parquet_atomic(stale_cube, newer.cube_path, 'another-run')
+        mismatched = PlaceAggregates(self.folder.name)
+        self.assertFalse(mismatched.stored_files_match())
+        mismatched.update(places)
+        self.assertCubeMatchesRebuild(mismatched, places)
+
+    def test_query_helpers(self):
+        aggregates = PlaceAggregates(self.folder.name)
+        aggregates.update(sample_places())
+
+        overall = aggregates.query().iloc[0]
+        self.assertEqual(overall['place_count'], 5)
+        self.assertEqual(overall['rating_count'], 4)
+        self.assertAlmostEqual(overall['rating_mean'], np.mean([4.5, 3.0, 5.0, 4.0]), places=3)
+        self.assertAlmostEqual(overall['rating_std'], np.std([4.5, 3.0, 5.0, 4.0]), places=3)
+
+        by_city = aggregates.query(group_by=['city'])
+        self.assertEqual(by_city.loc['Chicago', 'place_count'], 3)
+        self.assertEqual(aggregates.query(city='Evanston').iloc[0]['place_count'], 2)
+        self.assertEqual(aggregates.query(city=['Chicago', 'Evanston']).iloc[0]['place_count'], 5)
+
+        distribution = aggregates.rating_distribution().iloc[0]
+        self.assertEqual(distribution['rating_3.0-3.5'], 1)
+        self.assertEqual(distribution['rating_4.5-5.0'], 2)
+        self.assertEqual(distribution.sum(), 4)
+
+        mix = aggregates.price_level_mix(city='Chicago').iloc[0]
+        self.assertAlmostEqual(mix['2'], 2 / 3, places=3)
+        self.assertAlmostEqual(mix['1'], 1 / 3, places=3)
+
+        bands = aggregates.distance_band_counts()
+        self.assertEqual(bands.loc['restaurant_data_a.json', '0-1 km'], 1)
+        self.assertEqual(bands.loc['restaurant_data_b.json', '50+ km'], 1)
+        self.assertEqual(bands.loc['restaurant_data_b.json', 'unknown'], 1)
+
+        with self.assertRaisesRegex(ValueError, 'Unknown cube dimension'):
+            aggregates.query(state='Illinois')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+'''
+
+Tests for the shared feature cache of place_classifier.py: a full retraining uses the seed labels of every cached place, not only the places of the
+address file that triggered it.
+
+usage: python -m pytest tests  (or python -m unittest discover tests)
+
+'''
+# IMPORTS ###################################################################################################################################
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from place_classifier import PlaceClassifier
+
+# FUNCTIONS ###################################################################################################################################
+
+def address_places(prefix, names):
+    return {f"{prefix}{position}": {'name': name, 'types': ['restaurant'], 'reviews': [{'text': f"great {name.split()[0].lower()} food"}]}
+            for position, name in enumerate(names)}
+
+# CLASSES ###################################################################################################################################
+
+class SharedSeedCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_retraining_keeps_the_seeds_of_the_other_addresses(self):
+        first = address_places('a', [f"Sushi Place {number}" for number in range(8)] + [f"Taco Shop {number}" for number in range(8)])
+        second = address_places('b', [f"Pizza Joint {number}" for number in range(8)] + [f"Ramen House {number}" for number in range(8)])
+        PlaceClassifier(self.folder.name).record_place_labels(first)
+        # the second address doubles the cache, which retrains the model from scratch
+        classifier = PlaceClassifier(self.folder.name)
+        classifier.record_place_labels(second)
+        self.assertEqual(len(classifier.place_ids), 32)
+        self.assertEqual(sum(seed is not None for seed in classifier.row_seeds['cuisine']), 32)
+        self.assertEqual(sorted(classifier.model['classifiers']['cuisine'].classes_), ['italian', 'japanese', 'mexican'])
+
+        # the seeds are persisted with the features index
+        reloaded = PlaceClassifier(self.folder.name)
+        self.assertEqual(reloaded.row_seeds, classifier.row_seeds)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+'''
+
+Tests for the open_<day>_<hour> filter columns of place_filters.py.
+
+usage: python -m pytest tests  (or python -m unittest discover tests)
+
+'''
+# IMPORTS ###################################################################################################################################
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from place_filters import filter_places, places_to_frame
+
+# CONSTANTS ###################################################################################################################################
+
+# open friday 18:00 - 23:00 (day 5 in the google periods, sunday is 0)
+PLACES = {
+    'late': {'name': 'Late', 'opening_hours': {'periods': [{'open': {'day': 5, 'time': '1800'}, 'close': {'day': 5, 'time': '2300'}}]}},
+    'closed': {'name': 'Closed'},
+}
+
+# CLASSES ###################################################################################################################################
+
+class OpenAtColumnTest(unittest.TestCase):
+    def setUp(self):
+        self.frame = places_to_frame(PLACES)
+
+    def test_open_at_hour(self):
+        self.assertEqual(list(filter_places(self.frame, 'open_fri_22').index), ['late'])
+        self.assertEqual(list(filter_places(self.frame, 'open_friday_7').index), [])
+
+    def test_hours_outside_the_day_are_unknown_columns(self):
+        for column in ['open_fri_24', 'open_fri_99', 'open_sat_47']:
+            with self.assertRaisesRegex(ValueError, f"Unknown filter column: {column}"):
+                filter_places(self.frame, column)
+
+if __name__ == '__main__':
+    unittest.main()
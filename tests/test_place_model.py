@@ -0,0 +1,109 @@
+'''
+
+Tests for the compact place records of place_model.py: the dict round trip, write_places_json against json.dump and the in place changes to the
+packed fields.
+
+usage: python -m pytest tests  (or python -m unittest discover tests)
+
+'''
+# IMPORTS ###################################################################################################################################
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from place_model import compact_places, Place, read_places_json, write_places_json
+
+# CONSTANTS ###################################################################################################################################
+
+PLACES = {
+    'ChIJa': {
+        'place_id': 'ChIJa',
+        'name': 'Trattoria Uno',
+        'types': ['restaurant', 'food', 'point_of_interest', 'establishment'],
+        'business_status': 'OPERATIONAL',
+        'rating': 4.5,
+        'price_level': 2,
+        'geometry': {'location': {'lat': 41.88, 'lng': -87.63}},
+        'reservable': True,
+        'serves_wine': False,
+        'delivery': None,
+        'opening_hours': {'open_now': True, 'periods': [{'open': {'day': 5, 'time': '1700'}, 'close': {'day': 5, 'time': '2300'}}]},
+        'reviews': [{'author_name': 'Ana', 'rating': 5, 'text': 'Café quality pasta – loved it'}],
+        'field_sources': {'rating': {'source': 'search', 'last_updated': '2024-02-06T19:17:13'}},
+        'editorial_summary': {'overview': 'Family style italian classics.'},
+        'last_updated': '2024-02-06T19:17:13.901102',
+    },
+    'ChIJb': {'name': 'No Frills', 'types': 'restaurant', 'reviews': [], 'rating': None},
+    'ChIJc': {},
+}
+
+# CLASSES ###################################################################################################################################
+
+class PlaceModelTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_dict_round_trip_keeps_values_and_key_order(self):
+        for details in PLACES.values():
+            place = Place.from_dict(details)
+            self.assertEqual(place.to_dict(), details)
+            self.assertEqual(list(place.to_dict()), list(details))
+            self.assertEqual(len(place), len(details))
+
+    def test_write_places_json_matches_json_dump(self):
+        expected_path = os.path.join(self.folder.name, 'expected.json')
+        with open(expected_path, 'w') as file:
+            json.dump(PLACES, file, indent=4)
+        places = read_places_json(expected_path)
+        self.assertTrue(all(isinstance(place, Place) for place in places.values()))
+
+        written_path = os.path.join(self.folder.name, 'written.json')
+        self.assertEqual(write_places_json(written_path, places), len(PLACES))
+        with open(expected_path, 'rb') as expected, open(written_path, 'rb') as written:
+            self.assertEqual(written.read(), expected.read())
+
+        # an iterable of pairs, dict records and an empty file give the same bytes as json.dump too
+        write_places_json(written_path, ((place_id, details) for place_id, details in PLACES.items()))
+        with open(expected_path, 'rb') as expected, open(written_path, 'rb') as written:
+            self.assertEqual(written.read(), expected.read())
+        write_places_json(written_path, {})
+        with open(written_path, 'r') as file:
+            self.assertEqual(file.read(), json.dumps({}, indent=4))
+
+    def test_in_place_changes_to_packed_fields_are_kept(self):
+        place = Place.from_dict(PLACES['ChIJa'])
+        self.assertIs(place['field_sources'], place['field_sources'])
+        place['field_sources']['name'] = {'source': 'details', 'last_updated': '2024-03-01T00:00:00'}
+        place.setdefault('field_sources', {})['website'] = {'source': 'details', 'last_updated': '2024-03-01T00:00:00'}
+        place['reviews'].append({'author_name': 'Bo', 'rating': 4, 'text': 'good'})
+        self.assertEqual(sorted(place['field_sources']), ['name', 'rating', 'website'])
+
+        # a new packed field assigned to the place keeps the assigned object
+        candidates = []
+        place['menu_link_candidates'] = candidates
+        candidates.append({'url': 'https://uno.example.com/menu', 'score': 5})
+
+        # packing again keeps every change, the next read is a fresh materialization of the same values
+        self.assertEqual(compact_places({'ChIJa': place, 'plain': {'name': 'dict'}}), 3)
+        self.assertEqual(place.compact(), 0)
+        record = place.to_dict()
+        self.assertEqual(sorted(record['field_sources']), ['name', 'rating', 'website'])
+        self.assertEqual(len(record['reviews']), 2)
+        self.assertEqual(record['menu_link_candidates'], [{'url': 'https://uno.example.com/menu', 'score': 5}])
+        self.assertEqual(list(record)[-1], 'menu_link_candidates')
+
+    def test_to_dict_does_not_materialize_the_packed_fields(self):
+        place = Place.from_dict(PLACES['ChIJa'])
+        place.to_dict()
+        self.assertTrue(all(isinstance(value, bytes) for value in place.packed.values()))
+
+if __name__ == '__main__':
+    unittest.main()
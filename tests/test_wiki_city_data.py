@@ -0,0 +1,157 @@
+'''
+
+Tests for the batched Wikipedia fetch of wiki_city_data.py against a local stand-in for api.php.
+
+The stand-in server (http.server on localhost) answers action=query with canned title resolutions / revision ids and action=parse with canned
+wikitext. Some titles fail on purpose: 'Broken Page' returns a body that is not json and 'Dropped Page' closes the connection without a response
+on action=parse, a title batch with 'Dropped Query' closes the connection on action=query.
+
+usage: python -m pytest tests  (or python -m unittest discover tests)
+
+'''
+# IMPORTS ###################################################################################################################################
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+import json
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from wiki_city_data import city_title_key, WikiCityDataResearcher
+import wiki_city_data
+
+# CONSTANTS ###################################################################################################################################
+
+PAGE_WIKITEXT = {
+    'Springfield, Illinois': "'''Springfield''' is the capital.\n{{Infobox settlement\n| name = Springfield\n| population_total = 114,394\n"
+                             "| area_total_sq_mi = 68.0\n| subdivision_name1 = [[Illinois]]\n}}\nMore text.",
+    'Portland, Oregon': "{{Infobox settlement\n| name = Portland\n| population_total = 652,503<ref>census</ref>\n}}",
+}
+PAGE_REVISIONS = {'Springfield, Illinois': 101, 'Portland, Oregon': 202, 'Broken Page': 303, 'Dropped Page': 404}
+REDIRECTS = {'Springfield, IL': 'Springfield, Illinois'}
+
+# CLASSES ###################################################################################################################################
+
+class StandInApiHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        if params.get('action') == 'query':
+            titles = params.get('titles', '').split('|')
+            if 'Dropped Query' in titles:
+                self.close_connection = True
+                return
+            redirects = [{'from': title, 'to': REDIRECTS[title]} for title in titles if title in REDIRECTS]
+            pages = []
+            for title in titles:
+                title = REDIRECTS.get(title, title)
+                if title in PAGE_REVISIONS:
+                    pages.append({'title': title, 'lastrevid': PAGE_REVISIONS[title]})
+                else:
+                    pages.append({'title': title, 'missing': True})
+            self.send_json({'query': {'redirects': redirects, 'pages': pages}})
+        elif params.get('action') == 'parse':
+            title = REDIRECTS.get(params.get('page'), params.get('page'))
+            if title == 'Dropped Page':
+                # no status line at all, the client sees the connection closed
+                self.close_connection = True
+                return
+            if title == 'Broken Page':
+                body = b'<html>upstream error</html>'
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if title not in PAGE_WIKITEXT:
+                self.send_json({'error': {'code': 'missingtitle', 'info': "The page you specified doesn't exist."}})
+                return
+            self.send_json({'parse': {'title': title, 'revid': PAGE_REVISIONS[title], 'wikitext': PAGE_WIKITEXT[title]}})
+        else:
+            self.send_error(400)
+
+class WikiCityDataBatchTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInApiHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def researcher(self):
+        researcher = WikiCityDataResearcher(max_workers=4)
+        researcher.url = f"http://127.0.0.1:{self.server.server_address[1]}/w/api.php"
+        return researcher
+
+    def test_batch_resolves_redirects_and_parses_infoboxes(self):
+        results = self.researcher().fetch_wikipedia_data_batch(['Springfield, IL', 'Portland, Oregon', 'Atlantis'])
+        self.assertEqual(results['Springfield, IL']['name'], 'Springfield')
+        self.assertEqual(results['Springfield, IL']['population_total'], 114394)
+        self.assertEqual(results['Portland, Oregon']['population_total'], 652503)
+        self.assertIsNone(results['Atlantis'])
+
+    def test_failing_titles_do_not_abort_the_batch(self):
+        researcher = self.researcher()
+        infoboxes = researcher.fetch_infoboxes_for_titles(['Springfield, Illinois', 'Broken Page', 'Dropped Page', 'Portland, Oregon'])
+        self.assertEqual(sorted(infoboxes), ['Portland, Oregon', 'Springfield, Illinois'])
+        # the failed pages are not cached, the next run tries them again
+        self.assertNotIn('Broken Page', researcher.infobox_cache)
+        self.assertNotIn('Dropped Page', researcher.infobox_cache)
+
+    def test_failing_title_returns_no_revision(self):
+        researcher = self.researcher()
+        self.assertEqual(researcher.fetch_wikitext_revision('Broken Page'), (None, None))
+        self.assertEqual(researcher.fetch_wikitext_revision('Dropped Page'), (None, None))
+        wikitext, revid = researcher.fetch_wikitext_revision('Portland, Oregon')
+        self.assertEqual(revid, 202)
+        self.assertIn('Infobox settlement', wikitext)
+
+    def test_only_missing_pages_drop_the_saved_title(self):
+        researcher = self.researcher()
+        contexts = {'Springfield': {'state': 'Illinois'}, 'Dropped': {'state': 'Nowhere'}, 'Atlantis': {'state': 'Ocean'}}
+        saved_titles = {'Springfield': 'Springfield, Illinois', 'Dropped': 'Dropped Page', 'Atlantis': 'Atlantis'}
+        for city, title in saved_titles.items():
+            researcher.title_map[city_title_key(city, contexts[city]['state'])] = {'title': title, 'method': 'city_state_title'}
+        results = researcher.fetch_city_infoboxes(contexts)
+        self.assertEqual(results['Springfield']['population_total'], 114394)
+        self.assertIsNone(results['Dropped'])
+        # the dropped connection is transient, the mapping is kept. the page the api reports as missing is resolved again next run
+        self.assertIn(city_title_key('Dropped', 'Nowhere'), researcher.title_map)
+        self.assertNotIn(city_title_key('Atlantis', 'Ocean'), researcher.title_map)
+        self.assertIn(city_title_key('Springfield', 'Illinois'), researcher.title_map)
+
+    def test_dropped_title_batch_does_not_abort_the_resolution(self):
+        researcher = self.researcher()
+        # a single batch that fails leaves its phrases unresolved
+        self.assertEqual(researcher.resolve_titles(['Dropped Query', 'Portland, Oregon']), {})
+        # with one title per batch only the failed batch is lost
+        with mock.patch.object(wiki_city_data, 'TITLES_PER_QUERY', 1):
+            results = researcher.fetch_wikipedia_data_batch(['Dropped Query', 'Portland, Oregon'])
+        self.assertIsNone(results['Dropped Query'])
+        self.assertEqual(results['Portland, Oregon']['population_total'], 652503)
+
+    def test_dropped_disambiguation_request_returns_no_links(self):
+        self.assertEqual(self.researcher().fetch_disambiguation_links('Dropped Query'), [])
+
+if __name__ == '__main__':
+    unittest.main()